@@ -1,383 +1,478 @@
 import requests
-import base64
-from PIL import Image
-import io
 import os
 from dotenv import load_dotenv
 import json
 import sys
-import time
-import re
+import contextlib
 from uuid import uuid4
 
+import openrouter_client
+import result_cache
+import near_duplicate
+import image_preprocess
+import markdown_normalizer
+import answer_postprocess
+import extraction_parser
+import rate_limiter
+import stage_metrics
+import solve_prompts
+
 load_dotenv()
 sys.stdout.reconfigure(encoding='utf-8')
 
-OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
 DEEPSEEK_MODEL_NAME = "deepseek/deepseek-chat"
 GEMINI_MODEL_NAME = "google/gemini-flash-1.5-8b"
+# "local" formats answers with markdown_normalizer and only calls Gemini when the result fails validation;
+# "llm" always uses the Gemini reformat pass.
+REFORMAT_MODE = os.getenv("OCR_REFORMAT_MODE", "local").lower()
+# When the DeepSeek solve call has not produced its first token after HEDGE_AFTER seconds, the same request is also
+# sent to HEDGE_MODEL (DeepSeek again by default, which OpenRouter may route to another provider) and the first to
+# start answering is used, for streamed and non-streamed solves alike. 0 turns hedging off.
+HEDGE_AFTER = float(os.getenv("OCR_HEDGE_AFTER", "0"))
+HEDGE_MODEL = os.getenv("OCR_HEDGE_MODEL", DEEPSEEK_MODEL_NAME)
 
-def get_question_and_options(image_path, api_key, max_retries=3, base_delay=2):
+def get_question_and_options(image_path, api_key, max_retries=3, base_delay=2, priority=rate_limiter.PRIORITY_INTERACTIVE):
     """
     Extracts the question, diagram information, options, option type and question type from an image using google/gemini-flash-1.5-8b model.
+
+    Rate limits and transient failures are retried by openrouter_client up to max_retries attempts; priority decides
+    the order in which the shared rate limiter admits requests (see rate_limiter).
+    """
+    prepared = prepare_image(image_path)
+    if isinstance(prepared, str):
+        return prepared
+    return extract_question(prepared, api_key, max_retries, base_delay, priority)
+
+
+def prepare_image(image_path):
     """
+    The local, CPU-bound half of get_question_and_options: fingerprints the image, looks it up in the extraction cache
+    and, on a miss, preprocesses and encodes it for the vision model.
 
+    Returns a dict with "extraction" (the cached extraction, or None), "image_url", "image_key", "image_hash" and
+    "image_detail", or an error string.
+    """
     if not os.path.exists(image_path):
         return "Error: Image file does not exist."
 
-    for attempt in range(max_retries):
-        try:
-            image = Image.open(image_path)
-            if image.mode == "RGBA":
-                image = image.convert("RGB")
-
-            image_buffer = io.BytesIO()
-            image.save(image_buffer, format="PNG")
-            image_base64 = base64.b64encode(image_buffer.getvalue()).decode("utf-8")
-            image_url = f"data:image/png;base64,{image_base64}"
-
-            headers = {
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json"
-            }
-
-            payload = {
-                "model": GEMINI_MODEL_NAME,
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": """
-                                    **Objective:** Analyze the provided image and extract the question, diagram information, answer options, options type, and question type with high accuracy.
-
-                                    **Instructions:**
-
-                                    **1. Question Identification and Extraction:**
-                                        * Identify the core question. Preserve any original formatting (bold, italics, etc.).
-                                        * If no question is found, state "Question: No question found."
-                                         * **Matrix Match Extraction:**
-                                                * If the question is a matrix-match, output the question as a list of two lists, list 1 representing the first column and list 2 the second column. For example:
-                                                 ```
-                                                 [['A', 'B', 'C'], ['1', '2', '3']]
-                                                ```
-                                                 * Preserve any original formatting, including bolding, italics, and special characters, within the list.
-                                         *   **Paragraph Question Extraction:**
-                                                * If the question is a paragraph question, extract the paragraph followed by each of the questions that are associated with the paragraph.
-                                                *  Output the paragraph as a single string and the questions as a list.
-                                                *   Preserve any original formatting within the paragraph and the questions.
-                                    **2. Diagram Description (If Present):**
-                                        * Identify the type of diagram (bar, pie, flowchart, etc.).
-                                        * Provide a detailed description using Markdown (axes, labels, shapes, etc.).
-                                         * If no diagram is present, state "Diagram: No diagram found."
-                                    **3. Option Extraction (If Present):**
-                                        * Extract each option, including letter and text. Preserve original formatting.
-                                        * Format the options using Markdown with bullet points.
-                                        * If no options are present state "Options: No options found."
-                                    **4. Option Type:**
-                                        * Determine if the question is single-select or multi-select.
-                                         * If no options are present return `Options Type: No options`.
-                                        * If the option type is multi select, explicitly state `"Options Type: Multi-select"`.
-                                        * If the option type is single select, explicitly state `"Options Type: Single-select"`.
-                                    **5. Question Type Extraction:**
-                                        * Based on the question identify the type of question. Possible question types include:
-                                               - Multiple Choice Question
-                                               - Numerical Question
-                                               - Open Ended Question
-                                               - Diagram Question
-                                               - Matrix Match Question
-                                               - Paragraph Question
-                                        * If no question is found return **"Question Type: No question"**
-
-                                    **Output Format:**
-                                        *   Start with: **Question Extraction:**
-                                        *   Follow with the extracted question in Markdown format or "Question: No question found."
-                                        *   Start a new line with **Diagram Description:**
-                                        *   Follow with a detailed diagram description in Markdown format or "Diagram: No diagram found."
-                                        *   Start a new line with **Option Extraction:**
-                                        *   Follow with the extracted options in Markdown format or "Options: No options found.".
-                                        *   Start a new line with **Option Type:**
-                                        *   Follow with the options type.
-                                        *    Start a new line with **Question Type:**
-                                        *    Follow with the question type.
-                                        *   Do not include any additional introductory or concluding remarks.
-                                """
-                            },
-                             {
-                                 "type": "image_url",
-                                 "image_url": {
-                                     "url": image_url
-                                 }
-                              }
-                        ]
-                    }
-                ],
-                "max_tokens": 8000
-            }
-
-            response = requests.post(OPENROUTER_API_URL, headers=headers, json=payload, timeout=30)
-
-            if response.status_code == 200:
-                json_response = response.json()
-                if json_response and 'choices' in json_response and json_response['choices']:
-                    extracted_content = json_response['choices'][0]['message']['content']
-                    parts = extracted_content.split("Diagram Description:")
-                    if len(parts) > 1:
-                        question_and_options = parts[0].strip()
-                        diagram_and_options = parts[1].strip()
-                        parts2 = diagram_and_options.split("Option Extraction:")
-                        if len(parts2) > 1:
-                            diagram = parts2[0].strip()
-                            options_and_type = parts2[1].strip()
-                            parts3 = options_and_type.split("Option Type:")
-                            if len(parts3) > 1:
-                                options = parts3[0].strip()
-                                options_and_question = parts3[1].strip()
-                                parts4 = options_and_question.split("Question Type:")
-                                if len(parts4) > 1:
-                                    options_type = parts4[0].strip()
-                                    question_type = parts4[1].strip()
-                                    return {"question": question_and_options, "diagram": diagram, "options": options, "options_type": options_type, "question_type": question_type}
-                                else:
-                                   options_type = parts4[0].strip()
-                                   return {"question": question_and_options, "diagram": diagram, "options": options, "options_type": options_type, "question_type": ""}
-                            else:
-                                options = parts3[0].strip()
-                                return {"question": question_and_options, "diagram": diagram, "options": options, "options_type": "", "question_type": ""}
-                        else:
-                            diagram = parts2[0].strip()
-                            return {"question": question_and_options, "diagram": diagram, "options": "", "options_type": "", "question_type": ""}
-                    else:
-                        question_and_options = parts[0].strip()
-                        return {"question": question_and_options, "diagram": "", "options": "", "options_type": "", "question_type": ""}
-                else:
-                  print("Error: No valid response from Gemini model")
-                  return "Error: No valid response from Gemini model"
+    extraction_cache = result_cache.get_extraction_cache()
+    duplicate_index = near_duplicate.get_index()
+    with stage_metrics.stage("fingerprint"):
+        image_key, image_hash, image_detail = near_duplicate.image_fingerprints(image_path) if extraction_cache is not None else (None, None, None)
+    if image_key:
+        cached_extraction = extraction_cache.get(image_key)
+        if cached_extraction is None and duplicate_index is not None and image_hash is not None and image_detail is not None:
+            match = duplicate_index.find(image_hash, image_detail)
+            if match is not None:
+                cached_extraction = extraction_cache.get(match[0])
+                if cached_extraction is None:
+                    duplicate_index.remove(match[0])
+        if cached_extraction is not None:
+            stage_metrics.record("extract", cache_hits=1)
+            return {"extraction": cached_extraction, "image_url": None, "image_key": image_key, "image_hash": image_hash,
+                    "image_detail": image_detail}
+
+    try:
+        with stage_metrics.stage("encode"):
+            image_url, image_stats = image_preprocess.encode_image_file(image_path)
+    except Exception as e:
+        print(f"Error: Could not read image: {e}")
+        return f"Error: Could not read image: {e}"
+    stage_metrics.record("encode", original_bytes=image_stats["original_bytes"], payload_bytes=image_stats["payload_bytes"])
+    return {"extraction": None, "image_url": image_url, "image_key": image_key, "image_hash": image_hash,
+            "image_detail": image_detail}
+
+
+def extract_question(prepared, api_key, max_retries=3, base_delay=2, priority=rate_limiter.PRIORITY_INTERACTIVE):
+    """
+    The remote half of get_question_and_options: sends an image from prepare_image to the vision model, then parses
+    and caches the reply.
+    """
+    if prepared["extraction"] is not None:
+        return prepared["extraction"]
+
+    image_url, image_key, image_hash, image_detail = (prepared["image_url"], prepared["image_key"], prepared["image_hash"],
+                                                      prepared["image_detail"])
+    extraction_cache = result_cache.get_extraction_cache()
+    duplicate_index = near_duplicate.get_index()
+    try:
+        payload = {
+            "model": GEMINI_MODEL_NAME,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "text",
+                            "text": """
+                                **Objective:** Analyze the provided image and extract the question, diagram information, answer options, options type, and question type with high accuracy.
+
+                                **Instructions:**
+
+                                **1. Question Identification and Extraction:**
+                                    * Identify the core question. Preserve any original formatting (bold, italics, etc.).
+                                    * If no question is found, state "Question: No question found."
+                                     * **Matrix Match Extraction:**
+                                            * If the question is a matrix-match, output the question as a list of two lists, list 1 representing the first column and list 2 the second column. For example:
+                                             ```
+                                             [['A', 'B', 'C'], ['1', '2', '3']]
+                                            ```
+                                             * Preserve any original formatting, including bolding, italics, and special characters, within the list.
+                                     *   **Paragraph Question Extraction:**
+                                            * If the question is a paragraph question, extract the paragraph followed by each of the questions that are associated with the paragraph.
+                                            *  Output the paragraph as a single string and the questions as a list.
+                                            *   Preserve any original formatting within the paragraph and the questions.
+                                **2. Diagram Description (If Present):**
+                                    * Identify the type of diagram (bar, pie, flowchart, etc.).
+                                    * Provide a detailed description using Markdown (axes, labels, shapes, etc.).
+                                     * If no diagram is present, state "Diagram: No diagram found."
+                                **3. Option Extraction (If Present):**
+                                    * Extract each option, including letter and text. Preserve original formatting.
+                                    * Format the options using Markdown with bullet points.
+                                    * If no options are present state "Options: No options found."
+                                **4. Option Type:**
+                                    * Determine if the question is single-select or multi-select.
+                                     * If no options are present return `Options Type: No options`.
+                                    * If the option type is multi select, explicitly state `"Options Type: Multi-select"`.
+                                    * If the option type is single select, explicitly state `"Options Type: Single-select"`.
+                                **5. Question Type Extraction:**
+                                    * Based on the question identify the type of question. Possible question types include:
+                                           - Multiple Choice Question
+                                           - Numerical Question
+                                           - Open Ended Question
+                                           - Diagram Question
+                                           - Matrix Match Question
+                                           - Paragraph Question
+                                    * If no question is found return **"Question Type: No question"**
+
+                                **Output Format:**
+                                    *   Start with: **Question Extraction:**
+                                    *   Follow with the extracted question in Markdown format or "Question: No question found."
+                                    *   Start a new line with **Diagram Description:**
+                                    *   Follow with a detailed diagram description in Markdown format or "Diagram: No diagram found."
+                                    *   Start a new line with **Option Extraction:**
+                                    *   Follow with the extracted options in Markdown format or "Options: No options found.".
+                                    *   Start a new line with **Option Type:**
+                                    *   Follow with the options type.
+                                    *    Start a new line with **Question Type:**
+                                    *    Follow with the question type.
+                                    *   Do not include any additional introductory or concluding remarks.
+                            """
+                        },
+                         {
+                             "type": "image_url",
+                             "image_url": {
+                                 "url": image_url
+                             }
+                          }
+                    ]
+                }
+            ],
+            "max_tokens": 8000
+        }
+
+        response = openrouter_client.post_chat(payload, api_key, priority=priority, max_retries=max_retries, base_delay=base_delay)
+
+        if response.status_code == 200:
+            json_response = response.json()
+            stage_metrics.record_call("extract", response, json_response.get("usage") if json_response else None)
+            if json_response and 'choices' in json_response and json_response['choices']:
+                extracted_content = json_response['choices'][0]['message']['content']
+                extracted = extraction_parser.parse_extraction(extracted_content).as_dict()
+                if extraction_cache is not None and image_key:
+                    extraction_cache.put(image_key, extracted)
+                    if duplicate_index is not None and image_hash is not None and image_detail is not None:
+                        duplicate_index.add(image_hash, image_key, image_detail)
+                return extracted
             else:
-              print(f"Error: HTTP Request failed (Gemini model): {response.status_code}")
-              return f"Error: HTTP Request failed (Gemini model): {response.status_code}"
-
-
-        except requests.exceptions.RequestException as e:
-            if response and response.status_code == 429:
-                wait_time = base_delay * (2**attempt)
-                print(f"Rate limited (google/gemini-flash-1.5-8b model). Retrying in {wait_time} seconds (attempt {attempt + 1}/{max_retries})...")
-                time.sleep(wait_time)
-                continue
-            print(f"Error: HTTP Request failed (google/gemini-flash-1.5-8b model): {e}")
-            return f"Error: HTTP Request failed (google/gemini-flash-1.5-8b model): {e}"
-        except Exception as e:
-            print(f"Error: An unexpected error occurred (google/gemini-flash-1.5-8b model): {e}")
-            return f"Error: An unexpected error occurred (google/gemini-flash-1.5-8b model): {e}"
-    
-    print("Error: Max retries reached (google/gemini-flash-1.5-8b model), unable to get a response.")
-    return "Error: Max retries reached (google/gemini-flash-1.5-8b model), unable to get a response."
-
-
-def get_answer_from_question(question, diagram, options, options_type, question_type, api_key, max_retries=3, base_delay=2):
+              print("Error: No valid response from Gemini model")
+              return "Error: No valid response from Gemini model"
+        else:
+          stage_metrics.record_call("extract", response)
+          print(f"Error: HTTP Request failed (Gemini model): {response.status_code}")
+          return f"Error: HTTP Request failed (Gemini model): {response.status_code}"
+
+    except requests.exceptions.RequestException as e:
+        print(f"Error: HTTP Request failed (google/gemini-flash-1.5-8b model): {e}")
+        return f"Error: HTTP Request failed (google/gemini-flash-1.5-8b model): {e}"
+    except Exception as e:
+        print(f"Error: An unexpected error occurred (google/gemini-flash-1.5-8b model): {e}")
+        return f"Error: An unexpected error occurred (google/gemini-flash-1.5-8b model): {e}"
+
+
+def _collect_stream(deltas, on_token):
     """
-    Answers the extracted question using deepseek/deepseek-chat model and reformats the response using google/gemini-flash-1.5-8b model.
+    Passes each streamed text delta to on_token as it arrives and returns the full text, or "" if nothing came back.
     """
-    for attempt in range(max_retries):
-        try:
-            headers = {
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json"
-            }
-
-            deepseek_payload = {
-                "model": DEEPSEEK_MODEL_NAME,
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": (
-                            "Solve the following problem step-by-step. Provide a detailed explanation of each step, including all necessary equations (if applicable).\n\n"
-                            "**Context:**\n"
-                            f"* Consider this diagram information when solving the question:\n"
-                            f"    {diagram}\n"
-                            f"* These are the possible answer options:\n"
-                            f"    {options}\n"
-                            f"* This is the option type for this question:\n"
-                            f"    {options_type}\n"
-                            f"* This is the question type:\n"
-                            f"    {question_type}\n\n"
-                            "**Format Instructions:**\n\n"
-                            "*   **Equations:** Enclose all mathematical equations using the delimiter `$$...$$`. For example: $$E=mc^2$$\n"
-                            "*   **Reasoning Step:** Before each step, clearly state the reasoning behind it, starting with 'Reasoning Step:'.\n"
-                            "*  **Paragraph Question Logic:** If the question type is \"Paragraph Question\" use the following logic:\n"
-                            "      * First extract the paragraph and questions from the question string, if this fails assume the question is the paragraph and there are no questions.\n"
-                            "      * If extraction is successful:\n"
-                            "        *  Try to extract the paragraph, if this fails assume the paragraph is an empty string\n"
-                            "        *  Try to extract the questions, if this fails assume there are no questions.\n"
-                            f"        * The paragraph is: {question.split('Paragraph:')[1].split('Questions:')[0].strip() if 'Paragraph:' in question and 'Questions:' in question else ''}\n"
-                            f"        * The questions are: {question.split('Questions:')[1].strip() if 'Questions:' in question else ''}\n"
-                            "       * For each question, use the paragraph for context.\n"
-                            "        * Answer each question individually, using the paragraph to provide a response.\n"
-                            "      * If extraction is unsuccessful:\n"
-                            "        * Assume the question is the paragraph and there are no questions.\n\n"
-                            "*   **Matrix Match Logic:** If the question type is \"Matrix Match Question\" use the following logic:\n"
-                            "        *   Use a step-by-step approach, matching each item from the first list with the corresponding item from the second list.\n"
-                            "        *  State your reasoning behind each match.\n"
-                            "        *   Format your answer as a list of tuples, showing the matches. For example: `[('A', '1'), ('B', '2'), ('C', '3')]`\n"
-                            "*   **Step-by-step:** Use a numbered list to structure the explanation of your solution process.\n"
-                            "*   **Option Analysis:** If options (A, B, C, D) are provided:\n"
-                            "    * For **single-select** questions, rigorously analyze each option using your calculations or reasoning. Clearly state whether each option is correct or incorrect and explain why. Select only one option.\n"
-                            "    * For **multi-select** questions, analyze each option and explicitly state if it's correct or incorrect, explaining the reasoning. Select all correct options.\n"
-                            "*   **Final Answer:**\n"
-                            "    * For single select questions, when options are available, select one of the provided options as the final answer based on your analysis. State your answer using the format: 'The correct answer is: [option letter]'.\n"
-                            "    * For multi select questions, list all of the correct options. State the answer using the format: 'The correct answers are: [option letters]'.\n"
-                            "    * For matrix match questions, provide your answer as list of tuples.\n"
-                            "    * For paragraph questions, answer each question individually.\n"
-                            "    * For numerical questions provide the numerical answer along with the correct units.\n"
-                            "    * For open ended questions, answer in a paragraph.\n\n"
-                            "**Example Output Structure:**\n"
-                            "**Assumptions:** [Assumptions made to solve the problem]\n"
-                            "For Paragraph Questions:\n"
-                            "    **Paragraph:** [Extracted paragraph]\n"
-                            "    **Question 1:** [Answer to Question 1]\n"
-                            "    **Question 2:** [Answer to Question 2]\n"
-                            "    ...\n\n"
-                            "For Matrix Match Questions:\n"
-                            "    **Reasoning Step:** [Reasoning]\n"
-                            "    **Steps:**\n"
-                            "      1. [Explanation of Step 1]\n"
-                            "      2. [Explanation of Step 2]\n"
-                            "    **Final Answer:** [List of tuples]\n\n"
-                            "For other questions:\n"
-                            "    **Reasoning Step:** [Reasoning]\n"
-                            "    **Steps:**\n"
-                            "    1. [Explanation of Step 1 including equations or reasoning]\n\n"
-                            "    **Reasoning Step:** [Reasoning]\n"
-                            "    2. [Explanation of Step 2 including equations or reasoning]\n"
-                            "    ...\n\n"
-                            "    **Option Analysis Example:**\n"
-                            "    A: [Correct or Incorrect, Explanation]\n"
-                            "    B: [Correct or Incorrect, Explanation]\n"
-                            "    C: [Correct or Incorrect, Explanation]\n"
-                            "    D: [Correct or Incorrect, Explanation]\n\n"
-                            "**Final Answer Example:**\n"
-                            "   * Single Select Question: The correct answer is: [option letter]\n"
-                            "   * Multi Select Question: The correct answers are: [option letters]\n"
-                            "    * Matrix Match Question: [List of tuples]\n"
-                            "    * Paragraph Question:  [Answer to each question]\n"
-                            "   * Numerical Question: [Numerical Answer]\n"
-                            "   * Open Ended Question: [Answer paragraph]\n\n"
-                            "**Constraints:**\n"
-                            "* Do not include any introductory or concluding remarks. Start directly with the solution.\n"
-                            "* If multiple options are given always choose one or more of the given options.\n"
-                            "* If no options are given, just solve the question without selecting an option.\n"
-                            "* For Paragraph questions only use the given paragraph to answer each of the given questions.\n\n"
-                            f"**Question:** {question}"
-                        )
-                    }
-                ],
-                "max_tokens": 8000
-            }
-
-            response = requests.post(OPENROUTER_API_URL, headers=headers, json=deepseek_payload, timeout=30)
-            if response.status_code == 200:
+    streamed = []
+    for delta in deltas:
+        streamed.append(delta)
+        on_token(delta)
+    return "".join(streamed) + "\n" if streamed else ""
+
+
+def get_answer_from_question(question, diagram, options, options_type, question_type, api_key, max_retries=3, base_delay=2, on_token=None,
+                             priority=rate_limiter.PRIORITY_INTERACTIVE):
+    """
+    Answers the extracted question using deepseek/deepseek-chat model and formats the response locally, falling back to
+    reformatting it with google/gemini-flash-1.5-8b model when the local result fails validation (see REFORMAT_MODE).
+
+    If on_token is given, the deepseek answer is streamed and on_token is called with each piece of raw text as it arrives.
+    The return value is still the complete reformatted answer. max_retries, base_delay and priority are passed on to
+    openrouter_client as in get_question_and_options.
+    """
+    cached_answer = lookup_answer(question, diagram, options, options_type, question_type)
+    if cached_answer is not None:
+        return cached_answer
+
+    raw_answer = solve_question(question, diagram, options, options_type, question_type, api_key, max_retries, base_delay, on_token, priority)
+    if raw_answer.startswith("Error:"):
+        return raw_answer
+
+    answer = format_answer(raw_answer, api_key, max_retries, base_delay, priority)
+    if not answer.startswith("Error:"):
+        store_answer(question, diagram, options, options_type, question_type, answer)
+    return answer
+
+
+def lookup_answer(question, diagram, options, options_type, question_type):
+    """
+    Returns the cached formatted answer to an extracted question, or None.
+    """
+    answer_cache = result_cache.get_answer_cache()
+    if answer_cache is None:
+        return None
+    cached_answer = answer_cache.get(result_cache.answer_cache_key(question, diagram, options, options_type, question_type))
+    if cached_answer is not None:
+        stage_metrics.record("solve", cache_hits=1)
+    return cached_answer
+
+
+def store_answer(question, diagram, options, options_type, question_type, answer):
+    answer_cache = result_cache.get_answer_cache()
+    if answer_cache is not None:
+        answer_cache.put(result_cache.answer_cache_key(question, diagram, options, options_type, question_type), answer)
+
+
+def solve_question(question, diagram, options, options_type, question_type, api_key, max_retries=3, base_delay=2, on_token=None,
+                   priority=rate_limiter.PRIORITY_INTERACTIVE):
+    """
+    Sends the extracted question to deepseek/deepseek-chat model and returns its raw, unformatted answer, or an error string.
+    """
+    try:
+        deepseek_payload = {
+            "model": DEEPSEEK_MODEL_NAME,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": solve_prompts.build_solve_prompt(question, diagram, options, options_type, question_type),
+                }
+            ],
+            "max_tokens": 8000
+        }
+
+        streamed = on_token is not None or HEDGE_AFTER > 0
+        if HEDGE_AFTER > 0:
+            # Hedging races to the first token even when nothing is streamed to the user: a hedge sent while the
+            # primary is still generating would restart the answer from scratch and double the cost.
+            response, deltas = openrouter_client.hedged_stream_chat(
+                deepseek_payload, api_key, HEDGE_AFTER, {**deepseek_payload, "model": HEDGE_MODEL},
+                priority=priority, max_retries=max_retries, base_delay=base_delay,
+            )
+            if response.hedged:
+                stage_metrics.record("solve", hedges=1, hedge_wins=int(response.hedge_won))
+        elif on_token is not None:
+            response, deltas = openrouter_client.stream_chat(deepseek_payload, api_key, priority=priority, max_retries=max_retries, base_delay=base_delay)
+        else:
+            response = openrouter_client.post_chat(deepseek_payload, api_key, priority=priority, max_retries=max_retries, base_delay=base_delay)
+        if response.status_code == 200:
+            deepseek_answer = ""
+            if streamed:
+                deepseek_answer = _collect_stream(deltas, on_token or (lambda delta: None))
+                stage_metrics.record_call("solve", response, response.usage)
+            else:
                 json_response = response.json()
+                stage_metrics.record_call("solve", response, json_response.get("usage") if json_response else None)
                 if json_response and 'choices' in json_response and json_response['choices']:
-                    deepseek_answer = ""
                     for i in range(len(json_response['choices'])):
                         deepseek_answer += json_response['choices'][i]['message']['content'] + "\n"
-                    deepseek_answer = re.sub(r'\\\((.*?)\\\)', r'\1', deepseek_answer)
-                else:
-                    print("Error: No valid response from Deepseek model")
-                    return "Error: No valid response from Deepseek model"
+            if deepseek_answer:
+                return deepseek_answer
             else:
-                print(f"Error: HTTP Request failed (Deepseek model): {response.status_code}")
-                return f"Error: HTTP Request failed (Deepseek model): {response.status_code}"
-            
-            gemini_payload = {
-                "model": GEMINI_MODEL_NAME,
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": f"""
-                            Correct any formatting errors in the following text and reformat it so it's properly rendered on an educational website using markdown. Use the following guidelines:
-                                1. Use ``` only for actual code blocks, not for equations
-                                2. Use ** for bold text
-                                3. Use * for italics
-                                4. Use - for bullet points
-                                5. For section headers:
-                                    - Use ## for main sections
-                                    - Use ### for subsections
-                                    - Ensure proper spacing before and after headers
-                                6. Separate chemical structures from text using clear labels
-                                7. For mathematical equations:
-                                    - Use $$...$$ for display equations
-                                    - Use $...$ for inline equations
-                                    - Never use code blocks (```) for equations
-                                    - Preserve all LaTeX commands and environments
-                                    - Ensure proper spacing around equations
-                            Here is the text to format: {deepseek_answer}
-                        """
-                    }
-                ],
-                "max_tokens": 8000
-            }
-
-            gemini_response = requests.post(OPENROUTER_API_URL, headers=headers, json=gemini_payload, timeout=30)
-            if gemini_response.status_code == 200:
-                gemini_json_response = gemini_response.json()
-                if gemini_json_response and 'choices' in gemini_json_response and gemini_json_response['choices']:
-                    corrected_answer = gemini_json_response['choices'][0]['message']['content']
-                    corrected_answer = re.sub(r'(?<!\$)\$([^$]+?)\$(?!\$)', r' $\1$ ', corrected_answer)
-                    corrected_answer = re.sub(r'\$\$([^$]+?)\$\$', r'$$\1$$', corrected_answer)
-                    corrected_answer = re.sub(r'  +', ' ', corrected_answer)
-                    corrected_answer = re.sub(r'\$\$\s*([^$]+?)\s*\$\$', r'$$\1$$', corrected_answer)
-                    corrected_answer = re.sub(r'\\begin\{([^}]+)\}(.*?)\\end\{\1\}', r'\\begin{\1}\2\\end{\1}', corrected_answer, flags=re.DOTALL)
-                    
-                    return corrected_answer
-                else:
-                    print("Error: No valid response from Gemini model")
-                    return "Error: No valid response from Gemini model"
+                print("Error: No valid response from Deepseek model")
+                return "Error: No valid response from Deepseek model"
+        else:
+            stage_metrics.record_call("solve", response)
+            print(f"Error: HTTP Request failed (Deepseek model): {response.status_code}")
+            return f"Error: HTTP Request failed (Deepseek model): {response.status_code}"
+
+    except requests.exceptions.RequestException as e:
+        print(f"Error: HTTP Request failed (Deepseek model): {e}")
+        return f"Error: HTTP Request failed (Deepseek model): {e}"
+    except Exception as e:
+        print(f"Error: An unexpected error occurred (Deepseek model): {e}")
+        return f"Error: An unexpected error occurred (Deepseek model): {e}"
+
+
+def format_answer(raw_answer, api_key, max_retries=3, base_delay=2, priority=rate_limiter.PRIORITY_INTERACTIVE):
+    """
+    Formats a raw solver answer for the website: locally with markdown_normalizer, or with google/gemini-flash-1.5-8b
+    model when REFORMAT_MODE is "llm" or the local result fails validation. Returns the answer or an error string.
+    """
+    if REFORMAT_MODE == "local":
+        with stage_metrics.stage("reformat"):
+            local_answer = markdown_normalizer.normalize_markdown(raw_answer)
+            problems = markdown_normalizer.validate_markdown(local_answer)
+        if not problems:
+            return answer_postprocess.postprocess_answer(local_answer)
+        print(f"Warning: Local formatting failed validation ({'; '.join(problems)}), falling back to the Gemini reformat pass", file=sys.stderr)
+
+    deepseek_answer = answer_postprocess.strip_inline_parens(raw_answer)
+    try:
+        gemini_payload = {
+            "model": GEMINI_MODEL_NAME,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": f"""
+                        Correct any formatting errors in the following text and reformat it so it's properly rendered on an educational website using markdown. Use the following guidelines:
+                            1. Use ``` only for actual code blocks, not for equations
+                            2. Use ** for bold text
+                            3. Use * for italics
+                            4. Use - for bullet points
+                            5. For section headers:
+                                - Use ## for main sections
+                                - Use ### for subsections
+                                - Ensure proper spacing before and after headers
+                            6. Separate chemical structures from text using clear labels
+                            7. For mathematical equations:
+                                - Use $$...$$ for display equations
+                                - Use $...$ for inline equations
+                                - Never use code blocks (```) for equations
+                                - Preserve all LaTeX commands and environments
+                                - Ensure proper spacing around equations
+                        Here is the text to format: {deepseek_answer}
+                    """
+                }
+            ],
+            "max_tokens": 8000
+        }
+
+        gemini_response = openrouter_client.post_chat(gemini_payload, api_key, priority=priority, max_retries=max_retries, base_delay=base_delay)
+        if gemini_response.status_code == 200:
+            gemini_json_response = gemini_response.json()
+            stage_metrics.record_call("reformat", gemini_response, gemini_json_response.get("usage") if gemini_json_response else None)
+            if gemini_json_response and 'choices' in gemini_json_response and gemini_json_response['choices']:
+                return answer_postprocess.postprocess_answer(gemini_json_response['choices'][0]['message']['content'])
             else:
-                print(f"Error: HTTP Request failed (Gemini model): {gemini_response.status_code}")
-                return f"Error: HTTP Request failed (Gemini model): {gemini_response.status_code}"
+                print("Error: No valid response from Gemini model")
+                return "Error: No valid response from Gemini model"
+        else:
+            stage_metrics.record_call("reformat", gemini_response)
+            print(f"Error: HTTP Request failed (Gemini model): {gemini_response.status_code}")
+            return f"Error: HTTP Request failed (Gemini model): {gemini_response.status_code}"
+
+    except requests.exceptions.RequestException as e:
+        print(f"Error: HTTP Request failed (google/gemini-flash-1.5-8b model): {e}")
+        return f"Error: HTTP Request failed (google/gemini-flash-1.5-8b model): {e}"
+    except Exception as e:
+        print(f"Error: An unexpected error occurred (google/gemini-flash-1.5-8b model): {e}")
+        return f"Error: An unexpected error occurred (google/gemini-flash-1.5-8b model): {e}"
 
-        except requests.exceptions.RequestException as e:
-            if response and response.status_code == 429:
-                wait_time = base_delay * (2**attempt)
-                print(f"Rate limited (Deepseek model). Retrying in {wait_time} seconds (attempt {attempt + 1}/{max_retries})...")
-                time.sleep(wait_time)
-                continue
-            print(f"Error: HTTP Request failed (Deepseek model): {e}")
-            return f"Error: HTTP Request failed (Deepseek model): {e}"
-        except Exception as e:
-            print(f"Error: An unexpected error occurred (Deepseek model): {e}")
-            return f"Error: An unexpected error occurred (Deepseek model): {e}"
 
-    print("Error: Max retries reached (Deepseek model), unable to get an answer.")
-    return "Error: Max retries reached (Deepseek model), unable to get an answer."
+def solve_image(image_path, api_key, on_token=None):
+    """
+    Runs the full extraction and solve flow for one image and returns the text to show the user.
+
+    on_token is passed through to get_answer_from_question to stream the raw answer while it is generated.
+    """
+    question_and_options = get_question_and_options(image_path, api_key)
+    if "Error:" in question_and_options:
+        return question_and_options
+    if not isinstance(question_and_options, dict):
+        return question_and_options
+
+    question_string = question_and_options.get("question", "").strip()
+    diagram_string = question_and_options.get("diagram", "").strip()
+    options_string = question_and_options.get("options", "").strip()
+    options_type = question_and_options.get("options_type", "").strip()
+    question_type = question_and_options.get("question_type", "").strip()
+
+    answer = get_answer_from_question(question_string, diagram_string, options_string, options_type, question_type, api_key, on_token=on_token)
+    if "Error:" in answer:
+        return answer
+    return f"{diagram_string}\n\n{answer}"
+
+
+def _write_message(stream, message):
+    stream.write(json.dumps(message, ensure_ascii=False) + "\n")
+    stream.flush()
+
+
+def serve(api_key):
+    """
+    Long-lived worker mode. Reads newline-delimited JSON jobs from stdin and writes one JSON result per line to stdout.
+
+    Job:    {"id": "<job id>", "image_path": "<path>", "api_key": "<optional override>", "stream": <optional bool>}
+    Token:  {"id": "<job id>", "event": "token", "text": "<raw answer text>"}   (only for jobs with "stream": true)
+    Result: {"id": "<job id>", "ok": true, "output": "<text>"} or {"id": "<job id>", "ok": false, "error": "<message>"}
+
+    Results also carry "metrics": the per-stage timings, bytes and token counts collected by stage_metrics.
+    With OCR_PROFILE_DIR set, each job is profiled with cProfile and dumped to <OCR_PROFILE_DIR>/<job id>.prof.
+
+    Anything the solve functions print is redirected to stderr so stdout only ever carries protocol messages.
+    """
+    protocol_out = sys.stdout
+    # Load the near-duplicate index (a few seconds per million stored images) before taking jobs, not inside one.
+    with contextlib.redirect_stdout(sys.stderr):
+        near_duplicate.get_index()
+    _write_message(protocol_out, {"event": "ready", "pid": os.getpid()})
+
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            job = json.loads(line)
+        except json.JSONDecodeError as e:
+            _write_message(protocol_out, {"id": None, "ok": False, "error": f"Error: Invalid job: {e}"})
+            continue
+
+        job_id = job.get("id")
+        image_path = job.get("image_path")
+        if not image_path:
+            _write_message(protocol_out, {"id": job_id, "ok": False, "error": "Error: Job is missing image_path."})
+            continue
+
+        on_token = None
+        if job.get("stream"):
+            def on_token(text, job_id=job_id):
+                _write_message(protocol_out, {"id": job_id, "event": "token", "text": text})
+
+        with stage_metrics.collect() as metrics:
+            try:
+                with contextlib.redirect_stdout(sys.stderr), stage_metrics.profile(job_id):
+                    output = solve_image(image_path, job.get("api_key") or api_key, on_token=on_token)
+                result = {"id": job_id, "ok": True, "output": output}
+            except Exception as e:
+                print(f"Error: An unexpected error occurred while processing job {job_id}: {e}", file=sys.stderr)
+                result = {"id": job_id, "ok": False, "error": f"Error: An unexpected error occurred: {e}"}
+        _write_message(protocol_out, {**result, "metrics": metrics.as_dict()})
 
 
 if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "--serve":
+        serve(sys.argv[2] if len(sys.argv) > 2 else os.getenv("OPENROUTER_API_KEY"))
+        sys.exit(0)
+
     if len(sys.argv) != 4:
         print("Usage: python OCR.py <image_path> <hyperbolic_api_key> <openrouter_api_key>")
+        print("       python OCR.py --serve [openrouter_api_key]")
         sys.exit(1)
 
     image_file_path = sys.argv[1]
     hyperbolic_api_key = sys.argv[2]
     openRouterApiKey = sys.argv[3]
 
-    question_and_options = get_question_and_options(image_file_path, openRouterApiKey)
-    if "Error:" in question_and_options:
-        print(question_and_options)
-    else:
-        if isinstance(question_and_options, dict):
-                question_string = question_and_options.get("question", "").strip()
-                diagram_string = question_and_options.get("diagram", "").strip()
-                options_string = question_and_options.get("options", "").strip()
-                options_type = question_and_options.get("options_type", "").strip()
-                question_type = question_and_options.get("question_type", "").strip()
-                
-                answer = get_answer_from_question(question_string, diagram_string, options_string, options_type, question_type, openRouterApiKey)
-                if "Error:" in answer:
-                    print(answer)
-                else:
-                    print(f"{diagram_string}\n\n{answer}")
-        else:
-            print(question_and_options)
\ No newline at end of file
+    print(solve_image(image_file_path, openRouterApiKey))
@@ -0,0 +1,43 @@
+import re
+
+# Regex clean-up applied to every answer, compiled once at import.
+#
+# This used to be six re.sub calls compiled on every answer: one on the DeepSeek output and five on the formatted
+# output. Two of the five were identity substitutions (`$$x$$` -> `$$x$$` and `\begin{e}..\end{e}` -> itself) and
+# are dropped. The lazy [^$]+? groups are greedy now: a negated class can't run past the closing $ anyway, so the
+# match is the same without the per-character backtracking. Output is byte-for-byte the same as the old chain
+# (benchmarks/bench_postprocess.py checks this).
+#
+# The formatted answer still takes three passes. Padding has to come before collapsing, because the padding merges
+# with the spaces around the maths, and trimming a $$ block needs its spaces collapsed first. One regex with all three
+# as alternatives gives the same output, but it needs a Python callback on every match, and on the benchmark corpus
+# that is slower than even the old six-pass chain. Two of the three passes are template substitutions that run
+# entirely in C; only $$ blocks go through a callback.
+
+_INLINE_PARENS = re.compile(r"\\\((.*?)\\\)")
+_INLINE_MATH = re.compile(r"(?<!\$)\$([^$]+)\$(?!\$)")
+_SPACES = re.compile(r"  +")
+_DISPLAY_MATH = re.compile(r"\$\$([^$]+)\$\$")
+
+
+def strip_inline_parens(text):
+    """
+    Drops \\( \\) delimiters from the raw solver output, keeping what was inside them.
+    """
+    return _INLINE_PARENS.sub(r"\1", text)
+
+
+def _trim_display_math(match):
+    # The old pattern trimmed with \s* around a lazy group, which keeps the last character of an all-blank block.
+    body = match.group(1)
+    return f"$${body.strip() or body[-1]}$$"
+
+
+def postprocess_answer(text):
+    """
+    Pads inline $...$ maths with spaces, collapses runs of spaces and trims whitespace inside $$...$$ blocks.
+    """
+    text = _INLINE_MATH.sub(r" $\1$ ", text)
+    # A plain replacement string rather than a callback keeps this pass in C however many runs of spaces there are.
+    text = _SPACES.sub(" ", text)
+    return _DISPLAY_MATH.sub(_trim_display_math, text)
@@ -0,0 +1,188 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import sys
+import time
+
+import OCR
+import openrouter_client
+import pipeline
+import rate_limiter
+import stage_metrics
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".webp")
+
+
+def load_jobs(source):
+    """
+    Lists the images to solve. `source` is either a directory (every image file in it, sorted by name) or a manifest
+    file with one image path per line, or one JSON object per line with "image_path" and an optional "id".
+    Relative manifest paths are resolved against the manifest's directory.
+    """
+    if os.path.isdir(source):
+        names = sorted(name for name in os.listdir(source) if name.lower().endswith(IMAGE_EXTENSIONS))
+        return [{"id": name, "image_path": os.path.join(source, name)} for name in names]
+
+    base = os.path.dirname(os.path.abspath(source))
+    jobs = []
+    with open(source, encoding="utf-8") as manifest:
+        for line in manifest:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            job = json.loads(line) if line.startswith("{") else {"image_path": line}
+            job["image_path"] = os.path.join(base, job["image_path"])
+            job.setdefault("id", os.path.basename(job["image_path"]))
+            jobs.append(job)
+    return jobs
+
+
+def _encode(item):
+    prepared = OCR.prepare_image(item["record"]["image_path"])
+    if isinstance(prepared, str):
+        item["record"]["error"] = prepared
+        item["done"] = True
+    else:
+        item["prepared"] = prepared
+
+
+def _extract(item, api_key):
+    record = item["record"]
+    extracted = OCR.extract_question(item.pop("prepared"), api_key, priority=rate_limiter.PRIORITY_BATCH)
+    if not isinstance(extracted, dict):
+        record["error"] = extracted
+        item["done"] = True
+        return
+    record.update({key: value.strip() if isinstance(value, str) else value for key, value in extracted.items()})
+    item["question"] = tuple(record.get(key, "") for key in ("question", "diagram", "options", "options_type", "question_type"))
+
+
+def _solve(item, api_key):
+    record = item["record"]
+    cached_answer = OCR.lookup_answer(*item["question"])
+    if cached_answer is not None:
+        record["answer"] = cached_answer
+        record["ok"] = True
+        item["done"] = True
+        return
+    raw_answer = OCR.solve_question(*item["question"], api_key, priority=rate_limiter.PRIORITY_BATCH)
+    if raw_answer.startswith("Error:"):
+        record["error"] = raw_answer
+        item["done"] = True
+    else:
+        item["raw_answer"] = raw_answer
+
+
+def _reformat(item, api_key):
+    record = item["record"]
+    answer = OCR.format_answer(item.pop("raw_answer"), api_key, priority=rate_limiter.PRIORITY_BATCH)
+    if answer.startswith("Error:"):
+        record["error"] = answer
+        return
+    OCR.store_answer(*item["question"], answer)
+    record["answer"] = answer
+    record["ok"] = True
+
+
+def default_stage_sizes(concurrency=8):
+    # Image work is CPU-bound, so more threads than cores only adds contention. Pillow releases the GIL while it
+    # decodes, resizes and encodes, but the pure-Python pHash DCT (about a tenth of prepare_image) holds it, so encode
+    # workers overlap well without quite scaling one per core. Extraction and solving are network waits and get the
+    # concurrency. Local reformatting takes milliseconds, and two workers cover the occasional Gemini fallback.
+    return {"encode": min(4, os.cpu_count() or 1), "extract": concurrency, "solve": concurrency, "reformat": 2}
+
+
+async def solve_batch(jobs, api_key, output, stage_sizes=None, queue_size=None, report_interval=None):
+    """
+    Solves every job through a four-stage pipeline (encode, extract, solve, reformat), each stage with its own
+    thread pool and a bounded asyncio queue in front of it. Writes one JSON line per result to `output` as soon as it
+    finishes and returns (records in completion order, stage report).
+    """
+    sizes = {**default_stage_sizes(), **(stage_sizes or {})}
+    functions = {
+        "encode": _encode,
+        "extract": lambda item: _extract(item, api_key),
+        "solve": lambda item: _solve(item, api_key),
+        "reformat": lambda item: _reformat(item, api_key),
+    }
+    stages = [
+        pipeline.Stage(name, functions[name], sizes[name], queue_size or 2 * sizes[name])
+        for name in ("encode", "extract", "solve", "reformat")
+    ]
+    results = []
+
+    def sink(item):
+        record = item["record"]
+        item["metrics"].finish()
+        record["stages"] = item["metrics"].stages
+        record["seconds"] = round(item["metrics"].seconds, 3)
+        output.write(json.dumps(record, ensure_ascii=False) + "\n")
+        output.flush()
+        results.append(record)
+
+    def items():
+        for job in jobs:
+            # Built lazily, so a job's clock starts when it enters the pipeline rather than when the batch starts.
+            record = {"id": job["id"], "image_path": job["image_path"], "ok": False}
+            yield {"record": record, "metrics": stage_metrics.RequestMetrics()}
+
+    runner = pipeline.Pipeline(stages, sink)
+    await runner.run(items(), report_interval=report_interval)
+    return results, runner.report()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Solve a whole question paper concurrently and write the results as JSONL.")
+    parser.add_argument("source", help="directory of question images, or a manifest file listing them")
+    parser.add_argument("--output", "-o", default="-", help="JSONL file to write (default: stdout)")
+    parser.add_argument("--concurrency", "-c", type=int, default=8, help="workers in the extract and solve stages (default: 8)")
+    for name in ("encode", "extract", "solve", "reformat"):
+        parser.add_argument(f"--{name}-workers", type=int, help=f"workers in the {name} stage (overrides --concurrency)")
+    parser.add_argument("--queue-size", type=int, help="bound on each stage's input queue (default: twice its workers)")
+    parser.add_argument("--report-interval", type=float, help="print queue depths and stage utilisation every N seconds")
+    parser.add_argument("--api-key", default=os.getenv("OPENROUTER_API_KEY"), help="OpenRouter API key (default: $OPENROUTER_API_KEY)")
+    args = parser.parse_args(argv)
+
+    if not args.api_key:
+        parser.error("no API key given and OPENROUTER_API_KEY is not set")
+
+    jobs = load_jobs(args.source)
+    if not jobs:
+        print(f"Error: No images found in {args.source}", file=sys.stderr)
+        return 1
+
+    stage_sizes = default_stage_sizes(args.concurrency)
+    for name in stage_sizes:
+        if getattr(args, f"{name}_workers"):
+            stage_sizes[name] = getattr(args, f"{name}_workers")
+
+    # Every worker that calls OpenRouter can hold a connection, so the pool must cover all of them.
+    api_workers = stage_sizes["extract"] + stage_sizes["solve"] + stage_sizes["reformat"]
+    openrouter_client.configure(pool_size=max(openrouter_client.POOL_SIZE, api_workers))
+
+    output = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    start = time.perf_counter()
+    try:
+        # The solve functions print their errors; keep them out of the results stream.
+        with contextlib.redirect_stdout(sys.stderr):
+            results, report = asyncio.run(
+                solve_batch(jobs, args.api_key, output, stage_sizes, args.queue_size, args.report_interval)
+            )
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    wall = time.perf_counter() - start
+
+    solved = sum(1 for record in results if record["ok"])
+    slowest = max((record.get("seconds", 0) for record in results), default=0)
+    total = sum(record.get("seconds", 0) for record in results)
+    print(f"Solved {solved}/{len(results)} questions in {wall:.1f}s "
+          f"(slowest question {slowest:.1f}s, serial total {total:.1f}s)", file=sys.stderr)
+    print(pipeline.format_report(report), file=sys.stderr)
+    return 0 if solved == len(results) else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
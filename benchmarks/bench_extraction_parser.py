@@ -0,0 +1,173 @@
+"""
+Property check and throughput benchmark for extraction_parser.
+
+Generates extraction replies with randomized header styles (**Header:**, ## Header, Header:, "Options Type"),
+section order, dropped sections, option bullets, matrix-match lists and paragraph questions, and checks that every
+field parses back to what was generated. Random junk is fed through as well to check the parser never raises and
+always returns well-typed records. Exits non-zero on the first failure; the throughput of the split cascade it
+replaced is printed alongside for reference.
+
+    python benchmarks/bench_extraction_parser.py [--replies 20000] [--repeat 5]
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import extraction_parser  # noqa: E402
+
+
+def legacy_parse_extraction(extracted_content):
+    parts = extracted_content.split("Diagram Description:")
+    if len(parts) == 1:
+        return {"question": parts[0].strip(), "diagram": "", "options": "", "options_type": "", "question_type": ""}
+    question, rest = parts[0].strip(), parts[1].strip()
+    diagram, _, rest = rest.partition("Option Extraction:")
+    options, _, rest = rest.partition("Option Type:")
+    options_type, _, question_type = rest.partition("Question Type:")
+    return {"question": question, "diagram": diagram.strip(), "options": options.strip(),
+            "options_type": options_type.strip(), "question_type": question_type.strip()}
+
+
+_HEADER_NAMES = {
+    "question": ["Question Extraction"],
+    "diagram": ["Diagram Description"],
+    "options": ["Option Extraction", "Options Extraction"],
+    "options_type": ["Option Type", "Options Type"],
+    "question_type": ["Question Type"],
+}
+_HEADER_STYLES = ["**{}:**", "**{}**:", "{}:", "## {}", "### {}:", "*{}:*", "__{}:__", "{}", "1. **{}:**"]
+_WORDS = ["velocity", "mass", "the", "block", "is", "placed", "on", "an", "incline", "of", "angle", "$\\theta$",
+          "find", "**net**", "force", "$x^2 + 3x$", "(in m/s)", "if", "`k`", "and", "2.5", "kg", "$$E = mc^2$$"]
+_OPTION_STYLES = ["* ({}) {}", "- {}) {}", "{}. {}", "*   **({})** {}", "({}) {}"]
+
+
+def _sentence(rng, low=4, high=20):
+    return " ".join(rng.choice(_WORDS) for _ in range(rng.randint(low, high))).capitalize()
+
+
+def build_reply(rng):
+    """
+    Returns (reply, expected) where expected holds the fields the parser should recover.
+    """
+    question_type = rng.choice(extraction_parser.QUESTION_TYPES)
+    expected = {"matrix": None, "paragraph": "", "sub_questions": [], "option_list": []}
+
+    if question_type == "Matrix Match Question":
+        columns = [[_sentence(rng, 1, 3) for _ in range(4)], [_sentence(rng, 1, 3) for _ in range(4)]]
+        question = f"Match List-I with List-II:\n{columns!r}"
+        expected["matrix"] = columns
+    elif question_type == "Paragraph Question":
+        paragraph = _sentence(rng, 20, 40)
+        sub_questions = [_sentence(rng) for _ in range(rng.randint(2, 4))]
+        listed = "\n".join(f"{number}. {text}" for number, text in enumerate(sub_questions, 1))
+        question = f"Paragraph: {paragraph}\nQuestions:\n{listed}"
+        expected.update(paragraph=paragraph, sub_questions=sub_questions)
+    else:
+        question = "\n\n".join(_sentence(rng) for _ in range(rng.randint(1, 3)))
+
+    if rng.random() < 0.3:
+        options, options_type = "Options: No options found.", "No options"
+    else:
+        labels = "ABCD"
+        texts = [_sentence(rng, 1, 5) for _ in labels]
+        style = rng.choice(_OPTION_STYLES)
+        options = "\n".join(style.format(label, text) for label, text in zip(labels, texts))
+        options_type = rng.choice(["Single-select", "Multi-select"])
+        # Option text that is bold as a whole comes back without the markers.
+        unwrapped = [text[2:-2] if text.startswith("**") and text.endswith("**") and text.count("**") == 2 else text for text in texts]
+        expected["option_list"] = [{"label": label, "text": text} for label, text in zip(labels, unwrapped)]
+
+    diagram = rng.choice(["Diagram: No diagram found.", f"A free-body diagram:\n- {_sentence(rng)}\n- {_sentence(rng)}"])
+    sections = {
+        "question": question,
+        "diagram": diagram,
+        "options": options,
+        "options_type": rng.choice(['"Options Type: {}"', "`Options Type: {}`", "{}"]).format(options_type),
+        "question_type": question_type,
+    }
+    expected.update(sections, options_type=options_type)
+
+    names = list(sections)
+    if rng.random() < 0.3:
+        rng.shuffle(names)
+    if rng.random() < 0.2:
+        dropped = rng.choice([name for name in names if name != "question"])
+        names.remove(dropped)
+        expected[dropped] = ""
+        if dropped == "options":
+            expected["option_list"] = []
+    if names[0] != "question" and rng.random() < 0.5 and "question" in names:
+        names.remove("question")
+        names.insert(0, "question")
+
+    pieces = []
+    for name in names:
+        header = rng.choice(_HEADER_STYLES).format(rng.choice(_HEADER_NAMES[name]))
+        # A header without a colon has to sit on its own line.
+        separator = rng.choice(["\n", " ", "\n\n"]) if ":" in header else "\n"
+        pieces.append(f"{header}{separator}{sections[name]}")
+    return rng.choice(["\n\n", "\n"]).join(pieces), expected
+
+
+def check_properties(count, seed=0):
+    rng = random.Random(seed)
+    for _ in range(count):
+        reply, expected = build_reply(rng)
+        parsed = extraction_parser.parse_extraction(reply).as_dict()
+        for key, value in expected.items():
+            if parsed[key] != value:
+                return f"{key} mismatch:\n  reply: {reply!r}\n  expected: {value!r}\n  parsed: {parsed[key]!r}"
+    return None
+
+
+def check_junk(count, seed=1):
+    rng = random.Random(seed)
+    alphabet = string.printable + "*#_[]():\"'`•"
+    fragments = [name for names in _HEADER_NAMES.values() for name in names] + ["Paragraph:", "Questions:", "[[", "]]", "(A)"]
+    for _ in range(count):
+        text = "".join(rng.choice(alphabet) if rng.random() < 0.8 else rng.choice(fragments) for _ in range(rng.randint(0, 300)))
+        try:
+            parsed = extraction_parser.parse_extraction(text)
+        except Exception as e:
+            return f"raised {e!r} on {text!r}"
+        if not all(isinstance(getattr(parsed, name), str) for name in ("question", "diagram", "options", "options_type", "question_type", "paragraph")):
+            return f"non-string field on {text!r}"
+        if parsed.matrix is not None and not (len(parsed.matrix) == 2 and all(isinstance(column, list) for column in parsed.matrix)):
+            return f"malformed matrix {parsed.matrix!r} on {text!r}"
+    return None
+
+
+def bench(function, corpus, repeat):
+    return min(timeit.repeat(lambda: [function(text) for text in corpus], number=1, repeat=repeat))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--replies", type=int, default=20000, help="generated replies for the property check")
+    parser.add_argument("--repeat", type=int, default=5, help="timing repeats (best is reported)")
+    args = parser.parse_args(argv)
+
+    problem = check_properties(args.replies) or check_junk(args.replies)
+    if problem:
+        print(f"FAIL: {problem}")
+        return 1
+    print(f"properties: {args.replies} generated replies and {args.replies} junk inputs OK")
+
+    rng = random.Random(2)
+    corpus = [build_reply(rng)[0] for _ in range(2000)]
+    megabytes = sum(len(text.encode("utf-8")) for text in corpus) / 1e6
+    legacy = bench(legacy_parse_extraction, corpus, args.repeat)
+    current = bench(lambda text: extraction_parser.parse_extraction(text), corpus, args.repeat)
+    print(f"corpus: {len(corpus)} replies, {megabytes:.2f} MB")
+    print(f"legacy split cascade: {legacy * 1000:8.1f} ms  {len(corpus) / legacy:9.0f} replies/s")
+    print(f"extraction_parser:    {current * 1000:8.1f} ms  {len(corpus) / current:9.0f} replies/s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
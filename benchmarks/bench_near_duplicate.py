@@ -0,0 +1,212 @@
+"""
+Regression check and timing for near-duplicate matching in near_duplicate.
+
+Renders JEE-style questions and checks two things through a NearDuplicateIndex in a scratch database: copies that
+differ only in their numbers (mass, angle, friction coefficient) are never matched to each other at any font size from
+10 to 30 pixels, and re-encoded, brightened or re-cropped copies of one question are matched. Exits non-zero on the
+first failure. It also checks that evicting an extraction from a size-limited ResultCache deletes its fingerprint,
+and that the fingerprints count towards the cache's byte limit. How many rescaled copies still match, and the time
+to fingerprint an upload and to confirm a candidate, are printed alongside.
+
+It then fills a scratch database with --entries random hashes and reports what one worker's index costs: the time
+to load it at startup, the memory it keeps, and the time of a lookup.
+
+    python benchmarks/bench_near_duplicate.py [--repeat 20] [--entries 1000000]
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+
+from PIL import Image, ImageDraw, ImageEnhance, ImageFont, ImageOps
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import near_duplicate  # noqa: E402
+import result_cache  # noqa: E402
+
+_NUMERIC_VARIANTS = [(2, 30, 0.2), (5, 60, 0.4), (3, 30, 0.2), (2, 30, 0.3), (2, 37, 0.2), (20, 30, 0.2)]
+# Font sizes at which re-encoded and re-cropped copies must match; smaller text is allowed to miss.
+_COPY_FONT_SIZES = (18, 26)
+
+
+def render_question(mass, angle, mu, font_size=26, width=1400):
+    font = ImageFont.load_default(size=font_size)
+    image = Image.new("RGB", (width, 520), "white")
+    draw = ImageDraw.Draw(image)
+    lines = [
+        f"Q. A block of mass {mass} kg is placed on a rough incline of angle {angle}°.",
+        f"The coefficient of kinetic friction is {mu}. Taking g = 10 m/s², find the",
+        "acceleration of the block as it slides down the incline.",
+        "(A) 3.27 m/s²    (B) 5.00 m/s²    (C) 4.13 m/s²    (D) 6.73 m/s²",
+    ]
+    for row, text in enumerate(lines):
+        draw.text((60, 60 + row * 70), text, fill="black", font=font)
+    return image
+
+
+def _jpeg(image, quality):
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality)
+    buffer.seek(0)
+    return Image.open(buffer).convert("RGB")
+
+
+def benign_copies(image):
+    width, height = image.size
+    return {
+        "jpeg q60": _jpeg(image, 60),
+        "jpeg q30": _jpeg(image, 30),
+        "darker": ImageEnhance.Brightness(image).enhance(0.8),
+        "wider margin": ImageOps.expand(image, 40, "white"),
+        "tighter crop": image.crop((30, 30, width - 20, height - 20)),
+    }
+
+
+def rescaled_copies(image):
+    width, height = image.size
+    return {
+        "1.3x larger": image.resize((int(width * 1.3), int(height * 1.3)), Image.BICUBIC),
+        "half size": image.resize((width // 2, height // 2), Image.LANCZOS),
+    }
+
+
+def _save(image, directory, name):
+    path = os.path.join(directory, f"{name}.png")
+    image.save(path)
+    return path
+
+
+def _fingerprint(image, directory, name):
+    return near_duplicate.image_fingerprints(_save(image, directory, name))
+
+
+def check_matching(directory):
+    """
+    Returns (problem or None, rescaled copies matched, rescaled copies tried).
+    """
+    rescaled_matched = rescaled_tried = 0
+    for font_size in range(10, 31, 2):
+        path = os.path.join(directory, f"index_{font_size}.sqlite3")
+        cache = result_cache.ResultCache(path, result_cache.EXTRACTION_NAMESPACE)
+        index = near_duplicate.NearDuplicateIndex(path)
+        variants = [render_question(*numbers, font_size=font_size) for numbers in _NUMERIC_VARIANTS]
+        for number, image in enumerate(variants):
+            key, value, detail = _fingerprint(image, directory, f"variant_{font_size}_{number}")
+            match = index.find(value, detail)
+            if match is not None:
+                return f"{_NUMERIC_VARIANTS[number]} at {font_size}px matched {match[0]} ({match[1]} bits apart)", 0, 0
+            cache.put(key, {"question": f"variant {number}"})
+            index.add(value, key, detail)
+        if font_size not in _COPY_FONT_SIZES:
+            continue
+        first_key = result_cache.image_cache_key(variants[0])
+        for name, copy in benign_copies(variants[0]).items():
+            _, value, detail = _fingerprint(copy, directory, f"copy_{font_size}_{name}")
+            match = index.find(value, detail)
+            if match is None or match[0] != first_key:
+                return f"{name} copy at {font_size}px did not match its original (got {match})", 0, 0
+        for name, copy in rescaled_copies(variants[0]).items():
+            _, value, detail = _fingerprint(copy, directory, f"rescaled_{font_size}_{name}")
+            match = index.find(value, detail)
+            if match is not None and match[0] != first_key:
+                return f"{name} copy at {font_size}px matched another question ({match[0]})", 0, 0
+            rescaled_tried += 1
+            rescaled_matched += match is not None
+    return None, rescaled_matched, rescaled_tried
+
+
+def check_eviction(directory, count=6):
+    """
+    Returns a problem or None.
+    """
+    path = os.path.join(directory, "eviction.sqlite3")
+    images = [render_question(mass, 30, 0.2) for mass in range(1, count + 1)]
+    fingerprints = [_fingerprint(image, directory, f"eviction_{number}") for number, image in enumerate(images)]
+    detail_bytes = len(fingerprints[0][2])
+    # Room for about half the fingerprints: the extraction values themselves are tiny.
+    cache = result_cache.ResultCache(path, result_cache.EXTRACTION_NAMESPACE, max_bytes=detail_bytes * count // 2)
+    index = near_duplicate.NearDuplicateIndex(path)
+    for key, value, detail in fingerprints:
+        cache.put(key, {"question": key})
+        index.add(value, key, detail)
+
+    stats = cache.stats()
+    if stats["bytes"] < detail_bytes * stats["entries"]:
+        return f"cache reports {stats['bytes']} bytes for {stats['entries']} entries with {detail_bytes} byte fingerprints"
+    connection = result_cache.connect(path)
+    stored = {key for (key,) in connection.execute("SELECT key FROM phashes")}
+    cached = {key for key, _, _ in fingerprints if cache.get(key) is not None}
+    if stored != cached or len(cached) >= count:
+        return f"{len(stored)} fingerprints kept for {len(cached)} of {count} cached extractions"
+    evicted = [(value, detail) for key, value, detail in fingerprints if key not in cached]
+    if any(near_duplicate.NearDuplicateIndex(path).find(value, detail) is not None for value, detail in evicted):
+        return "an evicted extraction was still matched"
+    return None
+
+
+def measure_index(path, entries, repeat):
+    """
+    Returns (seconds to load, bytes kept, seconds per lookup) for a NearDuplicateIndex over `entries` stored hashes.
+    """
+    connection = result_cache.connect(path)
+    hashes = [random.getrandbits(64) for _ in range(entries)]
+    connection.executemany(
+        "INSERT INTO phashes (hash, key) VALUES (?, ?)",
+        ((near_duplicate._to_signed(value), f"{number:064x}") for number, value in enumerate(hashes)),
+    )
+    connection.close()
+
+    start = time.perf_counter()
+    index = near_duplicate.NearDuplicateIndex(path)
+    load = time.perf_counter() - start
+    del index
+
+    tracemalloc.start()
+    index = near_duplicate.NearDuplicateIndex(path)
+    kept = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    queries = [value ^ (1 << random.randrange(64)) for value in random.sample(hashes, min(len(hashes), 100))]
+    lookup = min(timeit.repeat(lambda: [index._index.candidates(value) for value in queries], number=1, repeat=repeat))
+    return load, kept, lookup / len(queries)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20, help="timing repeats (best is reported)")
+    parser.add_argument("--entries", type=int, default=200000, help="stored images for the index size figures")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="bench_near_duplicate_") as directory:
+        problem, rescaled_matched, rescaled_tried = check_matching(directory)
+        if problem:
+            print(f"FAIL: {problem}")
+            return 1
+        print(f"matching: {len(_NUMERIC_VARIANTS)} numeric variants kept apart at 10-30px, re-encoded and re-cropped copies matched OK")
+        print(f"rescaled copies matched: {rescaled_matched}/{rescaled_tried}")
+        problem = check_eviction(directory)
+        if problem:
+            print(f"FAIL: {problem}")
+            return 1
+        print("eviction: evicted extractions lose their fingerprints, which count towards max_bytes OK")
+
+        path = _save(render_question(2, 30, 0.2), directory, "timing")
+        detail = near_duplicate.image_fingerprints(path)[2]
+        fingerprint = min(timeit.repeat(lambda: near_duplicate.image_fingerprints(path), number=1, repeat=args.repeat))
+        confirm = min(timeit.repeat(lambda: near_duplicate.details_match(detail, detail), number=1, repeat=args.repeat))
+        load, kept, lookup = measure_index(os.path.join(directory, "size.sqlite3"), args.entries, args.repeat)
+    print(f"fingerprint one upload:  {fingerprint * 1000:7.1f} ms ({len(detail)} byte detail fingerprint)")
+    print(f"confirm one candidate:   {confirm * 1000:7.1f} ms")
+    print(f"index of {args.entries} images: load {load:.2f} s at worker startup, {kept / 1e6:.1f} MB per worker "
+          f"({kept / max(1, args.entries):.0f} bytes each), lookup {lookup * 1e6:.0f} us")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
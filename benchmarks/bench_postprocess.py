@@ -0,0 +1,118 @@
+"""
+Throughput benchmark and equivalence check for answer_postprocess.
+
+Compares the precompiled post-processor against the regex chain it replaced on a corpus of long, answer-shaped
+texts, plus a randomized fuzz corpus. Exits non-zero if any output differs or if the new code is slower.
+
+    python benchmarks/bench_postprocess.py [--answers 200] [--repeat 5]
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import answer_postprocess  # noqa: E402
+
+
+def legacy_strip_inline_parens(text):
+    return re.sub(r'\\\((.*?)\\\)', r'\1', text)
+
+
+def legacy_postprocess_answer(corrected_answer):
+    corrected_answer = re.sub(r'(?<!\$)\$([^$]+?)\$(?!\$)', r' $\1$ ', corrected_answer)
+    corrected_answer = re.sub(r'\$\$([^$]+?)\$\$', r'$$\1$$', corrected_answer)
+    corrected_answer = re.sub(r'  +', ' ', corrected_answer)
+    corrected_answer = re.sub(r'\$\$\s*([^$]+?)\s*\$\$', r'$$\1$$', corrected_answer)
+    corrected_answer = re.sub(r'\\begin\{([^}]+)\}(.*?)\\end\{\1\}', r'\\begin{\1}\2\\end{\1}', corrected_answer, flags=re.DOTALL)
+    return corrected_answer
+
+
+_STEPS = [
+    "Resolve the weight along the incline: $F = mg\\sin\\theta$ where $\\theta = 30^\\circ$.",
+    "Apply Newton's second law:  $$  a = \\frac{F}{m} = g \\sin\\theta  $$",
+    "Substitute the values \\(g = 9.8\\,\\text{m/s}^2\\) and  \\(\\sin 30^\\circ = 0.5\\).",
+    "Integrate term by term: $$\\int_0^3 x^2 \\, dx = \\left[ \\frac{x^3}{3} \\right]_0^3 = 9$$",
+    "The determinant is\n$$\n\\begin{vmatrix} 1 & 2 \\\\ 3 & 4 \\end{vmatrix} = 1 \\cdot 4 - 2 \\cdot 3 = -2\n$$",
+    "Balance the reaction: $\\mathrm{2H_2 + O_2 \\rightarrow 2H_2O}$, so  two moles of water form.",
+    "Using the identity $\\sin^2 x + \\cos^2 x = 1$ the expression   simplifies to $1$.",
+    "\\begin{aligned} v^2 &= u^2 + 2as \\\\ &= 0 + 2(4.9)(10) \\end{aligned}",
+    "Matching each item: `[('A', '2'), ('B', '1'), ('C', '4'), ('D', '3')]`",
+]
+_OPTIONS = ["A", "B", "C", "D"]
+
+
+def build_corpus(count, seed=0):
+    """
+    Long answers shaped like the solver's output: reasoning steps, display and inline maths, option analysis.
+    """
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(count):
+        lines = ["## Assumptions", "- The surface is frictionless", "- $g = 9.8\\,\\text{m/s}^2$", "", "## Steps"]
+        for number in range(1, rng.randint(8, 25)):
+            lines.append(f"**Reasoning Step:** {rng.choice(_STEPS)}")
+            lines.append(f"{number}. {rng.choice(_STEPS)}")
+            lines.append("")
+        lines.append("## Option Analysis")
+        for option in _OPTIONS:
+            verdict = rng.choice(["Correct", "Incorrect"])
+            lines.append(f"- {option}: {verdict}, because $a = {rng.randint(1, 9)}.{rng.randint(0, 9)}$  m/s^2")
+        lines.append("")
+        lines.append(f"**Final Answer:** The correct answer is: {rng.choice(_OPTIONS)}")
+        corpus.append("\n".join(lines))
+    return corpus
+
+
+def build_fuzz_corpus(count, seed=1):
+    rng = random.Random(seed)
+    alphabet = ["$", "$", "$$", " ", "  ", "\t", "\n", "a", "x^2", "\\begin{m}", "\\end{m}", "\\(", "\\)"]
+    return ["".join(rng.choice(alphabet) for _ in range(rng.randint(0, 40))) for _ in range(count)]
+
+
+def check_equivalence(texts):
+    for text in texts:
+        if answer_postprocess.strip_inline_parens(text) != legacy_strip_inline_parens(text):
+            return f"strip_inline_parens differs on {text!r}"
+        if answer_postprocess.postprocess_answer(text) != legacy_postprocess_answer(text):
+            return f"postprocess_answer differs on {text!r}"
+    return None
+
+
+def bench(function, corpus, repeat):
+    def run():
+        for text in corpus:
+            function(text)
+    return min(timeit.repeat(run, number=1, repeat=repeat))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--answers", type=int, default=200, help="answers in the benchmark corpus")
+    parser.add_argument("--repeat", type=int, default=5, help="timing repeats (best is reported)")
+    args = parser.parse_args(argv)
+
+    corpus = build_corpus(args.answers)
+    problem = check_equivalence(corpus) or check_equivalence(build_fuzz_corpus(20000))
+    if problem:
+        print(f"FAIL: {problem}")
+        return 1
+
+    megabytes = sum(len(text.encode("utf-8")) for text in corpus) / 1e6
+    legacy = bench(lambda text: legacy_postprocess_answer(legacy_strip_inline_parens(text)), corpus, args.repeat)
+    current = bench(lambda text: answer_postprocess.postprocess_answer(answer_postprocess.strip_inline_parens(text)), corpus, args.repeat)
+
+    print(f"corpus: {len(corpus)} answers, {megabytes:.2f} MB")
+    print(f"legacy chain:       {legacy * 1000:8.1f} ms  {megabytes / legacy:7.1f} MB/s")
+    print(f"answer_postprocess: {current * 1000:8.1f} ms  {megabytes / current:7.1f} MB/s  ({legacy / current:.2f}x)")
+    if current > legacy:
+        print("FAIL: answer_postprocess is slower than the legacy chain")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,80 @@
+"""
+Size comparison of the typed DeepSeek solve prompts against the full all-types prompt.
+
+Builds both prompts for every question type and option type the extraction step produces and prints their size in
+bytes and approximate tokens (bytes / 4). Also checks that each typed prompt still carries the question, the context
+that was found and the final-answer format that markdown_normalizer and answer_postprocess expect, and exits
+non-zero on the first failure.
+
+    python benchmarks/bench_solve_prompts.py
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import extraction_parser  # noqa: E402
+import solve_prompts  # noqa: E402
+
+_QUESTION = "A block of mass $2\\,\\text{kg}$ slides down a rough incline of angle $30^\\circ$ with $\\mu_k = 0.2$. Find its acceleration."
+_DIAGRAM = "An inclined plane at $30^\\circ$ with a block on its surface and the weight $mg$ marked."
+_OPTIONS = "* (A) $3.27\\,\\text{m/s}^2$\n* (B) $5.00\\,\\text{m/s}^2$\n* (C) $4.13\\,\\text{m/s}^2$\n* (D) $6.73\\,\\text{m/s}^2$"
+_EXPECTED_ANSWER = {
+    "Single-select": "The correct answer is:",
+    "Multi-select": "The correct answers are:",
+    "Matrix Match Question": "list of tuples",
+    "Paragraph Question": "**Question 1:**",
+    "Numerical Question": "numerical answer",
+}
+
+
+def cases():
+    for question_type in extraction_parser.QUESTION_TYPES:
+        for options_type in ("Single-select", "Multi-select", "No options"):
+            options = _OPTIONS if options_type != "No options" else "Options: No options found."
+            for diagram in (_DIAGRAM, "Diagram: No diagram found."):
+                yield question_type, options_type, options, diagram
+
+
+def check(question_type, options_type, options, diagram, prompt):
+    expected = [_QUESTION]
+    if "no diagram" not in diagram.lower():
+        expected.append(_DIAGRAM)
+    if options_type != "No options":
+        expected += [_OPTIONS, _EXPECTED_ANSWER[options_type]]
+    # With options the answer is an option letter; the numerical answer format only applies without them.
+    if question_type in _EXPECTED_ANSWER and (question_type != "Numerical Question" or options_type == "No options"):
+        expected.append(_EXPECTED_ANSWER[question_type])
+    for text in expected:
+        if text not in prompt:
+            return f"{question_type} / {options_type}: prompt is missing {text!r}"
+    if "No options found" in prompt or "No diagram found" in prompt:
+        return f"{question_type} / {options_type}: prompt carries an empty section"
+    return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.parse_args(argv)
+
+    print(f"{'question type':<26} {'options':<14} {'full':>7} {'typed':>7} {'tokens saved':>13}")
+    full_total = typed_total = 0
+    for question_type, options_type, options, diagram in cases():
+        full = solve_prompts.full_prompt(_QUESTION, diagram, options, options_type, question_type).encode("utf-8")
+        typed = solve_prompts.build_solve_prompt(_QUESTION, diagram, options, options_type, question_type)
+        problem = check(question_type, options_type, options, diagram, typed)
+        if problem:
+            print(f"FAIL: {problem}")
+            return 1
+        typed = typed.encode("utf-8")
+        full_total += len(full)
+        typed_total += len(typed)
+        if "no diagram" in diagram.lower():
+            print(f"{question_type:<26} {options_type:<14} {len(full):>7} {len(typed):>7} {(len(full) - len(typed)) // 4:>13}")
+    print(f"all cases: typed prompts are {typed_total / full_total:.0%} of the full prompt's size")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,351 @@
+"""
+End-to-end load benchmark for the /upload route, offline against the fake OpenRouter server.
+
+Starts benchmarks/fake_openrouter.py in-process and `node index.js` pointed at it (or uses a server that is already
+running with --url), then uploads a corpus of question images at a fixed concurrency. Reports client-side latency
+percentiles and throughput, and a per-stage breakdown taken from the difference between two /metrics scrapes. Without
+--corpus, synthetic question images are generated that differ only in their numbers, as JEE variants do.
+
+    python benchmarks/bench_upload_load.py [-c 8] [--requests 200] [--latency 0.8] [--tokens-per-second 150] [--error-rate 0.05]
+    python benchmarks/bench_upload_load.py --url http://127.0.0.1:3002 --corpus path/to/questions/
+"""
+import argparse
+import concurrent.futures
+import json
+import math
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_openrouter  # noqa: E402
+import stage_metrics  # noqa: E402
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMAGE_TYPES = {".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".gif": "image/gif"}
+
+_SAMPLE_LINE = re.compile(r"^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})?\s+(\S+)$")
+_LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def generate_corpus(directory, count):
+    """
+    Draws `count` distinct question images into directory and returns their paths.
+    """
+    from PIL import Image, ImageDraw
+
+    paths = []
+    for index in range(count):
+        image = Image.new("RGB", (1100, 420), "white")
+        draw = ImageDraw.Draw(image)
+        lines = [
+            f"Q{index + 1}. A block of mass {2 + index % 7} kg is placed on a rough incline of angle {20 + index % 40} degrees.",
+            f"The coefficient of kinetic friction is 0.{1 + index % 8}. Find the acceleration of the block.",
+            "(A) 3.27 m/s^2     (B) 5.00 m/s^2     (C) 4.13 m/s^2     (D) 6.73 m/s^2",
+        ]
+        for row, text in enumerate(lines):
+            draw.text((40, 60 + row * 70), text, fill="black")
+        path = os.path.join(directory, f"question_{index:04d}.png")
+        image.save(path)
+        paths.append(path)
+    return paths
+
+
+def load_corpus(directory):
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if os.path.splitext(name)[1].lower() in IMAGE_TYPES
+    )
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(node, port, env, timeout=30.0):
+    """
+    Starts `node index.js` and waits for /metrics to answer. Returns the process.
+    """
+    process = subprocess.Popen([node, "index.js"], cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    # Drain stderr so the OCR workers' retry messages can't fill the pipe and stall the server.
+    stderr = []
+    threading.Thread(target=lambda: stderr.extend(process.stderr), daemon=True).start()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"node index.js exited with {process.returncode}:\n{''.join(stderr[-20:])}")
+        try:
+            requests.get(f"http://127.0.0.1:{port}/metrics", timeout=1)
+            return process
+        except requests.exceptions.ConnectionError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"node index.js did not start listening on port {port} within {timeout:g} seconds")
+
+
+def parse_metrics(text):
+    """
+    Parses Prometheus text format into {(name, ((label, value), ...)): value}.
+    """
+    samples = {}
+    for line in text.splitlines():
+        match = _SAMPLE_LINE.match(line)
+        if not match or line.startswith("#"):
+            continue
+        name, labels, value = match.groups()
+        key = (name, tuple(sorted(_LABEL.findall(labels or ""))))
+        samples[key] = float(value)
+    return samples
+
+
+def diff_metrics(before, after):
+    return {key: value - before.get(key, 0.0) for key, value in after.items()}
+
+
+def histogram_quantile(buckets, quantile):
+    """
+    Estimates a quantile from cumulative (upper bound, count) buckets by linear interpolation, as Prometheus does.
+    """
+    total = buckets[-1][1] if buckets else 0
+    if not total:
+        return 0.0
+    rank = quantile * total
+    lower_bound, lower_count = 0.0, 0.0
+    for bound, count in buckets:
+        if count >= rank:
+            if bound == float("inf"):
+                return lower_bound
+            return lower_bound + (bound - lower_bound) * (rank - lower_count) / max(count - lower_count, 1e-12)
+        lower_bound, lower_count = bound, count
+    return lower_bound
+
+
+def histogram_series(samples, name, by):
+    """
+    Groups a histogram's samples by the label `by`: {label value: {"count", "sum", "buckets"}}.
+    """
+    series = {}
+    for (sample_name, labels), value in samples.items():
+        if sample_name not in (f"{name}_count", f"{name}_sum", f"{name}_bucket"):
+            continue
+        labels = dict(labels)
+        entry = series.setdefault(labels.get(by, ""), {"count": 0.0, "sum": 0.0, "buckets": {}})
+        if sample_name == f"{name}_bucket":
+            bound = float(labels["le"])
+            entry["buckets"][bound] = entry["buckets"].get(bound, 0.0) + value
+        else:
+            entry[sample_name[len(name) + 1:]] += value
+    for entry in series.values():
+        entry["buckets"] = sorted(entry["buckets"].items())
+    return series
+
+
+def percentile(sorted_values, quantile):
+    if not sorted_values:
+        return 0.0
+    # Nearest rank.
+    return sorted_values[max(0, math.ceil(quantile * len(sorted_values)) - 1)]
+
+
+def upload(session, url, path, timeout):
+    start = time.perf_counter()
+    try:
+        with open(path, "rb") as f:
+            response = session.post(f"{url}/upload", timeout=timeout, files={
+                "image": (os.path.basename(path), f, IMAGE_TYPES[os.path.splitext(path)[1].lower()]),
+            })
+        ok = response.status_code == 200 and not response.text.lstrip().startswith("Error")
+        outcome = "ok" if ok else f"HTTP {response.status_code}" if response.status_code != 200 else "error reply"
+    except requests.exceptions.RequestException as e:
+        outcome = type(e).__name__
+    return time.perf_counter() - start, outcome
+
+
+def run_load(url, corpus, count, concurrency, timeout):
+    """
+    Closed-loop load: `concurrency` clients upload back to back until `count` uploads are done.
+    Returns (latencies, outcomes, wall seconds).
+    """
+    local = threading.local()
+
+    def task(index):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        return upload(local.session, url, corpus[index % len(corpus)], timeout)
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(task, range(count)))
+    return [latency for latency, _ in results], [outcome for _, outcome in results], time.perf_counter() - start
+
+
+def build_report(latencies, outcomes, wall, samples, fake_stats):
+    ordered = sorted(latencies)
+    ok = outcomes.count("ok")
+    failures = {}
+    for outcome in outcomes:
+        if outcome != "ok":
+            failures[outcome] = failures.get(outcome, 0) + 1
+
+    requests_series = histogram_series(samples, "ocr_request_duration_seconds", "route").get("/upload", {"count": 0, "sum": 0})
+    mean_request = requests_series["sum"] / requests_series["count"] if requests_series["count"] else 0.0
+    stages = []
+    durations = histogram_series(samples, "ocr_stage_duration_seconds", "stage")
+    queued = histogram_series(samples, "ocr_stage_queued_seconds", "stage")
+    queue_wait = histogram_series(samples, "ocr_worker_queue_seconds", "").get("", {"count": 0, "sum": 0, "buckets": []})
+    rows = [("worker queue", queue_wait)] + [(name, durations[name]) for name in stage_metrics.STAGES if name in durations]
+    for name, series in rows:
+        if not series["count"]:
+            continue
+        mean = series["sum"] / series["count"]
+        stage_queued = queued.get(name)
+        stages.append({
+            "stage": name,
+            "count": int(series["count"]),
+            "mean": mean,
+            "p50": histogram_quantile(series["buckets"], 0.50),
+            "p95": histogram_quantile(series["buckets"], 0.95),
+            # Per-request share: the stage's total time spread over every upload the server answered.
+            "share": series["sum"] / requests_series["sum"] if requests_series["sum"] else 0.0,
+            "rate_limited": stage_queued["sum"] / stage_queued["count"] if stage_queued and stage_queued["count"] else 0.0,
+        })
+
+    def counter_total(name):
+        return {dict(labels).get("stage", ""): value for (sample_name, labels), value in samples.items() if sample_name == name and value}
+
+    return {
+        "requests": len(outcomes),
+        "ok": ok,
+        "failures": failures,
+        "wall_seconds": wall,
+        "throughput": len(outcomes) / wall if wall else 0.0,
+        "latency": {
+            "mean": sum(ordered) / len(ordered) if ordered else 0.0,
+            "p50": percentile(ordered, 0.50),
+            "p95": percentile(ordered, 0.95),
+            "p99": percentile(ordered, 0.99),
+            "max": ordered[-1] if ordered else 0.0,
+        },
+        "server_mean": mean_request,
+        "stages": stages,
+        "retries": counter_total("ocr_stage_retries_total"),
+        "cache_hits": counter_total("ocr_stage_cache_hits_total"),
+        "hedge_winners": {dict(labels)["winner"]: value for (sample_name, labels), value in samples.items()
+                          if sample_name == "ocr_stage_hedges_total" and value},
+        "fake_openrouter": fake_stats,
+    }
+
+
+def format_report(report):
+    latency = report["latency"]
+    lines = [
+        f"requests:   {report['requests']} ({report['ok']} ok"
+        + "".join(f", {count} {outcome}" for outcome, count in sorted(report["failures"].items())) + ")",
+        f"wall:       {report['wall_seconds']:.2f} s, {report['throughput']:.2f} uploads/s",
+        f"latency:    mean {latency['mean']:.3f} s  p50 {latency['p50']:.3f} s  p95 {latency['p95']:.3f} s  "
+        f"p99 {latency['p99']:.3f} s  max {latency['max']:.3f} s",
+        f"server:     mean {report['server_mean']:.3f} s per /upload",
+        "",
+        f"{'stage':<13} {'count':>6} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'share':>6} {'rate-limit ms':>14}",
+    ]
+    for row in report["stages"]:
+        lines.append(
+            f"{row['stage']:<13} {row['count']:>6} {row['mean'] * 1000:>9.1f} {row['p50'] * 1000:>9.1f} {row['p95'] * 1000:>9.1f} "
+            f"{row['share']:>6.0%} {row['rate_limited'] * 1000:>14.1f}"
+        )
+    if report["retries"]:
+        lines.append("retries:    " + ", ".join(f"{stage} {int(count)}" for stage, count in sorted(report["retries"].items())))
+    if report["cache_hits"]:
+        lines.append("cache hits: " + ", ".join(f"{stage} {int(count)}" for stage, count in sorted(report["cache_hits"].items())))
+    if report["hedge_winners"]:
+        lines.append("hedges:     " + ", ".join(f"{winner} won {int(count)}" for winner, count in sorted(report["hedge_winners"].items())))
+    if report["fake_openrouter"]:
+        lines.append("openrouter: " + ", ".join(f"{key} {count}" for key, count in sorted(report["fake_openrouter"].items())))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-c", "--concurrency", type=int, default=8, help="uploads in flight at once")
+    parser.add_argument("--requests", type=int, default=None, help="uploads to send (default: one per corpus image)")
+    parser.add_argument("--warmup", type=int, default=None, help="uploads sent before measuring (default: one per OCR worker)")
+    parser.add_argument("--corpus", help="directory of question images (default: generated)")
+    parser.add_argument("--images", type=int, default=100, help="images to generate when there is no --corpus")
+    parser.add_argument("--url", help="base URL of a running server; skips starting node and the fake OpenRouter")
+    parser.add_argument("--ocr-workers", type=int, default=None, help="OCR_WORKERS for the started server (default: concurrency)")
+    parser.add_argument("--cache", action="store_true", help="leave the result cache on in the started server")
+    parser.add_argument("--node", default="node", help="node binary for the started server")
+    parser.add_argument("--timeout", type=float, default=120.0, help="per-upload timeout in seconds")
+    parser.add_argument("--json", help="also write the report to this file")
+    fake_openrouter.add_behaviour_arguments(parser)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="bench_upload_") as scratch:
+        corpus = load_corpus(args.corpus) if args.corpus else generate_corpus(scratch, args.images)
+        if not corpus:
+            print(f"FAIL: no .png, .jpg or .gif images in {args.corpus}")
+            return 1
+        count = args.requests or len(corpus)
+
+        fake = None
+        server = None
+        url = args.url.rstrip("/") if args.url else None
+        workers = args.ocr_workers or args.concurrency
+        try:
+            if url is None:
+                fake = fake_openrouter.FakeOpenRouter(behaviour=fake_openrouter.behaviour_from_arguments(args))
+                port = _free_port()
+                env = dict(
+                    os.environ,
+                    PORT=str(port),
+                    OPENROUTER_API_URL=fake.start(),
+                    OPENROUTER_API_KEY="offline",
+                    OCR_WORKERS=str(workers),
+                    PYTHON_BIN=sys.executable,
+                    # A scratch cache keeps the run independent of, and out of, the real cache.
+                    OCR_CACHE_PATH=os.path.join(scratch, "cache.sqlite3"),
+                    OCR_CACHE_DISABLED="" if args.cache else "1",
+                )
+                server = start_server(args.node, port, env)
+                url = f"http://127.0.0.1:{port}"
+
+            warmup = workers if args.warmup is None else args.warmup
+            if warmup:
+                # Warm-up uploads use images from the end of the corpus so they don't prime the cache for the run.
+                run_load(url, corpus[::-1], warmup, min(warmup, args.concurrency), args.timeout)
+            before = parse_metrics(requests.get(f"{url}/metrics", timeout=10).text)
+            fake_before = fake.stats.as_dict() if fake else {}
+
+            latencies, outcomes, wall = run_load(url, corpus, count, args.concurrency, args.timeout)
+
+            samples = diff_metrics(before, parse_metrics(requests.get(f"{url}/metrics", timeout=10).text))
+            fake_stats = {key: value - fake_before.get(key, 0) for key, value in fake.stats.as_dict().items()} if fake else {}
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait(timeout=10)
+            if fake is not None:
+                fake.shutdown()
+
+    report = build_report(latencies, outcomes, wall, samples, fake_stats)
+    print(f"concurrency {args.concurrency}, {len(corpus)} images, {count} uploads against {url}")
+    print(format_report(report))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 0 if report["ok"] == report["requests"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,335 @@
+"""
+Local stand-in for the OpenRouter chat completions API that replays recorded responses.
+
+Each request is answered with a recording for the same model and kind ("vision" when the messages carry an image,
+"text" otherwise), picked by a hash of the request so the same request always gets the same reply. The server adds
+a configurable time to first byte and generation speed, can inject 429s (at random or above a request rate) with a
+Retry-After header, and streams server-sent events like OpenRouter when the request asks for "stream". GET /stats
+returns what it has served. With --upstream it proxies to the real API instead and appends every reply to the
+recordings file, which is how the recordings are made.
+
+    python benchmarks/fake_openrouter.py [--port 8765] [--latency 0.8] [--tokens-per-second 150] [--error-rate 0.05]
+    OPENROUTER_API_URL=http://127.0.0.1:8765/v1/chat/completions python OCR.py question.png <hyperbolic_api_key> <openrouter_api_key>
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_RECORDINGS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "recordings", "openrouter.jsonl")
+# Characters per streamed chunk; OpenRouter sends roughly one token per event.
+_CHUNK_CHARACTERS = 4
+
+
+def request_kind(payload):
+    for message in payload.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, list) and any(part.get("type") == "image_url" for part in content if isinstance(part, dict)):
+            return "vision"
+    return "text"
+
+
+def load_recordings(path):
+    """
+    Reads a JSONL file of {"model", "kind", "content", "usage"} records.
+    """
+    recordings = []
+    if not os.path.exists(path):
+        return recordings
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                recordings.append(json.loads(line))
+    return recordings
+
+
+class Recordings:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._by_key = {}
+        for record in load_recordings(path):
+            self._index(record)
+
+    def _index(self, record):
+        self._by_key.setdefault((record.get("model"), record["kind"]), []).append(record)
+        self._by_key.setdefault((None, record["kind"]), []).append(record)
+
+    def pick(self, payload, digest):
+        """
+        Returns a recording for the payload's model and kind, falling back to any model of the same kind.
+        """
+        kind = request_kind(payload)
+        candidates = self._by_key.get((payload.get("model"), kind)) or self._by_key.get((None, kind))
+        if not candidates:
+            return None
+        return candidates[int(digest[:8], 16) % len(candidates)]
+
+    def append(self, record):
+        with self._lock:
+            self._index(record)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+class Behaviour:
+    """
+    Latency and failure knobs. Time to first byte is log-normal around `latency` with spread `jitter` (sigma);
+    the body then takes completion_tokens / tokens_per_second, or nothing when that is 0.
+    """
+
+    def __init__(self, latency=0.5, jitter=0.3, tokens_per_second=0.0, error_rate=0.0, rate_limit=0.0, retry_after=1.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._window = []
+
+    def first_byte_delay(self):
+        if self.latency <= 0:
+            return 0.0
+        with self._lock:
+            return self.latency * math.exp(self._random.gauss(0, self.jitter)) if self.jitter else self.latency
+
+    def generation_time(self, completion_tokens):
+        return completion_tokens / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+    def should_throttle(self):
+        now = time.monotonic()
+        with self._lock:
+            if self.error_rate and self._random.random() < self.error_rate:
+                return True
+            if self.rate_limit:
+                self._window = [started for started in self._window if now - started < 1.0]
+                if len(self._window) >= self.rate_limit:
+                    return True
+                self._window.append(now)
+        return False
+
+
+class Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {}
+
+    def add(self, key):
+        with self._lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def as_dict(self):
+        with self._lock:
+            return dict(self.counts)
+
+
+def _estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+
+def _usage(payload, record):
+    usage = dict(record.get("usage") or {})
+    if "prompt_tokens" not in usage:
+        usage["prompt_tokens"] = _estimate_tokens(json.dumps(payload.get("messages", [])))
+    if "completion_tokens" not in usage:
+        usage["completion_tokens"] = _estimate_tokens(record["content"])
+    usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+    return usage
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _write_chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            self._send_json(200, self.server.stats.as_dict())
+        else:
+            self._send_json(404, {"error": {"message": "Not found", "code": 404}})
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            self._send_json(400, {"error": {"message": "Invalid JSON", "code": 400}})
+            return
+        server.stats.add("requests")
+
+        if server.behaviour.should_throttle():
+            server.stats.add("throttled")
+            self._send_json(429, {"error": {"message": "Rate limit exceeded", "code": 429}},
+                            {"Retry-After": f"{server.behaviour.retry_after:g}"})
+            return
+
+        digest = hashlib.sha256(json.dumps(payload.get("messages", []), sort_keys=True).encode("utf-8")).hexdigest()
+        if server.upstream:
+            record = self._record_upstream(payload)
+            if record is None:
+                return
+        else:
+            record = server.recordings.pick(payload, digest)
+            if record is None:
+                server.stats.add("unmatched")
+                self._send_json(404, {"error": {"message": f"No recording for {payload.get('model')} ({request_kind(payload)})", "code": 404}})
+                return
+
+        server.stats.add(f"{payload.get('model')} {request_kind(payload)}")
+        usage = _usage(payload, record)
+        # A proxied reply has already taken the real time.
+        simulate = not server.upstream
+        if simulate:
+            time.sleep(server.behaviour.first_byte_delay())
+        if payload.get("stream"):
+            server.stats.add("streamed")
+            self._stream(payload, digest, record["content"], usage, simulate)
+        else:
+            if simulate:
+                time.sleep(server.behaviour.generation_time(usage["completion_tokens"]))
+            self._send_json(200, {
+                "id": f"gen-{digest[:16]}",
+                "model": payload.get("model"),
+                "object": "chat.completion",
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": record["content"]}}],
+                "usage": usage,
+            })
+
+    def _stream(self, payload, digest, content, usage, simulate=True):
+        chunks = [content[i:i + _CHUNK_CHARACTERS] for i in range(0, len(content), _CHUNK_CHARACTERS)]
+        pause = self.server.behaviour.generation_time(usage["completion_tokens"]) / max(1, len(chunks)) if simulate else 0.0
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            # OpenRouter keeps the connection open with SSE comments until the model starts producing tokens.
+            self._write_chunk(b": OPENROUTER PROCESSING\n\n")
+            for piece in chunks:
+                event = {"id": f"gen-{digest[:16]}", "model": payload.get("model"), "choices": [{"index": 0, "delta": {"content": piece}}]}
+                self._write_chunk(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+                if pause:
+                    time.sleep(pause)
+            final = {"id": f"gen-{digest[:16]}", "model": payload.get("model"), "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+            if (payload.get("usage") or {}).get("include"):
+                final["usage"] = usage
+            self._write_chunk(f"data: {json.dumps(final)}\n\n".encode("utf-8"))
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client closed the stream early, for example a cancelled request.
+            self.server.stats.add("cancelled")
+            self.close_connection = True
+
+    def _record_upstream(self, payload):
+        import requests
+
+        forwarded = dict(payload, stream=False)
+        forwarded.pop("usage", None)
+        try:
+            response = requests.post(self.server.upstream, json=forwarded, timeout=120, headers={
+                "Authorization": self.headers.get("Authorization", ""),
+                "Content-Type": "application/json",
+            })
+        except requests.exceptions.RequestException as e:
+            self._send_json(502, {"error": {"message": f"Upstream request failed: {e}", "code": 502}})
+            return None
+        if response.status_code != 200:
+            headers = {"Retry-After": response.headers["Retry-After"]} if "Retry-After" in response.headers else None
+            self._send_json(response.status_code, response.json() if response.content else {}, headers)
+            return None
+        body = response.json()
+        record = {
+            "model": payload.get("model"),
+            "kind": request_kind(payload),
+            "content": body["choices"][0]["message"]["content"],
+            "usage": {key: body.get("usage", {}).get(key) for key in ("prompt_tokens", "completion_tokens") if key in body.get("usage", {})},
+        }
+        self.server.recordings.append(record)
+        self.server.stats.add("recorded")
+        return record
+
+
+class FakeOpenRouter(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), recordings=DEFAULT_RECORDINGS, behaviour=None, upstream=None):
+        super().__init__(address, _Handler)
+        self.recordings = Recordings(recordings)
+        self.behaviour = behaviour or Behaviour()
+        self.upstream = upstream
+        self.stats = Stats()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+    def start(self):
+        """
+        Serves from a daemon thread and returns the chat completions URL.
+        """
+        threading.Thread(target=self.serve_forever, name="fake-openrouter", daemon=True).start()
+        return self.url
+
+
+def add_behaviour_arguments(parser):
+    parser.add_argument("--latency", type=float, default=0.5, help="median seconds to first byte")
+    parser.add_argument("--jitter", type=float, default=0.3, help="log-normal spread of the time to first byte")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="generation speed; 0 sends the body at once")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with a 429")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="answer with 429 above this many requests per second")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with each 429")
+    parser.add_argument("--seed", type=int, default=None, help="seed for latency and 429 injection")
+
+
+def behaviour_from_arguments(args):
+    return Behaviour(args.latency, args.jitter, args.tokens_per_second, args.error_rate, args.rate_limit, args.retry_after, args.seed)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--recordings", default=DEFAULT_RECORDINGS, help="JSONL file of recorded responses")
+    parser.add_argument("--upstream", help="proxy to this chat completions URL and append its replies to --recordings")
+    add_behaviour_arguments(parser)
+    args = parser.parse_args(argv)
+
+    server = FakeOpenRouter((args.host, args.port), args.recordings, behaviour_from_arguments(args), args.upstream)
+    mode = f"recording from {args.upstream}" if args.upstream else "replaying"
+    print(f"Fake OpenRouter {mode} {args.recordings} at {server.url}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,172 @@
+import ast
+import re
+from dataclasses import dataclass, field
+
+# Single-pass parser for the extraction model's reply. The prompt in get_question_and_options asks for five
+# sections, each introduced by a header line. Models restyle those headers (**Header:**, ## Header, Header:,
+# "Options Type" for "Option Type"), reorder them and sometimes skip one, so headers are matched loosely and the
+# sections are picked up in whatever order they appear.
+
+# One capture group per section, in this order, so match.lastindex names the section without normalising the header.
+_SECTIONS = (None, "question", "diagram", "options", "options_type", "question_type")
+
+_HEADER = re.compile(
+    r"^[ \t>#*_\"`]*(?:\d+\.[ \t]*)?[*_]*"
+    r"(?i:(question[ \t]+extraction)|(diagram[ \t]+description)|(options?[ \t]+extraction)|(options?[ \t]+type)|(question[ \t]+type))"
+    r"[ \t*_]*(?::[*_]*[ \t]*|$)",
+    re.MULTILINE,
+)
+_WRAPPED = re.compile(r"^(\*\*|__|\*|_)([^*_]+)\1$")
+_EDGE_QUOTES = re.compile(r"^[\s*_\"'`.]+|[\s*_\"'`.]+$")
+
+_OPTION = re.compile(
+    r"^[ \t]*(?:[-*•][ \t]*)?[*_]*\(?([A-Da-d]|[1-4])[).:][*_]*[ \t]+(.+?)[ \t]*$",
+    re.MULTILINE,
+)
+_PLACEHOLDER = re.compile(r"^(?:question|diagram|options?)\s*:\s*no\s+\w+\s+found\.?$", re.IGNORECASE)
+_MATRIX_LITERAL = re.compile(r"\[\s*\[.*?\]\s*,\s*\[.*?\]\s*\]", re.DOTALL)
+_PARAGRAPH = re.compile(r"paragraph\s*:\s*(.*?)(?:questions?\s*:\s*(.*))?$", re.IGNORECASE | re.DOTALL)
+_PARAGRAPH_MARKER = re.compile(r"paragraph\s*:", re.IGNORECASE)
+_NUMBERED_ITEM = re.compile(r"^[ \t]*(?:[-*•]|\(?\d+[).:]|Q\d+[).:]?)[ \t]+(.+?)[ \t]*$", re.MULTILINE)
+
+QUESTION_TYPES = (
+    "Multiple Choice Question",
+    "Numerical Question",
+    "Open Ended Question",
+    "Diagram Question",
+    "Matrix Match Question",
+    "Paragraph Question",
+)
+_QUESTION_TYPE_WORDS = tuple((question_type.lower().replace(" question", ""), question_type) for question_type in QUESTION_TYPES)
+
+
+def _unwrap(text):
+    # "**4**" -> "4", leaving emphasis that only covers part of the text alone.
+    text = text.strip()
+    if text[:1] not in ("*", "_") or text[-1:] != text[:1]:
+        return text
+    match = _WRAPPED.match(text)
+    return match.group(2).strip() if match else text
+
+
+@dataclass
+class Option:
+    label: str
+    text: str
+
+
+@dataclass
+class Extraction:
+    """
+    Parsed extraction reply. The first five fields keep the section text the solver prompt is built from;
+    the rest are structured views of it.
+    """
+    question: str = ""
+    diagram: str = ""
+    options: str = ""
+    options_type: str = ""
+    question_type: str = ""
+    option_list: list = field(default_factory=list)
+    matrix: list = None
+    paragraph: str = ""
+    sub_questions: list = field(default_factory=list)
+
+    def as_dict(self):
+        # dataclasses.asdict deep-copies field by field, which costs more than the parse itself.
+        record = dict(self.__dict__)
+        record["option_list"] = [{"label": option.label, "text": option.text} for option in self.option_list]
+        return record
+
+
+def _add_section(sections, name, body):
+    body = body.strip()
+    previous = sections.get(name)
+    # A repeated header continues its section rather than replacing it.
+    sections[name] = f"{previous}\n{body}" if previous and body else previous or body
+
+
+def _split_sections(content):
+    # Text ahead of the first header is the question when the model left out "Question Extraction:".
+    sections = {}
+    name = "question"
+    start = 0
+    for match in _HEADER.finditer(content):
+        _add_section(sections, name, content[start:match.start()])
+        name = _SECTIONS[match.lastindex]
+        start = match.end()
+    _add_section(sections, name, content[start:])
+    return sections
+
+
+def _canonical_options_type(text):
+    lowered = text.lower()
+    if "multi" in lowered:
+        return "Multi-select"
+    if "single" in lowered:
+        return "Single-select"
+    if "no option" in lowered:
+        return "No options"
+    return _EDGE_QUOTES.sub("", text)
+
+
+def _canonical_question_type(text):
+    lowered = text.lower()
+    for words, question_type in _QUESTION_TYPE_WORDS:
+        if words in lowered:
+            return question_type
+    if "no question" in lowered:
+        return "No question"
+    return _EDGE_QUOTES.sub("", text)
+
+
+def _parse_matrix(question):
+    match = _MATRIX_LITERAL.search(question)
+    if not match:
+        return None
+    try:
+        value = ast.literal_eval(match.group(0))
+    except (ValueError, SyntaxError):
+        return None
+    if isinstance(value, (list, tuple)) and len(value) == 2 and all(isinstance(column, (list, tuple)) for column in value):
+        return [[str(item) for item in column] for column in value]
+    return None
+
+
+def _parse_paragraph(question):
+    match = _PARAGRAPH.search(question)
+    if not match:
+        return "", []
+    paragraph = match.group(1).strip()
+    questions_text = match.group(2) or ""
+    listed = questions_text.strip()
+    if listed.startswith("["):
+        try:
+            value = ast.literal_eval(listed)
+            if isinstance(value, (list, tuple)):
+                return paragraph, [str(item) for item in value]
+        except (ValueError, SyntaxError):
+            pass
+    sub_questions = [_unwrap(item) for item in _NUMBERED_ITEM.findall(questions_text)]
+    if not sub_questions and questions_text.strip():
+        sub_questions = [_unwrap(line) for line in questions_text.splitlines() if line.strip()]
+    return paragraph, sub_questions
+
+
+def parse_extraction(content):
+    """
+    Parses the extraction model's reply into an Extraction.
+    """
+    sections = _split_sections(content.replace("\r\n", "\n") if "\r" in content else content)
+    extraction = Extraction(**{name: sections.get(name, "") for name in ("question", "diagram", "options", "options_type", "question_type")})
+
+    extraction.options_type = _canonical_options_type(extraction.options_type)
+    extraction.question_type = _canonical_question_type(extraction.question_type)
+    if extraction.options and not _PLACEHOLDER.match(extraction.options):
+        extraction.option_list = [Option(label.upper(), _unwrap(text)) for label, text in _OPTION.findall(extraction.options)]
+
+    question = extraction.question
+    if extraction.question_type == "Matrix Match Question" or ("[" in question and "[[" in question.replace(" ", "")):
+        extraction.matrix = _parse_matrix(question)
+    if extraction.question_type == "Paragraph Question" or ("paragraph" in question.lower() and _PARAGRAPH_MARKER.search(question)):
+        extraction.paragraph, extraction.sub_questions = _parse_paragraph(question)
+    return extraction
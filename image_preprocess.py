@@ -0,0 +1,211 @@
+import base64
+import io
+import os
+import sys
+
+from PIL import Image, ImageChops, ImageOps, ImageStat
+
+MAX_EDGE = int(os.getenv("OCR_IMAGE_MAX_EDGE", "1600"))
+OUTPUT_FORMAT = os.getenv("OCR_IMAGE_FORMAT", "jpeg").lower()
+QUALITY = int(os.getenv("OCR_IMAGE_QUALITY", "85"))
+GRAYSCALE = os.getenv("OCR_IMAGE_GRAYSCALE", "auto").lower()
+CROP_TO_CONTENT = os.getenv("OCR_IMAGE_CROP", "1").lower() in ("1", "true", "yes")
+DESKEW = os.getenv("OCR_IMAGE_DESKEW", "1").lower() in ("1", "true", "yes")
+DESKEW_MAX_ANGLE = float(os.getenv("OCR_IMAGE_DESKEW_MAX_ANGLE", "5"))
+LOG_STATS = os.getenv("OCR_IMAGE_LOG_STATS", "").lower() in ("1", "true", "yes")
+
+# A pixel with at least this HSV saturation and value (0-255) counts as coloured, and a page is sent in grayscale
+# only when fewer than _GRAYSCALE_MAX_COLOURED of its pixels are. A mean saturation lets a white page drown out a
+# coloured diagram or label; clean text pages, even as low-quality JPEGs, have no pixels this saturated at all.
+# Tinted paper in phone photos also crosses the limit and keeps its colour, which only costs payload.
+_COLOUR_SATURATION = 80
+_COLOUR_VALUE = 64
+_GRAYSCALE_MAX_COLOURED = 0.00005
+_COLOUR_ANALYSIS_EDGE = 1600
+# A pixel darker than this after autocontrast counts as ink for cropping and deskewing.
+_INK_LEVEL = 160
+_CROP_PADDING = 0.02
+_DESKEW_ANALYSIS_EDGE = 400
+_DESKEW_STEP = 0.25
+_DESKEW_MIN_GAIN = 1.15
+
+_EXIF_ORIENTATION = 0x0112
+
+_FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg"),
+    "jpg": ("JPEG", "image/jpeg"),
+    "webp": ("WEBP", "image/webp"),
+    "png": ("PNG", "image/png"),
+}
+
+
+def _flatten(image):
+    if image.getexif().get(_EXIF_ORIENTATION, 1) != 1:
+        image = ImageOps.exif_transpose(image)
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        rgba = image.convert("RGBA")
+        background = Image.new("RGB", rgba.size, "white")
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        return background
+    if image.mode not in ("RGB", "L"):
+        return image.convert("RGB")
+    return image
+
+
+def _is_text_only(image):
+    if image.mode == "L":
+        return True
+    # Thin coloured strokes fade towards white when an image shrinks, so only very large images are reduced first.
+    if max(image.size) > _COLOUR_ANALYSIS_EDGE:
+        image = image.copy()
+        image.thumbnail((_COLOUR_ANALYSIS_EDGE, _COLOUR_ANALYSIS_EDGE))
+    _, saturation, value = image.convert("HSV").split()
+    coloured = ImageChops.darker(
+        saturation.point(lambda level: 255 if level >= _COLOUR_SATURATION else 0),
+        value.point(lambda level: 255 if level >= _COLOUR_VALUE else 0),
+    )
+    return coloured.histogram()[255] < _GRAYSCALE_MAX_COLOURED * image.width * image.height
+
+
+def _ink_mask(gray):
+    return ImageOps.autocontrast(gray).point(lambda value: 255 if value < _INK_LEVEL else 0)
+
+
+def _crop_to_content(image):
+    gray = image.convert("L")
+    bbox = _ink_mask(gray).getbbox()
+    if not bbox:
+        return image, False
+
+    width, height = image.size
+    pad_x = int(width * _CROP_PADDING)
+    pad_y = int(height * _CROP_PADDING)
+    left, top, right, bottom = bbox
+    bbox = (max(0, left - pad_x), max(0, top - pad_y), min(width, right + pad_x), min(height, bottom + pad_y))
+    if bbox == (0, 0, width, height):
+        return image, False
+    return image.crop(bbox), True
+
+
+def _skew_angle(image):
+    """
+    Projection-profile skew estimate: rotates a small ink mask through +/- DESKEW_MAX_ANGLE and picks the angle
+    whose row profile is spikiest, which is when text lines run horizontally. Searches whole degrees first and
+    then quarter degrees around the best one.
+    """
+    gray = image.convert("L")
+    gray.thumbnail((_DESKEW_ANALYSIS_EDGE, _DESKEW_ANALYSIS_EDGE))
+    mask = _ink_mask(gray)
+    height = mask.size[1]
+
+    def score(angle):
+        rows = mask.rotate(angle, resample=Image.NEAREST).resize((1, height), Image.BOX)
+        return ImageStat.Stat(rows).var[0]
+
+    level_score = score(0.0)
+    best_angle = 0.0
+    best_score = level_score
+
+    # Coarse pass in whole degrees, then refine around the best one.
+    coarse_steps = int(DESKEW_MAX_ANGLE)
+    candidates = [float(step) for step in range(-coarse_steps, coarse_steps + 1)]
+    for refine in (False, True):
+        for angle in candidates:
+            if angle and abs(angle) <= DESKEW_MAX_ANGLE:
+                angle_score = score(angle)
+                if angle_score > best_score:
+                    best_score = angle_score
+                    best_angle = angle
+        if not refine:
+            fine_steps = int(1 / _DESKEW_STEP)
+            candidates = [best_angle + step * _DESKEW_STEP for step in range(-fine_steps + 1, fine_steps) if step]
+
+    # Pages with little text have flat profiles; don't rotate them on noise.
+    if best_score < level_score * _DESKEW_MIN_GAIN:
+        return 0.0
+    return best_angle
+
+
+def preprocess_image(image):
+    """
+    Shrinks an image before it is sent to the vision model: flattens transparency, downscales to MAX_EDGE on the
+    long side, drops colour on text-only pages, deskews and crops to the inked area.
+
+    Returns (image, steps) where steps lists what was applied.
+    """
+    image = _flatten(image)
+    steps = {"grayscale": False, "deskew_angle": 0.0, "cropped": False, "downscaled": False}
+
+    # Downscale first so every later step works on the smaller image.
+    if MAX_EDGE and max(image.size) > MAX_EDGE:
+        image = image.copy()
+        image.thumbnail((MAX_EDGE, MAX_EDGE), Image.LANCZOS)
+        steps["downscaled"] = True
+
+    if GRAYSCALE == "always" or (GRAYSCALE == "auto" and _is_text_only(image)):
+        image = image.convert("L")
+        steps["grayscale"] = True
+
+    if DESKEW:
+        angle = _skew_angle(image)
+        if angle:
+            fill = 255 if image.mode == "L" else (255, 255, 255)
+            image = image.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=fill)
+            steps["deskew_angle"] = angle
+
+    if CROP_TO_CONTENT:
+        image, steps["cropped"] = _crop_to_content(image)
+
+    return image, steps
+
+
+def encode_image(image, output_format=OUTPUT_FORMAT, quality=QUALITY):
+    """
+    Encodes a preprocessed image. Returns (bytes, mime type).
+    """
+    pil_format, mime_type = _FORMATS.get(output_format, _FORMATS["jpeg"])
+    buffer = io.BytesIO()
+    if pil_format == "JPEG":
+        image.save(buffer, format="JPEG", quality=quality, optimize=True)
+    elif pil_format == "WEBP":
+        image.save(buffer, format="WEBP", quality=quality, method=4)
+    else:
+        image.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue(), mime_type
+
+
+def encode_image_file(image_path):
+    """
+    Opens, preprocesses and encodes an image file as a base64 data URL for the vision model.
+
+    Returns (data_url, stats) where stats records the byte counts before and after and the steps applied.
+    """
+    with Image.open(image_path) as image:
+        original_size = image.size
+        if MAX_EDGE and max(original_size) > MAX_EDGE:
+            # Lets the JPEG decoder scale down by a power of two while decoding, much cheaper than a full decode.
+            scale = MAX_EDGE / max(original_size)
+            image.draft("RGB", (int(original_size[0] * scale), int(original_size[1] * scale)))
+        image.load()
+        processed, steps = preprocess_image(image)
+
+    encoded, mime_type = encode_image(processed)
+    data_url = f"data:{mime_type};base64,{base64.b64encode(encoded).decode('utf-8')}"
+
+    stats = {
+        "original_bytes": os.path.getsize(image_path),
+        "encoded_bytes": len(encoded),
+        "payload_bytes": len(data_url),
+        "original_size": original_size,
+        "final_size": processed.size,
+        "mime_type": mime_type,
+        **steps,
+    }
+    if LOG_STATS:
+        print(
+            f"Image preprocessing: {stats['original_bytes']} -> {stats['encoded_bytes']} bytes "
+            f"({original_size[0]}x{original_size[1]} -> {processed.size[0]}x{processed.size[1]} {mime_type}, "
+            f"grayscale={steps['grayscale']}, deskew={steps['deskew_angle']}, cropped={steps['cropped']})",
+            file=sys.stderr,
+        )
+    return data_url, stats
@@ -1,10 +1,11 @@
 const express = require('express');
-const { spawn } = require('child_process');
 const multer = require('multer');
 const path = require('path');
 const fs = require('fs');
 const dotenv = require('dotenv');
 const { v4: uuidv4 } = require('uuid');
+const { OcrWorkerPool } = require('./ocrWorkerPool');
+const metrics = require('./metrics');
 
 dotenv.config();
 
@@ -36,59 +37,108 @@ const upload = multer({
 
 const app = express();
 app.use(express.static(path.join(__dirname, '.')));
-const port = 3002;
+const port = parseInt(process.env.PORT || '3002', 10);
+
+// Long-lived OCR.py workers, so uploads don't pay Python startup and imports on every request
+const ocrPool = new OcrWorkerPool({
+  size: parseInt(process.env.OCR_WORKERS || '4', 10),
+  pythonBin: process.env.PYTHON_BIN || 'python',
+  jobTimeoutMs: parseFloat(process.env.OCR_JOB_TIMEOUT || '300') * 1000,
+  onMetrics: (stages, queueSeconds) => {
+    metrics.queueWait.observe({}, queueSeconds);
+    metrics.observeStages(stages);
+  },
+}).start();
 
 // Function to run the Python script
-async function runPythonScript(imagePath, hyperbolicApiKey, openRouterApiKey) {
+async function runPythonScript(imagePath, onToken) {
   try {
-    const pythonProcess = spawn('python', ['OCR.py', imagePath, hyperbolicApiKey, openRouterApiKey], { encoding: 'utf8' });
-
-    let output = '';
-    for await (const chunk of pythonProcess.stdout) {
-      output += chunk;
-    }
-
-    let errorOutput = '';
-    for await (const chunk of pythonProcess.stderr){
-      errorOutput += chunk;
-    }
-
-
-    return new Promise((resolve, reject) => {
-       pythonProcess.on('close', (code) => {
-         if (code === 0) {
-            resolve(output);
-        } else {
-             console.error("Python script error output: ", errorOutput);
-            reject(new Error(`Python script failed with code ${code}`));
-        }
-       });
-    });
+    return await ocrPool.run(path.resolve(imagePath), { onToken });
   } catch (error) {
-    console.error(error);
+    console.error("Python worker error: ", error);
     throw error;
   }
 }
 
 
+function observeRequest(route, outcome, start) {
+  metrics.requestDuration.observe({ route, outcome }, Number(process.hrtime.bigint() - start) / 1e9);
+}
+
 app.post('/upload', upload.single('image'), async (req, res) => {
+  const start = process.hrtime.bigint();
   try {
         if (!req.file) {
             return res.status(400).send('No file uploaded or invalid file');
         }
 
       const imagePath = req.file.path;
-       const hyperbolicApiKey = process.env.HYPERBOLIC_API_KEY;
-       const openRouterApiKey = process.env.OPENROUTER_API_KEY;
-
-    const output = await runPythonScript(imagePath, hyperbolicApiKey, openRouterApiKey);
+    const output = await runPythonScript(imagePath);
     fs.promises.unlink(imagePath) //Delete the temp file asynchronously
      res.send(output);
+    observeRequest('/upload', 'ok', start);
   }
   catch (error){
      console.error("Error processing image:", error);
        res.status(500).send(error.message);
+    observeRequest('/upload', 'error', start);
+    }
+});
+
+function sendEvent(res, event, data) {
+  res.write(`event: ${event}\ndata: ${JSON.stringify(data)}\n\n`);
+}
+
+// Same as /upload, but relays the answer as server-sent events while it is generated:
+// `token` events carry raw answer text, then one `done` event carries the final formatted output (or `error`).
+app.post('/upload/stream', upload.single('image'), async (req, res) => {
+  if (!req.file) {
+    return res.status(400).send('No file uploaded or invalid file');
+  }
+
+  const imagePath = req.file.path;
+  const start = process.hrtime.bigint();
+  let outcome = 'ok';
+  let clientGone = false;
+  res.on('close', () => {
+    clientGone = true;
+  });
+
+  res.writeHead(200, {
+    'Content-Type': 'text/event-stream; charset=utf-8',
+    'Cache-Control': 'no-cache',
+    'Connection': 'keep-alive',
+    'X-Accel-Buffering': 'no',
+  });
+  res.flushHeaders();
+
+  try {
+    const output = await runPythonScript(imagePath, (text) => {
+      if (!clientGone) {
+        sendEvent(res, 'token', { text });
+      }
+    });
+    if (!clientGone) {
+      sendEvent(res, 'done', { output });
+    }
+  } catch (error) {
+    console.error("Error processing image:", error);
+    outcome = 'error';
+    if (!clientGone) {
+      sendEvent(res, 'error', { message: error.message });
     }
+  } finally {
+    fs.promises.unlink(imagePath).catch((error) => console.error("Failed to delete upload:", error));
+    res.end();
+    observeRequest('/upload/stream', outcome, start);
+  }
+});
+
+// Prometheus scrape endpoint: request latency, worker queue wait and the per-stage timings, bytes and
+// token usage the OCR workers report with each result.
+app.get('/metrics', (req, res) => {
+  res.set('Content-Type', 'text/plain; version=0.0.4; charset=utf-8');
+  res.send(metrics.registry.render());
 });
 
 app.get('/', (req, res) => {
@@ -0,0 +1,231 @@
+import re
+
+# Local stand-in for the Gemini "fix the markdown" pass in get_answer_from_question. It applies the same
+# guidelines that prompt asks for, deterministically:
+#   - ``` only for real code, never for equations
+#   - - for bullet points
+#   - ## headers with blank lines around them
+#   - $$...$$ for display maths and $...$ for inline maths, with unbalanced delimiters repaired
+#   - \begin{...}/\end{...} environments balanced
+# validate_markdown reports anything it could not repair so the caller can fall back to the LLM pass.
+
+_FENCE = re.compile(r"^([ \t]*)```[ \t]*([\w+-]*)[ \t]*\n(.*?)\n?[ \t]*```[ \t]*$", re.MULTILINE | re.DOTALL)
+_INLINE_CODE = re.compile(r"`[^`\n]+`")
+_PLACEHOLDER = re.compile(r"\x00(\d+)\x00")
+_EQUATION_PLACEHOLDER = re.compile(r"\x02(\d+)\x02")
+
+_MATH_FENCE_LANGUAGES = {"latex", "tex", "math", "katex", "mathjax"}
+_LATEX_COMMAND = re.compile(r"\\[A-Za-z]+")
+_CODE_HINT = re.compile(r"\b(def|return|import|print|function|class|for|while|var|let|const|int|void)\b|;\s*$|#include", re.MULTILINE)
+
+_DISPLAY_BRACKETS = re.compile(r"\\\[(.+?)\\\]", re.DOTALL)
+_INLINE_PARENS = re.compile(r"\\\((.+?)\\\)", re.DOTALL)
+
+_HEADER_NO_SPACE = re.compile(r"^(#{1,6})(?=[^#\s])", re.MULTILINE)
+_TOP_HEADER = re.compile(r"^# ", re.MULTILINE)
+_HEADER_LINE = re.compile(r"^#{1,6} .*$", re.MULTILINE)
+_BOLD_TITLE_LINE = re.compile(r"^[ \t]*\*\*([^*\n]{1,60}?):?\*\*:?[ \t]*$", re.MULTILINE)
+_BULLET = re.compile(r"^([ \t]*)(?:[*+\u2022\u2023\u25e6])[ \t]+", re.MULTILINE)
+
+_SINGLE_DOLLAR = re.compile(r"(?<![$\\])\$(?!\$)")
+_CURRENCY = re.compile(r"\$\d[\d,.]*(?![^$\s]*\$)")
+# Lines that start a block of their own in markdown: list items, headers and quotes.
+_BLOCK_START = re.compile(r"[ \t]*(?:[-+*][ \t]|\d+[.)][ \t]|#{1,6} |>)")
+# An escaped $ that isn't a currency amount, so _repair_inline_dollars had to guess which one was stray.
+_GUESSED_ESCAPE = re.compile(r"&#36;(?!\d)")
+_DISPLAY_MATH = re.compile(r"\$\$(.*?)\$\$", re.DOTALL)
+_ENVIRONMENT = re.compile(r"\\(begin|end)\{([^}]+)\}")
+_TRAILING_SPACE = re.compile(r"[ \t]+$", re.MULTILINE)
+_EXTRA_BLANK_LINES = re.compile(r"\n{3,}")
+
+
+def _protect_code(text):
+    """
+    Swaps real code blocks and inline code spans for placeholders so later passes leave them alone.
+    Fenced blocks that only contain maths are turned into $$ blocks instead.
+    """
+    saved = []
+
+    def save(fragment):
+        saved.append(fragment)
+        return f"\x00{len(saved) - 1}\x00"
+
+    def fence(match):
+        indent, language, body = match.group(1), match.group(2).lower(), match.group(3)
+        if _is_math(language, body):
+            equation = body.strip().strip("$").strip()
+            return f"{indent}$$\n{equation}\n$$"
+        return save(match.group(0))
+
+    text = _FENCE.sub(fence, text)
+    text = _INLINE_CODE.sub(lambda match: save(match.group(0)), text)
+    return text, saved
+
+
+def _restore_code(text, saved):
+    return _PLACEHOLDER.sub(lambda match: saved[int(match.group(1))], text)
+
+
+def _is_math(language, body):
+    if language in _MATH_FENCE_LANGUAGES:
+        return True
+    if language or not body.strip():
+        return False
+    if _CODE_HINT.search(body):
+        return False
+    return bool(_LATEX_COMMAND.search(body)) or body.strip().startswith("$")
+
+
+def _balance_environments(math):
+    """
+    Drops \\end{...} with no matching \\begin and closes any \\begin left open, innermost first.
+    """
+    stack = []
+    pieces = []
+    position = 0
+    for match in _ENVIRONMENT.finditer(math):
+        kind, name = match.groups()
+        if kind == "begin":
+            stack.append(name)
+        elif stack and stack[-1] == name:
+            stack.pop()
+        elif name in stack:
+            # Close the environments that were left open inside this one.
+            while stack[-1] != name:
+                pieces.append(math[position:match.start()])
+                pieces.append(f"\\end{{{stack.pop()}}}")
+                position = match.start()
+            stack.pop()
+        else:
+            pieces.append(math[position:match.start()])
+            position = match.end()
+    pieces.append(math[position:])
+    balanced = "".join(pieces)
+    while stack:
+        balanced = balanced.rstrip() + f"\n\\end{{{stack.pop()}}}"
+    return balanced
+
+
+def _close_display_math(text):
+    """
+    An odd number of $$ means the last block was never closed; close it at the end of its paragraph.
+    """
+    if text.count("$$") % 2 == 0:
+        return text
+    opening = text.rfind("$$")
+    paragraph_end = text.find("\n\n", opening)
+    if paragraph_end == -1:
+        return text.rstrip() + "$$"
+    return text[:paragraph_end].rstrip() + "$$" + text[paragraph_end:]
+
+
+def _split_blocks(text):
+    """
+    Splits text into the blocks markdown renders separately (paragraphs, list items, headers), each with the
+    newlines inside it. MathJax pairs $ delimiters across lines of one block but not across blocks.
+    """
+    blocks = []
+    for line in text.split("\n"):
+        if blocks and line.strip() and blocks[-1][-1].strip() and not _BLOCK_START.match(line):
+            blocks[-1].append(line)
+        else:
+            blocks.append([line])
+    return ["\n".join(lines) for lines in blocks]
+
+
+def _repair_inline_dollars(block):
+    """
+    A block with an odd number of single $ has a stray one, usually a currency sign. That one (or failing that,
+    the last one) is turned into an HTML entity so MathJax does not pair it with maths further on.
+    """
+    singles = [match.start() for match in _SINGLE_DOLLAR.finditer(block)]
+    if len(singles) % 2 == 0:
+        return block
+    stray = next((position for position in singles if _CURRENCY.match(block, position)), singles[-1])
+    return block[:stray] + "&#36;" + block[stray + 1:]
+
+
+def _dollar_problem(block):
+    singles = [match.start() for match in _SINGLE_DOLLAR.finditer(block)]
+    if len(singles) % 2:
+        return "unbalanced $ delimiters"
+    # A closing $ right before a digit is almost always two currency amounts paired up, as in "$10 vs $20".
+    if any(block[position + 1:position + 2].isdigit() for position in singles[1::2]):
+        return "$ delimiters pairing currency amounts"
+    if _GUESSED_ESCAPE.search(block):
+        return "stray $ escaped by guess"
+    return None
+
+
+def _space_headers(text):
+    text = _HEADER_NO_SPACE.sub(r"\1 ", text)
+    text = _TOP_HEADER.sub("## ", text)
+    text = _HEADER_LINE.sub(lambda match: f"\n{match.group(0)}\n", text)
+    return text
+
+
+def normalize_markdown(text):
+    """
+    Formats a model answer for the website the way the Gemini reformat prompt asks, without a model call.
+    """
+    text = text.replace("\r\n", "\n").strip()
+    text, saved = _protect_code(text)
+
+    text = _DISPLAY_BRACKETS.sub(lambda match: f"$${match.group(1).strip()}$$", text)
+    text = _INLINE_PARENS.sub(lambda match: f"${match.group(1).strip()}$", text)
+
+    text = _close_display_math(text)
+
+    # Keep display maths out of the line-based passes below.
+    equations = []
+
+    def hide_equation(match):
+        equations.append(f"$${_balance_environments(match.group(1))}$$")
+        return f"\x02{len(equations) - 1}\x02"
+
+    text = _DISPLAY_MATH.sub(hide_equation, text)
+    text = _BOLD_TITLE_LINE.sub(lambda match: f"## {match.group(1).strip()}", text)
+    text = _BULLET.sub(r"\1- ", text)
+    text = _space_headers(text)
+    if "$" in text:
+        text = "\n".join(_repair_inline_dollars(block) if "$" in block else block for block in _split_blocks(text))
+    # Environments written straight into the text, which MathJax renders without $$ delimiters.
+    if "\\begin" in text or "\\end" in text:
+        text = _balance_environments(text)
+    text = _EQUATION_PLACEHOLDER.sub(lambda match: equations[int(match.group(1))], text)
+
+    text = _TRAILING_SPACE.sub("", text)
+    text = _EXTRA_BLANK_LINES.sub("\n\n", text)
+    return _restore_code(text, saved).strip()
+
+
+def validate_markdown(text):
+    """
+    Returns a list of formatting problems in text; an empty list means it is safe to render.
+    """
+    problems = []
+    text, _ = _protect_code(text)
+    if not text.strip():
+        problems.append("empty answer")
+    if "```" in text:
+        problems.append("unbalanced code fence")
+    if text.count("$$") % 2:
+        problems.append("unbalanced $$ delimiters")
+
+    stack = []
+    for kind, name in _ENVIRONMENT.findall(text):
+        if kind == "begin":
+            stack.append(name)
+        elif not stack or stack.pop() != name:
+            problems.append(f"mismatched \\end{{{name}}}")
+            break
+    if stack:
+        problems.append(f"unclosed \\begin{{{stack[-1]}}}")
+
+    outside = _DISPLAY_MATH.sub("", text)
+    for block in _split_blocks(outside):
+        problem = _dollar_problem(block)
+        if problem:
+            problems.append(problem)
+            break
+    return problems
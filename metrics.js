@@ -0,0 +1,148 @@
+// Minimal Prometheus text-format metrics: counters and cumulative histograms with labels.
+// Rendered by GET /metrics in index.js.
+
+const DURATION_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120];
+const BYTE_BUCKETS = [1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216];
+const TOKEN_BUCKETS = [16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384];
+
+function escapeLabel(value) {
+  return String(value).replace(/\\/g, '\\\\').replace(/"/g, '\\"').replace(/\n/g, '\\n');
+}
+
+function labelKey(labels) {
+  return Object.keys(labels).sort().map((name) => `${name}="${escapeLabel(labels[name])}"`).join(',');
+}
+
+class Counter {
+  constructor(name, help) {
+    this.name = name;
+    this.help = help;
+    this.values = new Map();
+  }
+
+  inc(labels = {}, value = 1) {
+    const key = labelKey(labels);
+    this.values.set(key, (this.values.get(key) || 0) + value);
+  }
+
+  render() {
+    const lines = [`# HELP ${this.name} ${this.help}`, `# TYPE ${this.name} counter`];
+    for (const [key, value] of this.values) {
+      lines.push(`${this.name}${key ? `{${key}}` : ''} ${value}`);
+    }
+    return lines.join('\n');
+  }
+}
+
+class Histogram {
+  constructor(name, help, buckets = DURATION_BUCKETS) {
+    this.name = name;
+    this.help = help;
+    this.buckets = buckets;
+    this.series = new Map();
+  }
+
+  observe(labels, value) {
+    const key = labelKey(labels);
+    let series = this.series.get(key);
+    if (!series) {
+      series = { counts: new Array(this.buckets.length).fill(0), sum: 0, count: 0 };
+      this.series.set(key, series);
+    }
+    // Counts are stored per bucket and made cumulative when rendered.
+    const index = this.buckets.findIndex((bound) => value <= bound);
+    if (index !== -1) {
+      series.counts[index] += 1;
+    }
+    series.sum += value;
+    series.count += 1;
+  }
+
+  render() {
+    const lines = [`# HELP ${this.name} ${this.help}`, `# TYPE ${this.name} histogram`];
+    for (const [key, series] of this.series) {
+      const prefix = key ? `${key},` : '';
+      let cumulative = 0;
+      this.buckets.forEach((bound, i) => {
+        cumulative += series.counts[i];
+        lines.push(`${this.name}_bucket{${prefix}le="${bound}"} ${cumulative}`);
+      });
+      lines.push(`${this.name}_bucket{${prefix}le="+Inf"} ${series.count}`);
+      lines.push(`${this.name}_sum${key ? `{${key}}` : ''} ${series.sum}`);
+      lines.push(`${this.name}_count${key ? `{${key}}` : ''} ${series.count}`);
+    }
+    return lines.join('\n');
+  }
+}
+
+class Registry {
+  constructor() {
+    this.metrics = [];
+  }
+
+  counter(name, help) {
+    const metric = new Counter(name, help);
+    this.metrics.push(metric);
+    return metric;
+  }
+
+  histogram(name, help, buckets) {
+    const metric = new Histogram(name, help, buckets);
+    this.metrics.push(metric);
+    return metric;
+  }
+
+  render() {
+    return this.metrics.map((metric) => metric.render()).join('\n\n') + '\n';
+  }
+}
+
+const registry = new Registry();
+
+const requestDuration = registry.histogram('ocr_request_duration_seconds', 'Time to answer an upload, by route and outcome.');
+const queueWait = registry.histogram('ocr_worker_queue_seconds', 'Time an upload waited for a free OCR worker.');
+const stageDuration = registry.histogram('ocr_stage_duration_seconds', 'Wall time per pipeline stage, including rate-limit waits and retries.');
+const stageQueued = registry.histogram('ocr_stage_queued_seconds', 'Time an OpenRouter call spent on rate-limit waits, failed attempts and backoff.');
+const stageBytes = registry.histogram('ocr_stage_payload_bytes', 'Bytes per stage, by direction (image, request or response).', BYTE_BUCKETS);
+const stageTokens = registry.histogram('ocr_stage_tokens', 'OpenRouter token usage per call, by kind (prompt or completion).', TOKEN_BUCKETS);
+const tokensTotal = registry.counter('ocr_tokens_total', 'OpenRouter tokens used, by stage and kind.');
+const cacheHits = registry.counter('ocr_stage_cache_hits_total', 'Stages answered from the result cache.');
+const retries = registry.counter('ocr_stage_retries_total', 'OpenRouter attempts that were retried.');
+const hedges = registry.counter('ocr_stage_hedges_total', 'Hedged OpenRouter calls, by the attempt that won (primary or hedge).');
+
+// Records the `metrics` block an OCR worker attaches to each result (see stage_metrics.py).
+function observeStages(metrics) {
+  for (const [stage, values] of Object.entries(metrics.stages || {})) {
+    if (values.seconds !== undefined) {
+      stageDuration.observe({ stage }, values.seconds);
+    }
+    if (values.calls) {
+      stageQueued.observe({ stage }, values.queued || 0);
+      stageBytes.observe({ stage, direction: 'request' }, values.request_bytes || 0);
+      stageBytes.observe({ stage, direction: 'response' }, values.response_bytes || 0);
+    }
+    if (values.payload_bytes !== undefined) {
+      stageBytes.observe({ stage, direction: 'image' }, values.payload_bytes);
+    }
+    for (const kind of ['prompt', 'completion']) {
+      const tokens = values[`${kind}_tokens`];
+      if (tokens !== undefined) {
+        stageTokens.observe({ stage, kind }, tokens);
+        tokensTotal.inc({ stage, kind }, tokens);
+      }
+    }
+    if (values.cache_hits) {
+      cacheHits.inc({ stage }, values.cache_hits);
+    }
+    if (values.retries) {
+      retries.inc({ stage }, values.retries);
+    }
+    if (values.hedges) {
+      const hedgeWins = values.hedge_wins || 0;
+      hedges.inc({ stage, winner: 'hedge' }, hedgeWins);
+      hedges.inc({ stage, winner: 'primary' }, values.hedges - hedgeWins);
+    }
+  }
+}
+
+module.exports = { Counter, Histogram, Registry, registry, requestDuration, queueWait, observeStages };
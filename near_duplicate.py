@@ -0,0 +1,392 @@
+import io
+import math
+import os
+import sys
+import threading
+from array import array
+from itertools import accumulate
+
+from PIL import Image, ImageChops, ImageFilter, ImageOps
+
+import result_cache
+
+NEAR_DUPLICATE_DISABLED = os.getenv("OCR_NEAR_DUPLICATE_DISABLED", "").lower() in ("1", "true", "yes")
+HAMMING_THRESHOLD = int(os.getenv("OCR_PHASH_THRESHOLD", "4"))
+
+_HASH_BITS = 64
+# HammingIndex rebuilds its sorted tables once this many entries, or a quarter of its size, were added since the last build.
+_MIN_REBUILD = 1024
+
+# A pHash match is only a candidate: JEE questions that differ only in their numbers (2 kg vs 5 kg, 30 vs 60 degrees)
+# hash within a few bits of each other. Candidates are confirmed by comparing the two images' ink in grayscale, at
+# most _DETAIL_WIDTH pixels wide and softened by _DETAIL_BLUR. The difference is averaged over cells a
+# _DETAIL_CELL_LINES-th of a text line tall, and a cell whose mean (0-255) exceeds _DETAIL_MAX_CHANGE rejects the
+# match; the images are also tried one pixel apart in each direction to absorb cropping jitter. A changed digit
+# leaves 40+ in its cell at any text size, while re-encoding, brightness and margins stay below about 15. Copies that
+# fail the check, such as rescaled screenshots, rotated photos or text under _DETAIL_MIN_LINE pixels per line, just
+# miss the cache.
+_DETAIL_SOURCE_EDGE = 1600
+_DETAIL_WIDTH = 768
+_DETAIL_LEVELS = 16
+_DETAIL_BLUR = 0.7
+_DETAIL_CELL_LINES = 3
+_DETAIL_MAX_CHANGE = 24
+_DETAIL_MIN_LINE = 8
+_INK_LEVEL = 160
+
+def _trim_background(image):
+    """
+    Crops uniform margins so the same question photographed with a looser or tighter crop hashes alike.
+    """
+    background = Image.new(image.mode, image.size, image.getpixel((0, 0)))
+    difference = ImageChops.difference(image, background).point(lambda value: 255 if value > 24 else 0)
+    bbox = difference.getbbox()
+    return image.crop(bbox) if bbox else image
+
+
+_DCT_SIZE = 32
+_DCT_KEEP = 8
+_DCT_BASIS = [
+    [math.cos(math.pi * (2 * x + 1) * u / (2 * _DCT_SIZE)) for x in range(_DCT_SIZE)]
+    for u in range(_DCT_KEEP)
+]
+
+
+def phash(image):
+    """
+    64-bit DCT perceptual hash of a PIL image.
+
+    The image is reduced to grayscale, trimmed to its content and auto-contrasted before hashing, and only the
+    8x8 lowest DCT frequencies are kept, so brightness changes, margins and JPEG re-encoding barely move the hash.
+    """
+    gray = image.convert("L")
+    gray.thumbnail((512, 512))
+    gray = ImageOps.autocontrast(_trim_background(gray))
+    pixels = gray.resize((_DCT_SIZE, _DCT_SIZE), Image.LANCZOS).tobytes()
+
+    # Separable 2D DCT-II, computing only the low-frequency block we keep.
+    row_coefficients = []
+    for y in range(_DCT_SIZE):
+        row = pixels[y * _DCT_SIZE:(y + 1) * _DCT_SIZE]
+        row_coefficients.append([sum(c * p for c, p in zip(basis, row)) for basis in _DCT_BASIS])
+    coefficients = []
+    for basis in _DCT_BASIS:
+        for u in range(_DCT_KEEP):
+            coefficients.append(sum(basis[y] * row_coefficients[y][u] for y in range(_DCT_SIZE)))
+
+    # The DC term only tracks overall brightness, so leave it out of the median.
+    median = sorted(coefficients[1:])[len(coefficients) // 2 - 1]
+    value = 0
+    for coefficient in coefficients:
+        value = (value << 1) | (coefficient > median)
+    return value
+
+
+def detail_fingerprint(image):
+    """
+    Grayscale ink image used to confirm a pHash match: the image's inked area, at most _DETAIL_WIDTH pixels wide,
+    inverted so ink is bright, and reduced to _DETAIL_LEVELS levels to keep the stored PNG small.
+    """
+    gray = image.convert("L")
+    gray.thumbnail((_DETAIL_SOURCE_EDGE, _DETAIL_SOURCE_EDGE), Image.LANCZOS)
+    gray = ImageOps.autocontrast(gray)
+    bbox = gray.point(lambda value: 255 if value < _INK_LEVEL else 0).getbbox()
+    if bbox:
+        gray = gray.crop(bbox)
+    if gray.width > _DETAIL_WIDTH:
+        gray = gray.resize((_DETAIL_WIDTH, max(1, round(_DETAIL_WIDTH * gray.height / gray.width))), Image.LANCZOS)
+    step = 256 // _DETAIL_LEVELS
+    ink = ImageOps.invert(ImageOps.autocontrast(gray)).point(lambda value: value // step * 255 // (_DETAIL_LEVELS - 1))
+    buffer = io.BytesIO()
+    ink.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def _line_height(ink):
+    """
+    Median height in pixels of the runs of inked rows in an ink image, i.e. roughly the height of a line of text.
+    """
+    rows = ink.point(lambda value: 255 if value >= 128 else 0).resize((1, ink.height), Image.BOX).tobytes()
+    runs = []
+    run = 0
+    for value in rows + b"\0":
+        if value:
+            run += 1
+        elif run:
+            runs.append(run)
+            run = 0
+    return sorted(runs)[len(runs) // 2] if runs else 0
+
+
+def details_match(first, second):
+    """
+    True when two detail fingerprints show the same content, to within re-encoding noise and a pixel of cropping.
+    """
+    first_ink = Image.open(io.BytesIO(first))
+    second_ink = Image.open(io.BytesIO(second))
+    # Different aspect ratios can't be the same question.
+    if abs(first_ink.height / first_ink.width - second_ink.height / second_ink.width) > 0.05 * first_ink.height / first_ink.width:
+        return False
+    # Compare at the resolution the smaller image actually has.
+    if first_ink.width > second_ink.width:
+        first_ink, second_ink = second_ink, first_ink
+    line = _line_height(first_ink)
+    # Text this small can't show which digit is which, so a match can't be confirmed either way.
+    if line < _DETAIL_MIN_LINE or first_ink.width < 3 or first_ink.height < 3:
+        return False
+    soften = ImageFilter.GaussianBlur(_DETAIL_BLUR)
+    first_ink = first_ink.filter(soften)
+    second_ink = second_ink.resize(first_ink.size, Image.LANCZOS).filter(soften)
+    cell = max(2, round(line / _DETAIL_CELL_LINES))
+    width, height = first_ink.size
+    inner = first_ink.crop((1, 1, width - 1, height - 1))
+    for dx in (0, -1, 1):
+        for dy in (0, -1, 1):
+            shifted = second_ink.crop((1 + dx, 1 + dy, width - 1 + dx, height - 1 + dy))
+            if ImageChops.difference(inner, shifted).reduce(cell).getextrema()[1] <= _DETAIL_MAX_CHANGE:
+                return True
+    return False
+
+
+def image_fingerprints(image_path):
+    """
+    Opens the image once and returns (exact cache key, phash, detail fingerprint). Each value is None if it couldn't
+    be computed.
+    """
+    try:
+        with Image.open(image_path) as image:
+            image.load()
+            return result_cache.image_cache_key(image), phash(image), detail_fingerprint(image)
+    except Exception as e:
+        print(f"Warning: Could not fingerprint image for the result cache: {e}", file=sys.stderr)
+        return None, None, None
+
+
+class HammingIndex:
+    """
+    In-memory multi-index hash table for 64-bit hashes.
+
+    The hash is split into threshold + 1 disjoint blocks. Any hash within `threshold` bits of the query must match
+    it exactly on at least one block (pigeonhole), so a lookup only compares against the few entries sharing a
+    block value instead of walking the whole set. With the default threshold of 4 each block is 12-13 bits wide,
+    which keeps candidate lists short well past a million entries.
+
+    Entries live in flat arrays rather than Python objects: each one's hash and integer id, and per block its
+    position in a table sorted by block value, with an offsets table marking where each value's run starts. That is
+    36 bytes an entry at the default threshold, about 36 MB per million. Entries added after the tables were built
+    go into small per-block dicts until those reach a quarter of the tables' size, when the tables are rebuilt;
+    rebuilding takes about 3 seconds per million entries.
+    """
+
+    def __init__(self, threshold=HAMMING_THRESHOLD):
+        self.threshold = threshold
+        block_count = threshold + 1
+        widths = [_HASH_BITS // block_count + (1 if i < _HASH_BITS % block_count else 0) for i in range(block_count)]
+        self._blocks = []
+        shift = 0
+        for width in widths:
+            self._blocks.append((shift, (1 << width) - 1))
+            shift += width
+        self._hashes = array("Q")
+        # An id of 0 marks a removed entry.
+        self._ids = array("q")
+        self._offsets = [array("I", bytes(4 * (mask + 2))) for _, mask in self._blocks]
+        self._sorted = [array("I") for _ in self._blocks]
+        self._built = 0
+        self._recent = [{} for _ in self._blocks]
+        self._removed = 0
+
+    def __len__(self):
+        return len(self._hashes) - self._removed
+
+    def add(self, value, entry_id):
+        self.extend([(value, entry_id)])
+
+    def extend(self, entries):
+        """
+        Adds (hash, id) pairs. Ids must be positive integers.
+        """
+        start = len(self._hashes)
+        for value, entry_id in entries:
+            self._hashes.append(value)
+            self._ids.append(entry_id)
+        if len(self._hashes) - self._built > max(_MIN_REBUILD, self._built // 4):
+            self._build()
+            return
+        for position in range(start, len(self._hashes)):
+            value = self._hashes[position]
+            for table, (shift, mask) in zip(self._recent, self._blocks):
+                table.setdefault((value >> shift) & mask, []).append(position)
+
+    def _build(self):
+        # Counting sort of every entry by each block's value: one pass to count, one to place.
+        hashes = self._hashes
+        for index, (shift, mask) in enumerate(self._blocks):
+            block_values = [(value >> shift) & mask for value in hashes]
+            counts = [0] * (mask + 2)
+            for block_value in block_values:
+                counts[block_value + 1] += 1
+            offsets = list(accumulate(counts))
+            self._offsets[index] = array("I", offsets)
+            by_value = array("I", bytes(4 * len(hashes)))
+            for position, block_value in enumerate(block_values):
+                by_value[offsets[block_value]] = position
+                offsets[block_value] += 1
+            self._sorted[index] = by_value
+        self._built = len(hashes)
+        self._recent = [{} for _ in self._blocks]
+
+    def _positions(self, value):
+        for index, (shift, mask) in enumerate(self._blocks):
+            block_value = (value >> shift) & mask
+            offsets = self._offsets[index]
+            yield from self._sorted[index][offsets[block_value]:offsets[block_value + 1]]
+            yield from self._recent[index].get(block_value, ())
+
+    def remove(self, value, entry_id):
+        for position in self._positions(value):
+            if self._ids[position] == entry_id:
+                self._ids[position] = 0
+                self._removed += 1
+                return
+
+    def candidates(self, value):
+        """
+        Returns [(id, distance), ...] for every indexed hash within the threshold, closest first.
+        """
+        found = {}
+        hashes = self._hashes
+        ids = self._ids
+        for position in self._positions(value):
+            if position not in found and ids[position]:
+                found[position] = (hashes[position] ^ value).bit_count()
+        return sorted(
+            ((ids[position], distance) for position, distance in found.items() if distance <= self.threshold),
+            key=lambda item: item[1],
+        )
+
+    def find(self, value):
+        """
+        Returns (id, distance) for the closest indexed hash within the threshold, or None.
+        """
+        candidates = self.candidates(value)
+        return candidates[0] if candidates else None
+
+
+def _to_signed(value):
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+class NearDuplicateIndex:
+    """
+    HammingIndex persisted in the result cache database, with each image's detail fingerprint stored alongside its
+    hash to confirm candidates.
+
+    Rows belong to extraction cache entries: one is only stored while its entry exists, and ResultCache deletes it
+    when the entry is evicted or expires, so the table stays within the cache's limits.
+
+    Every worker keeps its own in-memory index of hashes and row ids (see HammingIndex for its size) and loads the
+    table when the index is created, which `--serve` workers do before they report ready. Rows added by other
+    workers are pulled in before each lookup; keys and detail fingerprints are only read for candidates. Once as
+    many rows were added as HammingIndex would take before rebuilding, the index is reloaded from the table instead,
+    which also drops the rows other workers evicted since the last load.
+    """
+
+    def __init__(self, path=result_cache.CACHE_PATH, threshold=HAMMING_THRESHOLD):
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._connection = result_cache.connect(path)
+        with self._lock:
+            self._load()
+
+    def __len__(self):
+        return len(self._index)
+
+    def _load(self):
+        self._index = HammingIndex(self.threshold)
+        self._last_id = 0
+        self._append()
+        self._loaded = len(self._index)
+        self._added = 0
+
+    def _append(self):
+        rows = self._connection.execute("SELECT id, hash FROM phashes WHERE id > ? ORDER BY id", (self._last_id,))
+
+        def entries():
+            for row_id, value in rows:
+                self._last_id = row_id
+                yield _to_unsigned(value), row_id
+
+        self._index.extend(entries())
+
+    def _sync(self):
+        pending = self._connection.execute("SELECT COUNT(*) FROM phashes WHERE id > ?", (self._last_id,)).fetchone()[0]
+        if not pending:
+            return
+        self._added += pending
+        if self._added > max(_MIN_REBUILD, self._loaded // 4):
+            self._load()
+        else:
+            self._append()
+
+    def find(self, value, detail):
+        """
+        Returns (key, distance) for the closest indexed image within the pHash threshold whose detail fingerprint
+        also matches, or None. Rows stored before detail fingerprints were kept are never confirmed.
+        """
+        with self._lock:
+            self._sync()
+            rows = []
+            for row_id, distance in self._index.candidates(value):
+                row = self._connection.execute("SELECT key, detail FROM phashes WHERE id = ?", (row_id,)).fetchone()
+                if row is None:
+                    # Evicted, by this or another worker, since the index was loaded.
+                    self._index.remove(value, row_id)
+                elif row[1] is not None:
+                    rows.append((row[0], distance, row[1]))
+        for key, distance, stored in rows:
+            if details_match(detail, stored):
+                return key, distance
+        return None
+
+    def add(self, value, key, detail):
+        with self._lock:
+            # Skipped when the entry was already evicted again, so no row outlives its entry.
+            self._connection.execute(
+                "INSERT OR IGNORE INTO phashes (hash, key, detail) "
+                "SELECT ?, ?, ? WHERE EXISTS (SELECT 1 FROM entries WHERE namespace = ? AND key = ?)",
+                (_to_signed(value), key, detail, result_cache.EXTRACTION_NAMESPACE, key),
+            )
+            self._sync()
+
+    def remove(self, key):
+        with self._lock:
+            row = self._connection.execute("SELECT id, hash FROM phashes WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._connection.execute("DELETE FROM phashes WHERE id = ?", (row[0],))
+                self._index.remove(_to_unsigned(row[1]), row[0])
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """
+    Returns the shared NearDuplicateIndex, or None when near-duplicate lookup or the result cache is disabled.
+    """
+    global _index
+    if NEAR_DUPLICATE_DISABLED or result_cache.CACHE_DISABLED:
+        return None
+    with _index_lock:
+        if _index is None:
+            try:
+                _index = NearDuplicateIndex()
+            except Exception as e:
+                print(f"Warning: Near-duplicate index unavailable: {e}", file=sys.stderr)
+                _index = False
+        return _index or None
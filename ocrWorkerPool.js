@@ -0,0 +1,190 @@
+const { spawn } = require('child_process');
+const readline = require('readline');
+const path = require('path');
+const { v4: uuidv4 } = require('uuid');
+
+// Pool of long-lived `python OCR.py --serve` processes.
+// Each worker handles one job at a time; jobs wait in a FIFO queue until a worker is idle.
+// A job that hasn't finished jobTimeoutMs after it was queued is rejected, and the worker running it is killed and restarted.
+// onMetrics, if given, is called with each result's per-stage metrics and the seconds the job spent queued.
+class OcrWorkerPool {
+  constructor({ size = 4, pythonBin = 'python', scriptPath = path.join(__dirname, 'OCR.py'), env = process.env, restartDelayMs = 1000, jobTimeoutMs = 300000, onMetrics = null } = {}) {
+    this.size = size;
+    this.pythonBin = pythonBin;
+    this.scriptPath = scriptPath;
+    this.env = env;
+    this.restartDelayMs = restartDelayMs;
+    this.jobTimeoutMs = jobTimeoutMs;
+    this.onMetrics = onMetrics;
+    this.workers = [];
+    this.queue = [];
+    this.closed = false;
+  }
+
+  start() {
+    for (let i = 0; i < this.size; i++) {
+      this.workers.push(this._spawnWorker(i));
+    }
+    return this;
+  }
+
+  // Resolves with the worker's output text, rejects if the worker reports a failure, dies mid-job or times out.
+  // With onToken, the worker streams the raw answer and onToken is called with each piece of text as it arrives.
+  run(imagePath, { onToken } = {}) {
+    return new Promise((resolve, reject) => {
+      const job = { id: uuidv4(), imagePath, onToken, queuedAt: Date.now() };
+      job.timer = setTimeout(() => this._onTimeout(job), this.jobTimeoutMs);
+      job.resolve = (output) => {
+        clearTimeout(job.timer);
+        resolve(output);
+      };
+      job.reject = (error) => {
+        clearTimeout(job.timer);
+        reject(error);
+      };
+      this.queue.push(job);
+      this._dispatch();
+    });
+  }
+
+  close() {
+    this.closed = true;
+    for (const worker of this.workers) {
+      worker.process.kill();
+    }
+    for (const job of this.queue.splice(0)) {
+      job.reject(new Error('OCR worker pool closed'));
+    }
+  }
+
+  _spawnWorker(index) {
+    const child = spawn(this.pythonBin, [this.scriptPath, '--serve'], {
+      cwd: path.dirname(this.scriptPath),
+      env: this.env,
+    });
+    const worker = { index, process: child, ready: false, job: null, gone: false, spawnError: null };
+
+    readline.createInterface({ input: child.stdout }).on('line', (line) => this._onMessage(worker, line));
+    child.stderr.on('data', (chunk) => {
+      process.stderr.write(`[ocr-worker ${index}] ${chunk}`);
+    });
+    // Writing a job to a worker that just died fails with EPIPE; its exit handler rejects the job.
+    child.stdin.on('error', (error) => {
+      console.error(`OCR worker ${index} stdin error:`, error.message);
+    });
+    // A worker that can't be spawned (a bad PYTHON_BIN) emits 'error' and never 'exit'.
+    child.on('error', (error) => {
+      if (child.pid === undefined) {
+        worker.spawnError = error;
+        this._onGone(worker, `OCR worker failed to start: ${error.message}`);
+      } else {
+        console.error(`OCR worker ${index} error:`, error);
+      }
+    });
+    child.on('exit', (code, signal) => this._onGone(worker, `OCR worker exited with code ${code}${signal ? ` (${signal})` : ''}`));
+
+    return worker;
+  }
+
+  _onMessage(worker, line) {
+    let message;
+    try {
+      message = JSON.parse(line);
+    } catch (error) {
+      console.error(`OCR worker ${worker.index} wrote a non-protocol line:`, line);
+      return;
+    }
+
+    if (message.event === 'ready') {
+      worker.ready = true;
+      this._dispatch();
+      return;
+    }
+
+    const job = worker.job;
+    if (!job || message.id !== job.id) {
+      console.error(`OCR worker ${worker.index} answered an unknown job:`, message.id);
+      return;
+    }
+
+    if (message.event === 'token') {
+      if (job.onToken) {
+        job.onToken(message.text);
+      }
+      return;
+    }
+
+    worker.job = null;
+    if (this.onMetrics && message.metrics) {
+      this.onMetrics(message.metrics, (job.dispatchedAt - job.queuedAt) / 1000);
+    }
+    if (message.ok) {
+      job.resolve(message.output);
+    } else {
+      job.reject(new Error(message.error || 'OCR worker failed'));
+    }
+    this._dispatch();
+  }
+
+  _onGone(worker, reason) {
+    if (worker.gone) {
+      return;
+    }
+    worker.gone = true;
+    worker.ready = false;
+    if (worker.job) {
+      worker.job.reject(new Error(reason));
+      worker.job = null;
+    }
+    if (this.closed) {
+      return;
+    }
+
+    // When no worker could even be spawned, queued jobs would otherwise wait out their timeout.
+    if (this.workers.every((other) => other.spawnError)) {
+      for (const job of this.queue.splice(0)) {
+        job.reject(new Error(reason));
+      }
+    }
+
+    console.error(`OCR worker ${worker.index}: ${reason}, restarting`);
+    setTimeout(() => {
+      if (!this.closed) {
+        this.workers[worker.index] = this._spawnWorker(worker.index);
+      }
+    }, this.restartDelayMs);
+  }
+
+  _onTimeout(job) {
+    const queued = this.queue.indexOf(job);
+    if (queued !== -1) {
+      this.queue.splice(queued, 1);
+    }
+    const worker = this.workers.find((candidate) => candidate.job === job);
+    if (worker) {
+      // The worker may be stuck anywhere in the job, so it is replaced rather than reused.
+      worker.job = null;
+      worker.ready = false;
+      worker.process.kill('SIGKILL');
+    }
+    job.reject(new Error(`OCR job timed out after ${this.jobTimeoutMs / 1000} s`));
+  }
+
+  _dispatch() {
+    for (const worker of this.workers) {
+      if (this.queue.length === 0) {
+        return;
+      }
+      if (!worker.ready || worker.job) {
+        continue;
+      }
+
+      const job = this.queue.shift();
+      job.dispatchedAt = Date.now();
+      worker.job = job;
+      worker.process.stdin.write(JSON.stringify({ id: job.id, image_path: job.imagePath, stream: Boolean(job.onToken) }) + '\n');
+    }
+  }
+}
+
+module.exports = { OcrWorkerPool };
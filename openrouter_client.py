@@ -0,0 +1,482 @@
+import json
+import os
+import queue
+import socket
+import sys
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+import rate_limiter
+
+OPENROUTER_API_URL = os.getenv("OPENROUTER_API_URL", "https://openrouter.ai/api/v1/chat/completions")
+POOL_SIZE = int(os.getenv("OPENROUTER_POOL_SIZE", "10"))
+CONNECT_TIMEOUT = float(os.getenv("OPENROUTER_CONNECT_TIMEOUT", "10"))
+READ_TIMEOUT = float(os.getenv("OPENROUTER_READ_TIMEOUT", "30"))
+LOG_TIMINGS = os.getenv("OPENROUTER_LOG_TIMINGS", "").lower() in ("1", "true", "yes")
+MAX_RETRIES = 3
+BASE_DELAY = 2
+
+# Time spent in connect() (TCP + TLS) by the current thread since the last call started.
+# Stays at 0.0 when the pool hands back an already-open keep-alive connection.
+_connect_timing = threading.local()
+
+
+# The CancelEvent of the call the current thread is making, if it was given one.
+_current_call = threading.local()
+
+
+class CancelEvent(threading.Event):
+    """
+    A threading.Event for abandoning a call from another thread. Once set, the call stops retrying and stops waiting
+    on the rate limiter, and the socket it is using is shut down, so a call blocked on response headers, on an idle
+    stream or on keep-alive comments returns at once instead of at the read timeout.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._socket_lock = threading.Lock()
+        self._socket = None
+
+    def set(self):
+        with self._socket_lock:
+            super().set()
+            _shutdown(self._socket)
+
+    def _watch(self, sock):
+        with self._socket_lock:
+            self._socket = sock
+            if self.is_set():
+                _shutdown(sock)
+
+    def _unwatch(self, sock):
+        # Called before a connection goes back to the pool, so a late cancel can't break it for the next caller.
+        with self._socket_lock:
+            if self._socket is sock:
+                self._socket = None
+
+
+def _shutdown(sock):
+    if sock is None:
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        # Already closed.
+        pass
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        _connect_timing.seconds = getattr(_connect_timing, "seconds", 0.0) + time.perf_counter() - start
+
+    def getresponse(self):
+        cancel = getattr(_current_call, "cancel", None)
+        if cancel is not None:
+            cancel._watch(self.sock)
+        return super().getresponse()
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        _connect_timing.seconds = getattr(_connect_timing, "seconds", 0.0) + time.perf_counter() - start
+
+    def getresponse(self):
+        cancel = getattr(_current_call, "cancel", None)
+        if cancel is not None:
+            cancel._watch(self.sock)
+        return super().getresponse()
+
+
+def _release_watch(conn):
+    cancel = getattr(_current_call, "cancel", None)
+    if cancel is not None and conn is not None:
+        cancel._unwatch(conn.sock)
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+    def _put_conn(self, conn):
+        _release_watch(conn)
+        super()._put_conn(conn)
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+    def _put_conn(self, conn):
+        _release_watch(conn)
+        super()._put_conn(conn)
+
+
+class _TimedHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool,
+        }
+
+
+class CallTimings:
+    """
+    Wall-clock breakdown of one HTTP call, in seconds.
+
+    connect is 0.0 when a pooled keep-alive connection was reused, ttfb is measured up to the response headers
+    and total includes reading the whole body; all three are for the last attempt. queued is everything before that
+    attempt: rate limiter waits, failed attempts and backoff. first_token is only set for streamed calls.
+    request_bytes and response_bytes count the JSON body sent and the body received.
+    """
+
+    def __init__(self, connect, ttfb, total, reused, first_token=None, queued=0.0, attempts=1, request_bytes=0,
+                 response_bytes=0):
+        self.connect = connect
+        self.ttfb = ttfb
+        self.total = total
+        self.reused = reused
+        self.first_token = first_token
+        self.queued = queued
+        self.attempts = attempts
+        self.request_bytes = request_bytes
+        self.response_bytes = response_bytes
+
+    def as_dict(self):
+        return {"connect": self.connect, "ttfb": self.ttfb, "total": self.total, "reused": self.reused,
+                "first_token": self.first_token, "queued": self.queued, "attempts": self.attempts,
+                "request_bytes": self.request_bytes, "response_bytes": self.response_bytes}
+
+    def __repr__(self):
+        return (f"CallTimings(connect={self.connect * 1000:.1f}ms, ttfb={self.ttfb * 1000:.1f}ms, "
+                f"total={self.total * 1000:.1f}ms, reused={self.reused}, queued={self.queued * 1000:.1f}ms, "
+                f"attempts={self.attempts})")
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Returns the process-wide requests.Session that every OpenRouter call shares, creating it on first use.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = _TimedHTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, pool_block=False)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+
+def configure(pool_size=None, connect_timeout=None, read_timeout=None, api_url=None):
+    """
+    Overrides the module defaults. Changing the pool size drops the current session so the next call builds a new one.
+    """
+    global POOL_SIZE, CONNECT_TIMEOUT, READ_TIMEOUT, OPENROUTER_API_URL, _session
+    with _session_lock:
+        if pool_size is not None and pool_size != POOL_SIZE:
+            POOL_SIZE = pool_size
+            if _session is not None:
+                _session.close()
+                _session = None
+        if connect_timeout is not None:
+            CONNECT_TIMEOUT = connect_timeout
+        if read_timeout is not None:
+            READ_TIMEOUT = read_timeout
+        if api_url is not None:
+            OPENROUTER_API_URL = api_url
+
+
+class RequestCancelled(requests.exceptions.RequestException):
+    """
+    Raised by a call whose CancelEvent was set before it got a response.
+    """
+
+
+def _send(body, headers, timeout, priority, max_retries, base_delay, cancel=None):
+    """
+    Posts body to OpenRouter, waiting on the shared rate limiter before every attempt. 429s, gateway errors and
+    connection failures are retried up to max_retries attempts in all, with jittered exponential backoff that
+    honours Retry-After. Once `cancel` (a CancelEvent) is set no further attempt is made and RequestCancelled is
+    raised.
+
+    Returns the last response, with the body still unread and `timings` set up to the response headers.
+    """
+    limiter = rate_limiter.get_limiter()
+    call_start = time.perf_counter()
+    # Stays set while the body is read, so cancelling can also interrupt the stream.
+    _current_call.cancel = cancel
+    for attempt in range(max_retries):
+        if cancel is not None and cancel.is_set():
+            raise RequestCancelled("Request cancelled")
+        if limiter is not None and limiter.acquire(priority, cancel) is None:
+            raise RequestCancelled("Request cancelled while waiting for the rate limiter")
+
+        _connect_timing.seconds = 0.0
+        start = time.perf_counter()
+        try:
+            response = get_session().post(
+                OPENROUTER_API_URL,
+                headers=headers,
+                json=body,
+                timeout=timeout or (CONNECT_TIMEOUT, READ_TIMEOUT),
+                stream=True,
+            )
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if cancel is not None and cancel.is_set():
+                raise RequestCancelled("Request cancelled") from e
+            if attempt + 1 >= max_retries:
+                raise
+            delay = rate_limiter.retry_delay(attempt, base_delay)
+            reason = str(e)
+        else:
+            ttfb = time.perf_counter() - start
+            if limiter is not None:
+                limiter.observe(response)
+            if response.status_code not in rate_limiter.RETRY_STATUSES or attempt + 1 >= max_retries:
+                connect = _connect_timing.seconds
+                response.timings = CallTimings(connect=connect, ttfb=ttfb, total=ttfb, reused=connect == 0.0,
+                                               queued=start - call_start, attempts=attempt + 1,
+                                               request_bytes=len(response.request.body or b""))
+                return response
+            delay = rate_limiter.retry_delay(attempt, base_delay, rate_limiter.parse_retry_after(response))
+            reason = f"HTTP {response.status_code}"
+            response.content
+
+        print(f"OpenRouter request for {body.get('model')} failed ({reason}). Retrying in {delay:.1f} seconds "
+              f"(attempt {attempt + 1}/{max_retries})...", file=sys.stderr)
+        if cancel is not None:
+            cancel.wait(delay)
+        else:
+            time.sleep(delay)
+
+
+def post_chat(payload, api_key, timeout=None, priority=rate_limiter.PRIORITY_INTERACTIVE, max_retries=MAX_RETRIES,
+              base_delay=BASE_DELAY):
+    """
+    Sends a chat completion request through the shared pooled session, retrying rate limits and transient failures.
+
+    Returns the requests.Response with the body already read and a `timings` attribute (CallTimings) attached.
+    """
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json"
+    }
+
+    response = _send(payload, headers, timeout, priority, max_retries, base_delay)
+    read_start = time.perf_counter()
+    # Reading the body to the end hands the connection back to the pool for keep-alive reuse.
+    response.timings.response_bytes = len(response.content)
+    response.timings.total = response.timings.ttfb + time.perf_counter() - read_start
+    if LOG_TIMINGS:
+        print(f"OpenRouter call ({payload.get('model')}): {response.timings}", file=sys.stderr)
+    return response
+
+
+def _iter_stream_content(response, start):
+    """
+    Yields the content deltas of an OpenRouter SSE stream and fills in response.timings and response.usage once it ends.
+    """
+    first_token = None
+    received = 0
+    try:
+        for raw_line in response.iter_lines():
+            received += len(raw_line) + 1
+            if not raw_line or raw_line.startswith(b":"):
+                continue
+            if not raw_line.startswith(b"data:"):
+                continue
+            data = raw_line[len(b"data:"):].strip()
+            if data == b"[DONE]":
+                # Keep reading to the end of the body so the connection goes back to the pool.
+                continue
+
+            event = json.loads(data)
+            if "error" in event:
+                raise requests.exceptions.RequestException(f"Stream error: {event['error']}")
+            if event.get("usage"):
+                response.usage = event["usage"]
+            for choice in event.get("choices") or []:
+                content = (choice.get("delta") or {}).get("content")
+                if content:
+                    if first_token is None:
+                        first_token = time.perf_counter() - start
+                    yield content
+    finally:
+        response.close()
+        response.timings.total = time.perf_counter() - start
+        response.timings.first_token = first_token
+        response.timings.response_bytes = received
+        if LOG_TIMINGS:
+            print(f"OpenRouter stream: {response.timings}, first token after "
+                  f"{(first_token or 0) * 1000:.1f}ms", file=sys.stderr)
+
+
+def stream_chat(payload, api_key, timeout=None, priority=rate_limiter.PRIORITY_INTERACTIVE, max_retries=MAX_RETRIES,
+                base_delay=BASE_DELAY, cancel=None):
+    """
+    Sends a chat completion request with `stream: true` through the shared pooled session. Rate limits and transient
+    failures are retried the same way as post_chat, before any content has been streamed. Setting the CancelEvent
+    `cancel` from another thread abandons the request, including a stream that is being read.
+
+    Returns (response, deltas). Check response.status_code first; on 200, iterating `deltas` yields the content
+    text as it arrives. response.timings.total and .first_token, and response.usage (the token counts OpenRouter
+    sends in the last chunk), are filled in when the stream is exhausted.
+    """
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json",
+        "Accept": "text/event-stream"
+    }
+
+    # Streamed responses only carry token usage when it is asked for.
+    response = _send({**payload, "stream": True, "usage": {"include": True}}, headers, timeout, priority, max_retries,
+                     base_delay, cancel)
+    # Stream timings count from the start of the attempt that succeeded.
+    start = time.perf_counter() - response.timings.ttfb
+    response.usage = None
+
+    if response.status_code != 200:
+        response.timings.response_bytes = len(response.content)
+        return response, iter(())
+    return response, _iter_stream_content(response, start)
+
+
+# Marks the end of a hedge attempt's deltas queue.
+_STREAM_END = object()
+
+
+class _HedgeAttempt:
+    """
+    One of the racing requests in hedged_stream_chat. A thread sends the request and reads its stream into a queue,
+    reporting "first_token", "done" or "failed" on the shared events queue. Cancelling shuts the connection down
+    wherever the attempt is, waiting for headers, reading the stream or backing off, so the provider stops generating
+    and no retry or rate limiter token is spent on it.
+    """
+
+    def __init__(self, name, payload, api_key, events, timeout, priority, max_retries, base_delay):
+        self.name = name
+        self.payload = payload
+        self.response = None
+        self.error = None
+        self.started = time.perf_counter()
+        self.deltas = queue.Queue()
+        self._events = events
+        self._cancelled = CancelEvent()
+        self._arguments = (api_key, timeout, priority, max_retries, base_delay)
+        threading.Thread(target=self._run, name=f"hedge-{name}", daemon=True).start()
+
+    def _run(self):
+        try:
+            response, deltas = stream_chat(self.payload, *self._arguments, cancel=self._cancelled)
+            self.response = response
+            if self._cancelled.is_set():
+                response.close()
+                return
+            if response.status_code != 200:
+                self._events.put((self, "failed"))
+                return
+            first = True
+            for delta in deltas:
+                if self._cancelled.is_set():
+                    deltas.close()
+                    return
+                self.deltas.put(delta)
+                if first:
+                    first = False
+                    self._events.put((self, "first_token"))
+        except Exception as e:
+            self.error = e
+            self.deltas.put(_STREAM_END)
+            self._events.put((self, "failed"))
+            return
+        self.deltas.put(_STREAM_END)
+        self._events.put((self, "done"))
+
+    def cancel(self):
+        self._cancelled.set()
+        # The socket is already shut down, so this doesn't wait on a read in progress. Closing the urllib3 response
+        # rather than the requests one leaves handing the connection back to the pool to the attempt's own thread.
+        response = self.response
+        if response is not None:
+            response.raw.close()
+
+    def iter_deltas(self):
+        while True:
+            delta = self.deltas.get()
+            if delta is _STREAM_END:
+                if self.error is not None:
+                    raise self.error
+                return
+            yield delta
+
+
+def hedged_stream_chat(payload, api_key, hedge_after, hedge_payload=None, timeout=None,
+                       priority=rate_limiter.PRIORITY_INTERACTIVE, max_retries=MAX_RETRIES, base_delay=BASE_DELAY):
+    """
+    stream_chat with a hedge: if the request has not streamed its first token within hedge_after seconds, or fails
+    before then, the same request is sent again as hedge_payload (another model or a replica; the same payload by
+    default). Whichever attempt streams a token first wins and the other is cancelled. Only the wait for the first
+    token is raced: once an attempt is generating, a hedge would have to start the answer over.
+
+    Returns (response, deltas) like stream_chat, for the winning attempt. response.hedged is True when the hedge was
+    sent and response.hedge_won when it won. The winner's timings.queued includes the time before it was sent.
+    """
+    events = queue.Queue()
+    arguments = (api_key, events, timeout, priority, max_retries, base_delay)
+    start = time.perf_counter()
+    attempts = [_HedgeAttempt("primary", payload, *arguments)]
+    failed = []
+    winner = None
+
+    while winner is None:
+        hedge_sent = len(attempts) > 1
+        wait = None if hedge_sent else max(0.0, hedge_after - (time.perf_counter() - start))
+        try:
+            attempt, event = events.get(timeout=wait)
+        except queue.Empty:
+            attempts.append(_HedgeAttempt("hedge", hedge_payload or payload, *arguments))
+            continue
+        if event == "failed":
+            failed.append(attempt)
+            if len(failed) == len(attempts) and hedge_sent:
+                break
+            if not hedge_sent:
+                attempts.append(_HedgeAttempt("hedge", hedge_payload or payload, *arguments))
+        else:
+            # "first_token", or "done" for a reply without any content.
+            winner = attempt
+
+    for attempt in attempts:
+        if attempt is not winner:
+            attempt.cancel()
+
+    if winner is None:
+        # Both attempts failed: return the first failed response, or raise the primary's error if neither got one.
+        responded = [attempt for attempt in attempts if attempt.response is not None]
+        if not responded:
+            raise attempts[0].error
+        response = responded[0].response
+        deltas = iter(())
+    else:
+        response = winner.response
+        deltas = winner.iter_deltas()
+    response.hedged = len(attempts) > 1
+    response.hedge_won = winner is not None and winner.name == "hedge"
+    response.timings.queued += (winner or responded[0]).started - start
+    if LOG_TIMINGS and response.hedged:
+        print(f"OpenRouter hedge for {payload.get('model')}: {'hedge' if response.hedge_won else 'primary'} won",
+              file=sys.stderr)
+    return response, deltas
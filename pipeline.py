@@ -0,0 +1,155 @@
+import asyncio
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import stage_metrics
+
+# Sentinel that tells one stage worker to exit.
+_STOP = object()
+
+
+class Stage:
+    """
+    A pool of workers fed from a bounded asyncio queue.
+
+    Each worker takes an item, runs `function(item)` on the stage's own thread pool and hands the item on to the next
+    stage. When the next stage's queue is full the worker waits, so a slow stage pushes back on the ones in front of
+    it rather than letting work pile up in memory. Busy time and queue depth are tracked for Pipeline.report().
+    """
+
+    def __init__(self, name, function, workers, queue_size):
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.executor = None
+        self.processed = 0
+        self.busy = 0.0
+        self.max_depth = 0
+        self._depth_total = 0
+        self._depth_samples = 0
+        self._lock = threading.Lock()
+
+    async def put(self, item):
+        await self.queue.put(item)
+
+    def sample_depth(self):
+        depth = self.queue.qsize()
+        with self._lock:
+            self._depth_total += depth
+            self._depth_samples += 1
+            self.max_depth = max(self.max_depth, depth)
+        return depth
+
+    def mean_depth(self):
+        with self._lock:
+            return self._depth_total / self._depth_samples if self._depth_samples else 0.0
+
+    def run(self, item):
+        start = time.perf_counter()
+        try:
+            with stage_metrics.use(item["metrics"]):
+                self.function(item)
+        except Exception as e:
+            item["record"]["error"] = f"Error: An unexpected error occurred in the {self.name} stage: {e}"
+            item["done"] = True
+        with self._lock:
+            self.busy += time.perf_counter() - start
+            self.processed += 1
+
+
+class Pipeline:
+    """
+    Chains stages so that several items are in different stages at once.
+
+    Items are dicts holding at least "record" (the result record) and "metrics" (a stage_metrics.RequestMetrics). A
+    stage function sets item["done"] when there is nothing left to do, for example on an error or a cache hit, and
+    the item skips straight to `sink`. Every item reaches `sink` exactly once, on the event loop, so sink calls never
+    overlap.
+    """
+
+    def __init__(self, stages, sink):
+        self.stages = stages
+        self.sink = sink
+        self.start = None
+
+    async def _worker(self, index):
+        loop = asyncio.get_running_loop()
+        stage = self.stages[index]
+        following = self.stages[index + 1] if index + 1 < len(self.stages) else None
+        while True:
+            item = await stage.queue.get()
+            if item is _STOP:
+                return
+            await loop.run_in_executor(stage.executor, stage.run, item)
+            if item.get("done") or following is None:
+                self.sink(item)
+            else:
+                following.sample_depth()
+                await following.put(item)
+
+    async def _report_periodically(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            print(format_report(self.report()), file=sys.stderr)
+
+    async def run(self, items, report_interval=None):
+        """
+        Feeds every item through the stages and returns once all of them have reached the sink.
+        With report_interval, prints queue depths and utilisation to stderr every that many seconds.
+        """
+        self.start = time.perf_counter()
+        workers = []
+        for index, stage in enumerate(self.stages):
+            stage.executor = ThreadPoolExecutor(max_workers=stage.workers, thread_name_prefix=f"{stage.name}-worker")
+            workers.append([asyncio.create_task(self._worker(index)) for _ in range(stage.workers)])
+        reporter = asyncio.create_task(self._report_periodically(report_interval)) if report_interval else None
+
+        try:
+            first = self.stages[0]
+            for item in items:
+                first.sample_depth()
+                await first.put(item)
+
+            # Stop the stages front to back: once every worker of a stage has exited, nothing more can reach the next.
+            for stage, tasks in zip(self.stages, workers):
+                for _ in tasks:
+                    await stage.put(_STOP)
+                await asyncio.gather(*tasks)
+        finally:
+            if reporter is not None:
+                reporter.cancel()
+            for stage, tasks in zip(self.stages, workers):
+                for task in tasks:
+                    task.cancel()
+                stage.executor.shutdown(wait=False)
+
+    def report(self):
+        """
+        Per-stage counters: items processed, utilisation (busy time over workers x elapsed) and queue depth.
+        """
+        elapsed = time.perf_counter() - self.start if self.start is not None else 0.0
+        return [
+            {
+                "stage": stage.name,
+                "workers": stage.workers,
+                "processed": stage.processed,
+                "utilization": stage.busy / (stage.workers * elapsed) if elapsed else 0.0,
+                "queue_depth": stage.queue.qsize(),
+                "mean_queue_depth": stage.mean_depth(),
+                "max_queue_depth": stage.max_depth,
+            }
+            for stage in self.stages
+        ]
+
+
+def format_report(report):
+    lines = [f"{'stage':<10} {'workers':>7} {'done':>6} {'busy':>6} {'queue':>6} {'mean q':>7} {'max q':>6}"]
+    for row in report:
+        lines.append(
+            f"{row['stage']:<10} {row['workers']:>7} {row['processed']:>6} {row['utilization']:>6.0%} "
+            f"{row['queue_depth']:>6} {row['mean_queue_depth']:>7.1f} {row['max_queue_depth']:>6}"
+        )
+    return "\n".join(lines)
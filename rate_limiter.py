@@ -0,0 +1,235 @@
+import email.utils
+import os
+import random
+import sqlite3
+import sys
+import threading
+import time
+from uuid import uuid4
+
+import result_cache
+
+RATE_LIMIT_DISABLED = os.getenv("OCR_RATE_LIMIT_DISABLED", "").lower() in ("1", "true", "yes")
+RATE_LIMIT_PATH = os.getenv("OCR_RATE_LIMIT_PATH", result_cache.CACHE_PATH)
+MAX_RATE = float(os.getenv("OCR_RATE_LIMIT_RPS", "10"))
+MIN_RATE = float(os.getenv("OCR_RATE_LIMIT_MIN_RPS", "0.2"))
+BURST = float(os.getenv("OCR_RATE_LIMIT_BURST", str(MAX_RATE)))
+MAX_RETRY_DELAY = float(os.getenv("OCR_RETRY_MAX_DELAY", "60"))
+
+# Lower numbers are admitted first. Uploads from the website should not queue behind a batch run.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+RETRY_STATUSES = (429, 502, 503, 504)
+
+# Each success raises the rate by this fraction of MAX_RATE; each 429 halves it.
+_RATE_STEP = 0.05
+# A waiter that has not checked in for this long belongs to a dead process and no longer holds back lower priorities.
+_WAITER_TTL = 30.0
+_MAX_POLL = 5.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rate_buckets (
+    name TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    rate REAL NOT NULL,
+    updated REAL NOT NULL,
+    blocked_until REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rate_waiters (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    seen REAL NOT NULL
+);
+"""
+
+
+class RateLimiter:
+    """
+    Token bucket shared by every process that opens the same SQLite file.
+
+    The bucket refills at `rate` requests per second up to `burst`. The rate adapts to the provider: a 429 halves it
+    and blocks the whole bucket until the Retry-After time, and each success nudges it back up towards `max_rate`.
+    A request only takes a token when no live waiter of a higher priority is queued.
+    """
+
+    def __init__(self, path=RATE_LIMIT_PATH, name="openrouter", max_rate=MAX_RATE, min_rate=MIN_RATE, burst=BURST):
+        self.name = name
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._connection = result_cache.connect(path)
+        self._connection.executescript(_SCHEMA)
+        self._connection.execute(
+            "INSERT OR IGNORE INTO rate_buckets (name, tokens, rate, updated, blocked_until) VALUES (?, ?, ?, ?, 0)",
+            (name, burst, max_rate, time.time()),
+        )
+
+    def _transaction(self, work):
+        # BEGIN IMMEDIATE takes the database write lock up front, so the read-modify-write of the bucket is atomic
+        # across processes.
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                result = work(time.time())
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+            return result
+
+    def _bucket(self, now):
+        tokens, rate, updated, blocked_until = self._connection.execute(
+            "SELECT tokens, rate, updated, blocked_until FROM rate_buckets WHERE name = ?", (self.name,)
+        ).fetchone()
+        rate = min(self.max_rate, rate)
+        return min(self.burst, tokens + max(0.0, now - updated) * rate), rate, blocked_until
+
+    def _try_acquire(self, now, waiter_id, priority):
+        """
+        Takes a token and returns 0.0, or registers the caller as waiting and returns how long to sleep.
+        """
+        tokens, rate, blocked_until = self._bucket(now)
+        self._connection.execute("DELETE FROM rate_waiters WHERE seen < ?", (now - _WAITER_TTL,))
+        ahead = self._connection.execute(
+            "SELECT 1 FROM rate_waiters WHERE name = ? AND priority < ? LIMIT 1", (self.name, priority)
+        ).fetchone()
+
+        if now >= blocked_until and tokens >= 1 and not ahead:
+            self._connection.execute(
+                "UPDATE rate_buckets SET tokens = ?, updated = ? WHERE name = ?", (tokens - 1, now, self.name)
+            )
+            self._connection.execute("DELETE FROM rate_waiters WHERE id = ?", (waiter_id,))
+            return 0.0
+
+        self._connection.execute(
+            "UPDATE rate_buckets SET tokens = ?, updated = ? WHERE name = ?", (tokens, now, self.name)
+        )
+        self._connection.execute(
+            "INSERT OR REPLACE INTO rate_waiters (id, name, priority, seen) VALUES (?, ?, ?, ?)",
+            (waiter_id, self.name, priority, now),
+        )
+        wait = max(blocked_until - now, (1 - tokens) / rate, 0.0)
+        # Leave the next token to the higher-priority waiter.
+        return max(wait, 1 / rate) if ahead else wait
+
+    def acquire(self, priority=PRIORITY_INTERACTIVE, cancel=None):
+        """
+        Blocks until a request may be sent and returns the number of seconds spent waiting, or None without taking a
+        token if the threading.Event `cancel` is set first.
+        """
+        waiter_id = uuid4().hex
+        waited = 0.0
+        try:
+            while True:
+                if cancel is not None and cancel.is_set():
+                    self._leave_queue(waiter_id)
+                    return None
+                wait = self._transaction(lambda now: self._try_acquire(now, waiter_id, priority))
+                if wait <= 0:
+                    return waited
+                # Jitter keeps workers that were woken by the same refill from all retrying in the same instant.
+                delay = min(wait, _MAX_POLL) * random.uniform(1.0, 1.2)
+                if cancel is not None:
+                    cancel.wait(delay)
+                else:
+                    time.sleep(delay)
+                waited += delay
+        except BaseException:
+            self._leave_queue(waiter_id)
+            raise
+
+    def _leave_queue(self, waiter_id):
+        with self._lock:
+            self._connection.execute("DELETE FROM rate_waiters WHERE id = ?", (waiter_id,))
+
+    def throttled(self, retry_after=None):
+        """
+        Records a 429: halves the rate, empties the bucket and blocks it until retry_after seconds from now.
+        """
+        def work(now):
+            tokens, rate, blocked_until = self._bucket(now)
+            # Every request in flight when the limit hit gets a 429; only the first one of a burst lowers the rate.
+            if now >= blocked_until:
+                rate = max(self.min_rate, rate / 2)
+            pause = retry_after if retry_after is not None else 1 / rate
+            self._connection.execute(
+                "UPDATE rate_buckets SET tokens = 0, rate = ?, updated = ?, blocked_until = ? WHERE name = ?",
+                (rate, now, max(blocked_until, now + pause), self.name),
+            )
+        self._transaction(work)
+
+    def succeeded(self):
+        with self._lock:
+            self._connection.execute(
+                "UPDATE rate_buckets SET rate = MIN(?, rate + ?) WHERE name = ? AND rate < ?",
+                (self.max_rate, self.max_rate * _RATE_STEP, self.name, self.max_rate),
+            )
+
+    def observe(self, response):
+        """
+        Feeds a provider response back into the limiter.
+        """
+        retry_after = parse_retry_after(response)
+        if response.status_code == 429 or (response.status_code == 503 and retry_after is not None):
+            self.throttled(retry_after)
+        elif response.status_code < 400:
+            self.succeeded()
+
+    def stats(self):
+        with self._lock:
+            tokens, rate, blocked_until = self._bucket(time.time())
+            waiting = self._connection.execute(
+                "SELECT COUNT(*) FROM rate_waiters WHERE name = ?", (self.name,)
+            ).fetchone()[0]
+        return {"tokens": tokens, "rate": rate, "blocked_for": max(0.0, blocked_until - time.time()), "waiting": waiting}
+
+
+def parse_retry_after(response):
+    """
+    Returns the Retry-After header of a response in seconds, or None. Both the delta-seconds and HTTP-date forms
+    are accepted.
+    """
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_delay(attempt, base_delay, retry_after=None):
+    """
+    Seconds to wait before retry number attempt + 1: exponential backoff with full jitter, never less than
+    the server's Retry-After.
+    """
+    backoff = random.uniform(0, min(MAX_RETRY_DELAY, base_delay * (2 ** attempt)))
+    return min(MAX_RETRY_DELAY, max(backoff, retry_after or 0.0))
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter():
+    """
+    Returns the process-wide RateLimiter, or None when rate limiting is disabled or its database can't be opened.
+    """
+    global _limiter
+    if RATE_LIMIT_DISABLED:
+        return None
+    with _limiter_lock:
+        if _limiter is None:
+            try:
+                _limiter = RateLimiter()
+            except sqlite3.Error as e:
+                print(f"Warning: Rate limiter unavailable ({RATE_LIMIT_PATH}): {e}", file=sys.stderr)
+                _limiter = False
+        return _limiter or None
@@ -0,0 +1,249 @@
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+CACHE_PATH = os.getenv("OCR_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "ocr_cache.sqlite3"))
+CACHE_DISABLED = os.getenv("OCR_CACHE_DISABLED", "").lower() in ("1", "true", "yes")
+CACHE_TTL = float(os.getenv("OCR_CACHE_TTL", str(30 * 24 * 3600)))
+CACHE_MAX_ENTRIES = int(os.getenv("OCR_CACHE_MAX_ENTRIES", "100000"))
+CACHE_MAX_BYTES = int(os.getenv("OCR_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+EXTRACTION_NAMESPACE = "extraction"
+ANSWER_NAMESPACE = "answer"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE INDEX IF NOT EXISTS entries_lru ON entries (namespace, accessed);
+CREATE TABLE IF NOT EXISTS counters (
+    namespace TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value INTEGER NOT NULL,
+    PRIMARY KEY (namespace, name)
+);
+CREATE TABLE IF NOT EXISTS phashes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    hash INTEGER NOT NULL,
+    key TEXT NOT NULL UNIQUE,
+    detail BLOB
+);
+"""
+
+
+def _add_detail_column(connection):
+    # phashes tables created before detail fingerprints were kept lack the column; their rows keep NULL and never
+    # match.
+    columns = {row[1] for row in connection.execute("PRAGMA table_info(phashes)")}
+    if "detail" not in columns:
+        try:
+            connection.execute("ALTER TABLE phashes ADD COLUMN detail BLOB")
+        except sqlite3.OperationalError as e:
+            # Another worker added it first.
+            if "duplicate column" not in str(e):
+                raise
+
+
+def connect(path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.executescript(_SCHEMA)
+    _add_detail_column(connection)
+    return connection
+
+
+class ResultCache:
+    """
+    Persistent JSON value cache in one namespace of an SQLite file.
+
+    Entries expire `ttl` seconds after they were written. When the namespace goes over `max_entries` or `max_bytes`,
+    the least recently read entries are evicted first. Hit and miss counters are stored alongside the entries so
+    every worker process sharing the file sees the same totals.
+
+    Extraction entries may also have a row in the phashes table, the near-duplicate fingerprint of their image (see
+    near_duplicate.py). Its detail bytes count towards `max_bytes`, and it is deleted with its entry in the same
+    transaction.
+    """
+
+    def __init__(self, path, namespace, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES):
+        self.path = path
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._fingerprints = namespace == EXTRACTION_NAMESPACE
+        self._lock = threading.Lock()
+        self._connection = connect(path)
+        if self._fingerprints:
+            # Fingerprints left behind by entries evicted before eviction deleted them.
+            with self._lock:
+                self._transaction(lambda: self._connection.execute(
+                    "DELETE FROM phashes WHERE key NOT IN (SELECT key FROM entries WHERE namespace = ?)",
+                    (self.namespace,),
+                ))
+
+    def _transaction(self, work):
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            result = work()
+        except BaseException:
+            self._connection.execute("ROLLBACK")
+            raise
+        self._connection.execute("COMMIT")
+        return result
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value, created FROM entries WHERE namespace = ? AND key = ?",
+                (self.namespace, key),
+            ).fetchone()
+
+            if row is not None and self.ttl and now - row[1] > self.ttl:
+                self._transaction(lambda: self._delete([key]))
+                row = None
+
+            if row is None:
+                self._count("misses")
+                return None
+
+            self._connection.execute(
+                "UPDATE entries SET accessed = ? WHERE namespace = ? AND key = ?",
+                (now, self.namespace, key),
+            )
+            self._count("hits")
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        encoded = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        def write():
+            self._connection.execute(
+                "INSERT OR REPLACE INTO entries (namespace, key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?, ?)",
+                (self.namespace, key, encoded, len(encoded.encode("utf-8")), now, now),
+            )
+            self._evict(now)
+
+        with self._lock:
+            self._transaction(write)
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._connection.execute(
+                "SELECT name, value FROM counters WHERE namespace = ?", (self.namespace,)
+            ).fetchall())
+            entries, size = self._usage()
+        return {"hits": counters.get("hits", 0), "misses": counters.get("misses", 0), "entries": entries, "bytes": size}
+
+    def _count(self, name):
+        self._connection.execute(
+            "INSERT INTO counters (namespace, name, value) VALUES (?, ?, 1) "
+            "ON CONFLICT (namespace, name) DO UPDATE SET value = value + 1",
+            (self.namespace, name),
+        )
+
+    def _usage(self):
+        entries, size = self._connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries WHERE namespace = ?", (self.namespace,)
+        ).fetchone()
+        if self._fingerprints:
+            size += self._connection.execute("SELECT COALESCE(SUM(LENGTH(detail)), 0) FROM phashes").fetchone()[0]
+        return entries, size
+
+    def _delete(self, keys):
+        self._connection.executemany(
+            "DELETE FROM entries WHERE namespace = ? AND key = ?", ((self.namespace, key) for key in keys)
+        )
+        if self._fingerprints:
+            self._connection.executemany("DELETE FROM phashes WHERE key = ?", ((key,) for key in keys))
+
+    def _evict(self, now):
+        if self.ttl:
+            expired = [key for (key,) in self._connection.execute(
+                "SELECT key FROM entries WHERE namespace = ? AND created < ?", (self.namespace, now - self.ttl)
+            )]
+            self._delete(expired)
+
+        entries, size = self._usage()
+        if entries <= self.max_entries and size <= self.max_bytes:
+            return
+
+        if self._fingerprints:
+            rows = self._connection.execute(
+                "SELECT entries.key, entries.size + COALESCE(LENGTH(phashes.detail), 0) FROM entries "
+                "LEFT JOIN phashes ON phashes.key = entries.key WHERE entries.namespace = ? ORDER BY entries.accessed",
+                (self.namespace,),
+            )
+        else:
+            rows = self._connection.execute(
+                "SELECT key, size FROM entries WHERE namespace = ? ORDER BY accessed", (self.namespace,)
+            )
+        evicted = []
+        for key, entry_size in rows:
+            if entries <= self.max_entries and size <= self.max_bytes:
+                break
+            evicted.append(key)
+            entries -= 1
+            size -= entry_size
+        self._delete(evicted)
+
+
+def image_cache_key(image):
+    """
+    Hashes the decoded pixels rather than the file bytes, so the same picture saved with different metadata or
+    PNG compression maps to the same key.
+    """
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    digest = hashlib.sha256()
+    digest.update(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode("utf-8"))
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+def answer_cache_key(question, diagram, options, options_type, question_type):
+    encoded = json.dumps([question, diagram, options, options_type, question_type], ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(namespace):
+    """
+    Returns the shared ResultCache for a namespace, or None when caching is disabled or the cache file can't be opened.
+    """
+    if CACHE_DISABLED:
+        return None
+    with _caches_lock:
+        if namespace not in _caches:
+            try:
+                _caches[namespace] = ResultCache(CACHE_PATH, namespace)
+            except sqlite3.Error as e:
+                print(f"Warning: Result cache unavailable ({CACHE_PATH}): {e}", file=sys.stderr)
+                _caches[namespace] = None
+        return _caches[namespace]
+
+
+def get_extraction_cache():
+    return get_cache(EXTRACTION_NAMESPACE)
+
+
+def get_answer_cache():
+    return get_cache(ANSWER_NAMESPACE)
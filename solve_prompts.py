@@ -0,0 +1,178 @@
+import os
+
+import extraction_parser
+
+# "typed" sends only the instructions that apply to the extracted question and option type; "full" always sends the
+# original all-types prompt. Questions of an unrecognised type get the full prompt either way.
+PROMPT_STYLE = os.getenv("OCR_SOLVE_PROMPT", "typed").lower()
+
+_INTRO = "Solve the following problem step-by-step, explaining each step and the equations it uses.\n\n"
+
+_FORMAT = (
+    "**Format Instructions:**\n"
+    "* Enclose all equations in `$$...$$`, for example $$E=mc^2$$.\n"
+    "* Number the steps, and start each one with 'Reasoning Step:' and the reasoning behind it.\n"
+)
+
+_CONSTRAINTS = "**Constraints:** Start directly with the solution, with no introductory or concluding remarks.\n\n"
+
+_ANSWER = {
+    "Single-select": (
+        "* Analyse each option (A, B, C, D) against your working and state whether it is correct or incorrect and why.\n"
+        "* Exactly one option is correct. End with: 'The correct answer is: [option letter]'.\n"
+    ),
+    "Multi-select": (
+        "* Analyse each option (A, B, C, D) against your working and state whether it is correct or incorrect and why.\n"
+        "* One or more options are correct. End with: 'The correct answers are: [option letters]'.\n"
+    ),
+    "options": (
+        "* Analyse each option (A, B, C, D) against your working and state whether it is correct or incorrect and why.\n"
+        "* Always choose from the given options. End with 'The correct answer is: [option letter]' for a single "
+        "answer or 'The correct answers are: [option letters]' for several.\n"
+    ),
+    "Numerical Question": "* End with the numerical answer and its units.\n",
+    "Open Ended Question": "* End with the answer as a short paragraph.\n",
+    "no options": "* End with the final answer: a value with its units, or a short paragraph.\n",
+}
+
+_MATRIX = (
+    "* Match each item of the first list with an item of the second list, stating the reasoning for each match.\n"
+    "* Give the matches as a list of tuples, for example `[('A', '1'), ('B', '2'), ('C', '3')]`.\n"
+)
+
+_PARAGRAPH = (
+    "* Use only the paragraph to answer each question, answering them one at a time under **Question 1:**, "
+    "**Question 2:** and so on.\n"
+    "* If the questions can't be told apart from the paragraph, treat the whole text as one question.\n"
+)
+
+
+def _given(text, empty_marker):
+    """
+    Returns the extracted section, or "" when it is missing or is the extraction prompt's "nothing found" marker.
+    """
+    text = (text or "").strip()
+    return "" if not text or empty_marker in text.lower() else text
+
+
+def build_solve_prompt(question, diagram, options, options_type, question_type):
+    """
+    Builds the DeepSeek solve prompt for an extracted question.
+
+    With PROMPT_STYLE "typed" and a recognised question type, the prompt carries only the context that was found
+    (diagram, options) and the answer instructions for that question and option type, which is a fraction of the
+    full prompt's size. The final answer formats are the same in both, so markdown_normalizer and
+    answer_postprocess handle either.
+    """
+    if PROMPT_STYLE != "typed" or question_type not in extraction_parser.QUESTION_TYPES:
+        return full_prompt(question, diagram, options, options_type, question_type)
+
+    diagram = _given(diagram, "no diagram found")
+    options = _given(options, "no options found") if options_type != "No options" else ""
+
+    context = []
+    if diagram:
+        context.append(f"**Diagram:**\n{diagram}\n\n")
+    if options:
+        context.append(f"**Options ({options_type}):**\n{options}\n\n" if options_type else f"**Options:**\n{options}\n\n")
+
+    instructions = []
+    if question_type == "Matrix Match Question":
+        instructions.append(_MATRIX)
+    elif question_type == "Paragraph Question":
+        instructions.append(_PARAGRAPH)
+    if options:
+        instructions.append(_ANSWER.get(options_type, _ANSWER["options"]))
+    elif question_type not in ("Matrix Match Question", "Paragraph Question"):
+        instructions.append(_ANSWER.get(question_type, _ANSWER["no options"]))
+
+    parts = [_INTRO] + context
+    parts.append(_FORMAT + "".join(instructions) + "\n")
+    parts.append(_CONSTRAINTS)
+    parts.append(f"**Question:** {question}")
+    return "".join(parts)
+
+
+def full_prompt(question, diagram, options, options_type, question_type):
+    """
+    The original prompt, with the instructions for every question type.
+    """
+    return (
+        "Solve the following problem step-by-step. Provide a detailed explanation of each step, including all necessary equations (if applicable).\n\n"
+        "**Context:**\n"
+        f"* Consider this diagram information when solving the question:\n"
+        f"    {diagram}\n"
+        f"* These are the possible answer options:\n"
+        f"    {options}\n"
+        f"* This is the option type for this question:\n"
+        f"    {options_type}\n"
+        f"* This is the question type:\n"
+        f"    {question_type}\n\n"
+        "**Format Instructions:**\n\n"
+        "*   **Equations:** Enclose all mathematical equations using the delimiter `$$...$$`. For example: $$E=mc^2$$\n"
+        "*   **Reasoning Step:** Before each step, clearly state the reasoning behind it, starting with 'Reasoning Step:'.\n"
+        "*  **Paragraph Question Logic:** If the question type is \"Paragraph Question\" use the following logic:\n"
+        "      * First extract the paragraph and questions from the question string, if this fails assume the question is the paragraph and there are no questions.\n"
+        "      * If extraction is successful:\n"
+        "        *  Try to extract the paragraph, if this fails assume the paragraph is an empty string\n"
+        "        *  Try to extract the questions, if this fails assume there are no questions.\n"
+        f"        * The paragraph is: {question.split('Paragraph:')[1].split('Questions:')[0].strip() if 'Paragraph:' in question and 'Questions:' in question else ''}\n"
+        f"        * The questions are: {question.split('Questions:')[1].strip() if 'Questions:' in question else ''}\n"
+        "       * For each question, use the paragraph for context.\n"
+        "        * Answer each question individually, using the paragraph to provide a response.\n"
+        "      * If extraction is unsuccessful:\n"
+        "        * Assume the question is the paragraph and there are no questions.\n\n"
+        "*   **Matrix Match Logic:** If the question type is \"Matrix Match Question\" use the following logic:\n"
+        "        *   Use a step-by-step approach, matching each item from the first list with the corresponding item from the second list.\n"
+        "        *  State your reasoning behind each match.\n"
+        "        *   Format your answer as a list of tuples, showing the matches. For example: `[('A', '1'), ('B', '2'), ('C', '3')]`\n"
+        "*   **Step-by-step:** Use a numbered list to structure the explanation of your solution process.\n"
+        "*   **Option Analysis:** If options (A, B, C, D) are provided:\n"
+        "    * For **single-select** questions, rigorously analyze each option using your calculations or reasoning. Clearly state whether each option is correct or incorrect and explain why. Select only one option.\n"
+        "    * For **multi-select** questions, analyze each option and explicitly state if it's correct or incorrect, explaining the reasoning. Select all correct options.\n"
+        "*   **Final Answer:**\n"
+        "    * For single select questions, when options are available, select one of the provided options as the final answer based on your analysis. State your answer using the format: 'The correct answer is: [option letter]'.\n"
+        "    * For multi select questions, list all of the correct options. State the answer using the format: 'The correct answers are: [option letters]'.\n"
+        "    * For matrix match questions, provide your answer as list of tuples.\n"
+        "    * For paragraph questions, answer each question individually.\n"
+        "    * For numerical questions provide the numerical answer along with the correct units.\n"
+        "    * For open ended questions, answer in a paragraph.\n\n"
+        "**Example Output Structure:**\n"
+        "**Assumptions:** [Assumptions made to solve the problem]\n"
+        "For Paragraph Questions:\n"
+        "    **Paragraph:** [Extracted paragraph]\n"
+        "    **Question 1:** [Answer to Question 1]\n"
+        "    **Question 2:** [Answer to Question 2]\n"
+        "    ...\n\n"
+        "For Matrix Match Questions:\n"
+        "    **Reasoning Step:** [Reasoning]\n"
+        "    **Steps:**\n"
+        "      1. [Explanation of Step 1]\n"
+        "      2. [Explanation of Step 2]\n"
+        "    **Final Answer:** [List of tuples]\n\n"
+        "For other questions:\n"
+        "    **Reasoning Step:** [Reasoning]\n"
+        "    **Steps:**\n"
+        "    1. [Explanation of Step 1 including equations or reasoning]\n\n"
+        "    **Reasoning Step:** [Reasoning]\n"
+        "    2. [Explanation of Step 2 including equations or reasoning]\n"
+        "    ...\n\n"
+        "    **Option Analysis Example:**\n"
+        "    A: [Correct or Incorrect, Explanation]\n"
+        "    B: [Correct or Incorrect, Explanation]\n"
+        "    C: [Correct or Incorrect, Explanation]\n"
+        "    D: [Correct or Incorrect, Explanation]\n\n"
+        "**Final Answer Example:**\n"
+        "   * Single Select Question: The correct answer is: [option letter]\n"
+        "   * Multi Select Question: The correct answers are: [option letters]\n"
+        "    * Matrix Match Question: [List of tuples]\n"
+        "    * Paragraph Question:  [Answer to each question]\n"
+        "   * Numerical Question: [Numerical Answer]\n"
+        "   * Open Ended Question: [Answer paragraph]\n\n"
+        "**Constraints:**\n"
+        "* Do not include any introductory or concluding remarks. Start directly with the solution.\n"
+        "* If multiple options are given always choose one or more of the given options.\n"
+        "* If no options are given, just solve the question without selecting an option.\n"
+        "* For Paragraph questions only use the given paragraph to answer each of the given questions.\n\n"
+        f"**Question:** {question}"
+    )
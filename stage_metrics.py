@@ -0,0 +1,132 @@
+import contextlib
+import cProfile
+import os
+import sys
+import threading
+import time
+
+PROFILE_DIR = os.getenv("OCR_PROFILE_DIR", "")
+
+# Stages of one solve, in pipeline order:
+#   fingerprint  decode and hash the upload for the result cache and near-duplicate lookup
+#   encode       preprocess and base64-encode the image for the vision model
+#   extract      Gemini extraction call and parse
+#   solve        DeepSeek solve call
+#   reformat     local markdown normalisation, or the Gemini reformat call when that fails
+STAGES = ("fingerprint", "encode", "extract", "solve", "reformat")
+
+_current = threading.local()
+
+
+class RequestMetrics:
+    """
+    Per-stage measurements for one request. Each stage maps to a dict of numbers that add up across calls, so a stage
+    that runs twice (or retries) reports its totals.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.seconds = None
+        self.stages = {}
+
+    def add(self, name, **values):
+        stage = self.stages.setdefault(name, {})
+        for key, value in values.items():
+            stage[key] = stage.get(key, 0) + value
+
+    def finish(self):
+        self.seconds = time.perf_counter() - self.start
+
+    def as_dict(self):
+        seconds = self.seconds if self.seconds is not None else time.perf_counter() - self.start
+        return {"seconds": seconds, "stages": self.stages}
+
+
+@contextlib.contextmanager
+def collect():
+    """
+    Collects the stages recorded by this thread into a new RequestMetrics until the block exits.
+    """
+    metrics = RequestMetrics()
+    with use(metrics):
+        try:
+            yield metrics
+        finally:
+            metrics.finish()
+
+
+@contextlib.contextmanager
+def use(metrics):
+    """
+    Records this thread's stages into an existing RequestMetrics until the block exits, for requests that move
+    between threads.
+    """
+    previous = getattr(_current, "metrics", None)
+    _current.metrics = metrics
+    try:
+        yield metrics
+    finally:
+        _current.metrics = previous
+
+
+def record(name, **values):
+    """
+    Adds values to a stage of the request being collected on this thread. Does nothing outside collect().
+    """
+    metrics = getattr(_current, "metrics", None)
+    if metrics is not None:
+        metrics.add(name, **values)
+
+
+@contextlib.contextmanager
+def stage(name):
+    """
+    Times the block as part of a stage.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, seconds=time.perf_counter() - start)
+
+
+def record_call(name, response, usage=None):
+    """
+    Records an OpenRouter call made by openrouter_client: wall time including rate-limit waits and retries, bytes
+    sent and received, and the prompt and completion tokens from the response's `usage` block.
+    """
+    timings = response.timings
+    values = {
+        "seconds": timings.queued + timings.total,
+        "queued": timings.queued,
+        "calls": 1,
+        "retries": timings.attempts - 1,
+        "request_bytes": timings.request_bytes,
+        "response_bytes": timings.response_bytes,
+    }
+    if usage:
+        values["prompt_tokens"] = usage.get("prompt_tokens") or 0
+        values["completion_tokens"] = usage.get("completion_tokens") or 0
+    record(name, **values)
+
+
+@contextlib.contextmanager
+def profile(request_id):
+    """
+    Profiles the block with cProfile and dumps the stats to OCR_PROFILE_DIR/<request_id>.prof when that is set.
+    """
+    if not PROFILE_DIR:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            safe_id = "".join(character if character.isalnum() or character in "-_" else "_" for character in str(request_id))
+            profiler.dump_stats(os.path.join(PROFILE_DIR, f"{safe_id}.prof"))
+        except OSError as e:
+            print(f"Warning: Could not write profile for {request_id}: {e}", file=sys.stderr)